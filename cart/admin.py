@@ -1,3 +1,30 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import Order, OrderLine, WebhookEvent
+
+
+class OrderLineInline(admin.TabularInline):
+    model = OrderLine
+    extra = 0
+    raw_id_fields = ('product',)
+
+
+@admin.register(Order)
+class OrderAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'metodo_pago', 'estado', 'total', 'created_at')
+    list_filter = ('estado', 'metodo_pago')
+    list_select_related = ('user',)
+    ordering = ('-created_at', '-id')
+    raw_id_fields = ('user',)
+    search_fields = ('=stripe_session_id',)
+    inlines = [OrderLineInline]
+    # Con millones de pedidos no se cuenta la tabla entera en cada listado
+    show_full_result_count = False
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ('event_id', 'type', 'received_at', 'processed_at')
+    search_fields = ('=event_id',)
+    ordering = ('-id',)
+    show_full_result_count = False
@@ -0,0 +1,96 @@
+"""
+Contador del carrito de la barra de navegación.
+
+``base.html`` lo muestra en todas las páginas, así que en lugar de sumar las
+cantidades en cada petición se guarda en la caché por usuario. Cualquier
+cambio en ``CartItem`` invalida la entrada (``cart.signals``); las escrituras
+masivas que no envían señales deben llamar a ``invalidate`` a mano.
+
+La clave del recuento lleva una generación por usuario que ``invalidate``
+incrementa. Quien calcula el recuento lee la generación antes de consultar
+la base de datos y lo guarda bajo esa generación: si otra petición cambia el
+carrito entre la consulta y el ``cache.set``, el recuento antiguo queda en
+una clave que ya nadie lee en lugar de sustituir al bueno.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum
+
+_deferred = ContextVar('cart_badge_deferred', default=False)
+
+
+def _generation_key(user_id):
+    return f'cart:count:gen:{user_id}'
+
+
+def _key(user_id, generation):
+    return f'cart:count:{user_id}:{generation}'
+
+
+def generation(user_id):
+    """Generación actual del contador; hay que leerla antes de consultar el carrito."""
+    key = _generation_key(user_id)
+    value = cache.get(key)
+    if value is None:
+        # Si la clave se ha expulsado se parte de un valor nuevo para no
+        # reutilizar recuentos que puedan seguir en caché
+        cache.add(key, time.time_ns(), None)
+        value = cache.get(key)
+    return value
+
+
+def cart_count(user_id):
+    from .models import CartItem
+
+    key = _key(user_id, generation(user_id))
+    count = cache.get(key)
+    if count is None:
+        count = CartItem.objects.filter(user_id=user_id).aggregate(
+            total_items=Sum('quantity'))['total_items'] or 0
+        cache.set(key, count, settings.CART_BADGE_TIMEOUT)
+    return count
+
+
+def remember(user_id, generation, count):
+    """
+    Guarda un recuento ya calculado (por ejemplo, al mostrar el carrito)
+    con la ``generation`` leída antes de la consulta.
+    """
+    cache.set(_key(user_id, generation), count, settings.CART_BADGE_TIMEOUT)
+
+
+def _bump(user_id):
+    try:
+        cache.incr(_generation_key(user_id))
+    except ValueError:
+        # Sin generación guardada no hay recuento que invalidar
+        pass
+
+
+@contextmanager
+def deferred():
+    """
+    Dentro del bloque, las señales de ``CartItem`` no invalidan el contador
+    fila a fila: quien borra en bloque llama a ``invalidate`` por usuario.
+    """
+    token = _deferred.set(True)
+    try:
+        yield
+    finally:
+        _deferred.reset(token)
+
+
+def is_deferred():
+    return _deferred.get()
+
+
+def invalidate(user_id):
+    _bump(user_id)
+    # Se repite al confirmar la transacción por si otra petición ha
+    # calculado el recuento anterior mientras tanto.
+    transaction.on_commit(lambda: _bump(user_id))
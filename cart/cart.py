@@ -0,0 +1,166 @@
+"""
+Carrito de la petición, con o sin sesión iniciada.
+
+Los usuarios identificados guardan su carrito en ``CartItem``. Los
+visitantes lo llevan en la sesión como ``{"product_id": cantidad}``, sin
+escribir nada en la tabla del carrito; al iniciar sesión o registrarse se
+vuelca con una sola sentencia (``merge_session_cart``).
+
+``get_cart(request)`` devuelve uno u otro con la misma interfaz, así que las
+vistas, la API JSON y el contador de la barra de navegación no distinguen
+entre ambos. ``update`` recibe ``{product_id: cantidad}`` con la cantidad
+final de cada línea (0 la quita) y devuelve los ids que no se han podido
+aplicar porque el producto no existe o el carrito está lleno.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum, Window
+from django.utils import timezone
+
+from products.models import Product
+
+from . import badge
+from .models import MAX_QUANTITY, CartItem
+
+SESSION_KEY = 'cart'
+# Límite para que la sesión siga siendo pequeña
+MAX_LINES = 50
+
+IMPORTE = DecimalField(max_digits=12, decimal_places=2)
+
+
+class CartLine:
+    """Línea del carrito de sesión, con los mismos atributos que ``CartItem``."""
+    __slots__ = ('product', 'quantity', 'line_total')
+
+    def __init__(self, product, quantity):
+        self.product = product
+        self.quantity = quantity
+        self.line_total = product.precio * quantity
+
+
+class DatabaseCart:
+    def __init__(self, user):
+        self.user = user
+
+    def add(self, product_id, quantity=1):
+        """Suma unidades del producto. Devuelve la cantidad resultante o None si no existe."""
+        return CartItem.objects.add(self.user.pk, product_id, quantity)
+
+    def update(self, cantidades):
+        borrar = [pk for pk, quantity in cantidades.items() if quantity == 0]
+        cambiar = {pk: quantity for pk, quantity in cantidades.items() if quantity > 0}
+        rechazados = set()
+        with transaction.atomic():
+            if borrar:
+                CartItem.objects.filter(user=self.user, product_id__in=borrar).delete()
+            items = list(CartItem.objects.filter(user=self.user, product_id__in=cambiar)
+                         .only('pk', 'product_id', 'quantity', 'updated_at'))
+            now = timezone.now()
+            for item in items:
+                item.quantity = cambiar.pop(item.product_id)
+                item.updated_at = now
+            # Todas las líneas existentes en un solo UPDATE
+            CartItem.objects.bulk_update(items, ['quantity', 'updated_at'])
+            if cambiar:
+                # Las que faltan se crean con el mismo INSERT ... ON CONFLICT
+                creadas = CartItem.objects.merge(self.user.pk, cambiar)
+                rechazados = set(cambiar) - set(creadas)
+        # bulk_update no envía señales
+        badge.invalidate(self.user.pk)
+        return rechazados
+
+    def count(self):
+        return badge.cart_count(self.user.pk)
+
+    def lines(self):
+        """``(líneas, total)`` con una sola consulta."""
+        # Líneas con su producto, el total de cada línea y, como función de
+        # ventana sobre todas las filas, el total del carrito
+        importe = ExpressionWrapper(F('quantity') * F('product__precio'), output_field=IMPORTE)
+        generation = badge.generation(self.user.pk)
+        items = list(
+            CartItem.objects.filter(user=self.user)
+            .select_related('product')
+            .only('quantity', 'product__nombre', 'product__precio')
+            .annotate(
+                line_total=importe,
+                cart_total=Window(Sum(importe), output_field=IMPORTE),
+                cart_count=Window(Sum('quantity')),
+            )
+            .order_by('created_at', 'id')
+        )
+        # De paso se deja al día el contador de la barra de navegación
+        badge.remember(self.user.pk, generation, items[0].cart_count if items else 0)
+        return items, items[0].cart_total if items else Decimal('0.00')
+
+
+class SessionCart:
+    def __init__(self, session):
+        self.session = session
+
+    def _data(self):
+        return self.session.get(SESSION_KEY, {})
+
+    def add(self, product_id, quantity=1):
+        data = dict(self._data())
+        key = str(product_id)
+        if key not in data and len(data) >= MAX_LINES:
+            return None
+        if not Product.objects.filter(pk=product_id).exists():
+            return None
+        data[key] = min(data.get(key, 0) + quantity, MAX_QUANTITY)
+        self.session[SESSION_KEY] = data
+        return data[key]
+
+    def update(self, cantidades):
+        data = dict(self._data())
+        nuevos = [pk for pk, quantity in cantidades.items() if quantity > 0 and str(pk) not in data]
+        existentes = set(Product.objects.filter(pk__in=nuevos).values_list('pk', flat=True)) if nuevos else set()
+        rechazados = set()
+        for pk, quantity in cantidades.items():
+            key = str(pk)
+            if quantity == 0:
+                data.pop(key, None)
+            elif key in data or (pk in existentes and len(data) < MAX_LINES):
+                data[key] = min(quantity, MAX_QUANTITY)
+            else:
+                rechazados.add(pk)
+        self.session[SESSION_KEY] = data
+        return rechazados
+
+    def count(self):
+        return sum(self._data().values())
+
+    def lines(self):
+        data = self._data()
+        if not data:
+            return [], Decimal('0.00')
+        productos = Product.objects.only('nombre', 'precio').in_bulk([int(pk) for pk in data])
+        # Se omiten los productos borrados desde que se añadieron
+        items = [CartLine(productos[int(pk)], quantity) for pk, quantity in data.items()
+                 if int(pk) in productos]
+        return items, sum((item.line_total for item in items), Decimal('0.00'))
+
+
+def get_cart(request):
+    if request.user.is_authenticated:
+        return DatabaseCart(request.user)
+    return SessionCart(request.session)
+
+
+def has_session_cart(request):
+    """True si el visitante anónimo tiene algo en el carrito de sesión."""
+    return bool(request.session.get(SESSION_KEY))
+
+
+def merge_session_cart(request, user):
+    """
+    Pasa el carrito de sesión a ``CartItem`` tras ``login()``, que conserva
+    los datos de la sesión anónima. Las cantidades se suman a las que el
+    usuario ya tuviera guardadas.
+    """
+    data = request.session.pop(SESSION_KEY, None)
+    if data:
+        CartItem.objects.merge(user.pk, {int(pk): quantity for pk, quantity in data.items()})
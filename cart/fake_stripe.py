@@ -0,0 +1,111 @@
+"""
+Servidor HTTP que imita la API de sesiones de Stripe para pruebas de carga.
+
+Responde a ``POST /v1/checkout/sessions`` con una sesión nueva tras una
+latencia configurable y respeta la cabecera ``Idempotency-Key``: la misma
+clave devuelve la misma sesión. Se usa con ``STRIPE_API_BASE``:
+
+    python manage.py fake_stripe --port 12111 --latency 0.3
+    STRIPE_API_BASE=http://127.0.0.1:12111 STRIPE_SECRET_KEY=sk_test_fake ...
+"""
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+class FakeStripeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0):
+        super().__init__(address, FakeStripeHandler)
+        self.latency = latency
+        self.sessions = {}
+        self.idempotency = {}
+        self.lock = threading.Lock()
+        self.created = 0
+
+    def handle_error(self, request, client_address):
+        # El cliente ha cortado la conexión (por ejemplo, por su timeout)
+        pass
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+
+class FakeStripeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Request-Id', f'req_{uuid.uuid4().hex[:14]}')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _not_found(self):
+        self._reply(404, {'error': {'type': 'invalid_request_error', 'message': 'No such resource'}})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        params = parse_qs(self.rfile.read(length).decode())
+        if self.path != '/v1/checkout/sessions':
+            return self._not_found()
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        key = self.headers.get('Idempotency-Key')
+        with server.lock:
+            session = server.idempotency.get(key) if key else None
+            if session is None:
+                session = self._session(params)
+                server.sessions[session['id']] = session
+                server.created += 1
+                if key:
+                    server.idempotency[key] = session
+        self._reply(200, session)
+
+    def do_GET(self):
+        prefix = '/v1/checkout/sessions/'
+        session = self.server.sessions.get(self.path[len(prefix):]) if self.path.startswith(prefix) else None
+        if session is None:
+            return self._not_found()
+        self._reply(200, session)
+
+    def _session(self, params):
+        total, i = 0, 0
+        while f'line_items[{i}][quantity]' in params:
+            total += (int(params[f'line_items[{i}][quantity]'][0])
+                      * int(params[f'line_items[{i}][price_data][unit_amount]'][0]))
+            i += 1
+        session_id = f'cs_test_{uuid.uuid4().hex}'
+        return {
+            'id': session_id,
+            'object': 'checkout.session',
+            'amount_total': total,
+            'currency': 'eur',
+            'mode': params.get('mode', ['payment'])[0],
+            'status': 'open',
+            'payment_status': 'unpaid',
+            'client_reference_id': params.get('client_reference_id', [None])[0],
+            'success_url': params.get('success_url', [''])[0],
+            'cancel_url': params.get('cancel_url', [''])[0],
+            'url': f'https://checkout.stripe.test/pay/{session_id}',
+            'livemode': False,
+        }
+
+
+def start(host='127.0.0.1', port=0, latency=0.0):
+    """Arranca el servidor en un hilo y lo devuelve (``server.url``, ``server.shutdown()``)."""
+    server = FakeStripeServer((host, port), latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,71 @@
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from cart import orders
+from cart.models import CartItem, Order, OrderLine
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = ('Mide cuántos pedidos por segundo se crean desde el carrito '
+            '(pedido, líneas con bulk_create y vaciado del carrito en una transacción)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=1000, help='Pedidos a crear')
+        parser.add_argument('--lines', type=int, default=3, help='Líneas en cada carrito')
+        parser.add_argument('--workers', type=int, default=1, help='Hilos que crean los pedidos')
+        parser.add_argument('--no-wal', action='store_true',
+                            help='En SQLite, no activa el modo WAL antes de medir')
+        parser.add_argument('--keep', action='store_true', help='No borra los datos de prueba')
+
+    def handle(self, *args, **options):
+        n, lines, workers = options['orders'], options['lines'], options['workers']
+        if connection.vendor == 'sqlite' and not options['no_wal']:
+            # El modo WAL es persistente: se queda activado en el fichero
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode=WAL')
+        prefix = f'bench-{uuid.uuid4().hex[:8]}'
+        products = Product.objects.bulk_create([
+            Product(nombre=f'{prefix} {i}', descripcion='', precio=10 + i) for i in range(lines)])
+        users = User.objects.bulk_create([User(username=f'{prefix}-{i}') for i in range(n)])
+        CartItem.objects.bulk_create([
+            CartItem(user=user, product=product, quantity=2) for user in users for product in products])
+
+        def checkout(user):
+            try:
+                return orders.create_from_cart(user, Order.CONTRAREEMBOLSO) is not None
+            finally:
+                if workers > 1:
+                    connections.close_all()
+
+        try:
+            start = time.monotonic()
+            if workers > 1:
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    results = list(pool.map(checkout, users))
+            else:
+                results = [checkout(user) for user in users]
+            elapsed = time.monotonic() - start
+
+            creados = Order.objects.filter(user__in=users).count()
+            lineas = OrderLine.objects.filter(order__user__in=users).count()
+            if creados != n or lineas != n * lines or not all(results):
+                raise CommandError(f'Se esperaban {n} pedidos y {n * lines} líneas; hay {creados} y {lineas}')
+            modo = ''
+            if connection.vendor == 'sqlite':
+                with connection.cursor() as cursor:
+                    cursor.execute('PRAGMA journal_mode')
+                    modo = f', journal_mode={cursor.fetchone()[0]}'
+            self.stdout.write(
+                f'{n} pedidos de {lines} líneas en {elapsed:.2f}s con {workers} hilos: '
+                f'{n / elapsed:.0f} pedidos/s ({connection.vendor}{modo})')
+        finally:
+            if not options['keep']:
+                Order.objects.filter(user__in=users).delete()
+                User.objects.filter(username__startswith=prefix).delete()
+                Product.objects.filter(pk__in=[product.pk for product in products]).delete()
@@ -0,0 +1,99 @@
+import logging
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import stripe
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.urls import reverse
+
+from cart import fake_stripe, payments
+from cart.models import CartItem, Order
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = ('Mide la creación de sesiones de pago contra un Stripe falso local: '
+            'primero con carritos nuevos y después repitiendo el clic (sesión reutilizada)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=100, help='Usuarios con carrito')
+        parser.add_argument('--workers', type=int, default=32, help='Peticiones simultáneas')
+        parser.add_argument('--latency', type=float, default=0.3, help='Latencia del Stripe falso (s)')
+        parser.add_argument('--keep', action='store_true', help='No borra los datos de prueba')
+
+    def handle(self, *args, **options):
+        buyers = options['buyers']
+        server = fake_stripe.start(latency=options['latency'])
+        api_base, api_key = stripe.api_base, stripe.api_key
+        stripe.api_base, stripe.api_key = server.url, api_key or 'sk_test_fake'
+        prefix = f'bench-{uuid.uuid4().hex[:8]}'
+        product = Product.objects.create(nombre=f'Prueba de carga {prefix}', descripcion='', precio=25)
+        url = reverse('create_checkout_session')
+        host = next((h.lstrip('.') for h in settings.ALLOWED_HOSTS if h != '*'), 'localhost')
+
+        def checkout(client):
+            start = time.monotonic()
+            try:
+                response = client.post(url)
+                ok = response.status_code == 200 and 'id' in response.json()
+            except Exception:
+                ok = False
+            finally:
+                connections.close_all()
+            return ok, time.monotonic() - start
+
+        def ronda(nombre, clients):
+            start = time.monotonic()
+            with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+                results = list(pool.map(checkout, clients))
+            elapsed = time.monotonic() - start
+            tiempos = sorted(t for _, t in results)
+            ok = sum(1 for success, _ in results if success)
+            self.stdout.write(
+                f'{nombre}: {len(clients)} peticiones en {elapsed:.2f}s ({len(clients) / elapsed:.0f}/s), '
+                f'{ok} con éxito, p50 {tiempos[len(tiempos) // 2] * 1000:.0f} ms, '
+                f'p99 {tiempos[int(len(tiempos) * 0.99)] * 1000:.0f} ms')
+            return ok
+
+        users = []
+        # Las peticiones rechazadas no deben llenar la salida de avisos
+        logging.getLogger('django.request').setLevel(logging.ERROR)
+        try:
+            users += [User.objects.create(username=f'{prefix}-{i}') for i in range(buyers)]
+            CartItem.objects.bulk_create([CartItem(user=user, product=product, quantity=1) for user in users])
+            clients = []
+            for user in users:
+                client = Client(HTTP_HOST=host)
+                client.force_login(user)
+                clients.append(client)
+
+            self.stdout.write(f'Stripe falso en {server.url} con {options["latency"]:.2f}s de latencia, '
+                              f'{settings.STRIPE_MAX_CONCURRENCY} llamadas simultáneas como máximo')
+            nuevas = ronda('Carritos nuevos', clients)
+            creadas = server.created
+            if nuevas != buyers:
+                self.stdout.write(self.style.WARNING(
+                    f'{buyers - nuevas} peticiones rechazadas: pool de Stripe lleno o timeout'))
+            # Cada usuario hace doble clic: las dos peticiones, a la vez,
+            # deben devolver la sesión que ya tiene
+            repetidas = ronda('Doble clic, mismo carrito', [c for client in clients for c in (client, client)])
+            self.stdout.write(f'Sesiones creadas en Stripe: {server.created} (antes del doble clic: {creadas})')
+            if server.created > buyers:
+                raise CommandError(f'Se han creado {server.created - buyers} sesiones de más')
+            if repetidas != 2 * buyers:
+                raise CommandError(f'{2 * buyers - repetidas} dobles clics sin sesión')
+        finally:
+            stripe.api_base, stripe.api_key = api_base, api_key
+            server.shutdown()
+            server.server_close()
+            for user in users:
+                payments.forget(user.pk)
+            if not options['keep']:
+                Order.objects.filter(user__username__startswith=prefix).delete()
+                User.objects.filter(username__startswith=prefix).delete()
+                product.delete()
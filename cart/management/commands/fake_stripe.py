@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from cart.fake_stripe import FakeStripeServer
+
+
+class Command(BaseCommand):
+    help = 'Servidor local que imita la API de sesiones de Stripe para pruebas de carga'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=12111)
+        parser.add_argument('--latency', type=float, default=0.3,
+                            help='Segundos que tarda en responder cada sesión')
+
+    def handle(self, *args, **options):
+        server = FakeStripeServer((options['host'], options['port']), options['latency'])
+        self.stdout.write(f'Stripe falso en {server.url} (STRIPE_API_BASE={server.url})')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f'{server.created} sesiones creadas')
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from cart import orders, webhooks
+
+
+class Command(BaseCommand):
+    help = ('Procesa la cola de eventos de Stripe: marca pedidos como pagados, vacía los carritos '
+            'y cancela los pedidos con tarjeta cuya sesión ha caducado')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Eventos por transacción')
+        parser.add_argument('--once', action='store_true', help='Vacía la cola y termina')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Segundos de espera cuando la cola está vacía')
+
+    def handle(self, *args, **options):
+        total = caducados = 0
+        try:
+            while True:
+                procesados = webhooks.process_pending(options['batch_size'])
+                total += procesados
+                if procesados:
+                    continue
+                # Con la cola vacía se devuelve el stock de las sesiones
+                # caducadas de las que no ha llegado el webhook
+                caducados += orders.expire_pending()
+                if options['once']:
+                    break
+                # Sin trabajo: no se mantiene abierta la conexión mientras se espera
+                connection.close()
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(f'{total} eventos procesados, {caducados} pedidos caducados cancelados')
@@ -0,0 +1,38 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from cart.models import CartItem
+
+
+class Command(BaseCommand):
+    help = ('Borra los carritos abandonados (sin cambios en los últimos días) '
+            'por rangos de id, con transacciones cortas')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.CART_STALE_DAYS,
+                            help='Días sin cambios en el carrito para considerar abandonado un carrito')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Ids por transacción')
+        parser.add_argument('--sleep', type=float, default=0.0,
+                            help='Segundos de pausa entre lotes para no competir con el tráfico')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        batch_size = options['batch_size']
+        # Límites fijados al empezar: lo que se añada mientras tanto no es antiguo
+        rango = CartItem.objects.aggregate(inicio=Min('pk'), fin=Max('pk'))
+        borrados = 0
+        start = time.monotonic()
+        if rango['inicio'] is not None:
+            for desde in range(rango['inicio'], rango['fin'] + 1, batch_size):
+                borrados += CartItem.objects.purge_stale(cutoff, desde, desde + batch_size)
+                if options['sleep']:
+                    time.sleep(options['sleep'])
+        elapsed = time.monotonic() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'{borrados} líneas de carrito borradas en {elapsed:.2f}s '
+            f'({borrados / elapsed if elapsed else 0:.0f} líneas/s)'))
@@ -0,0 +1,69 @@
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.urls import reverse
+
+from cart.models import MAX_QUANTITY, CartItem
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = ('Lanza clics simultáneos de "añadir al carrito" sobre el mismo producto '
+            'y comprueba que no se pierde ningún incremento')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clicks', type=int, default=500, help='Peticiones en total')
+        parser.add_argument('--workers', type=int, default=32, help='Hilos que lanzan las peticiones')
+        parser.add_argument('--users', type=int, default=10, help='Usuarios que comparten el producto')
+        parser.add_argument('--quantity', type=int, default=1, help='Unidades en cada clic')
+        parser.add_argument('--keep', action='store_true', help='No borra los datos de prueba')
+
+    def handle(self, *args, **options):
+        prefix = f'stress-{uuid.uuid4().hex[:8]}'
+        host = next((h.lstrip('.') for h in settings.ALLOWED_HOSTS if h != '*'), 'localhost')
+        product = Product.objects.create(nombre=f'Prueba de carga {prefix}', descripcion='', precio=1)
+        url = reverse('add_to_cart', args=[product.pk])
+        try:
+            clients = []
+            for i in range(options['users']):
+                client = Client(HTTP_HOST=host)
+                client.force_login(User.objects.create(username=f'{prefix}-{i}'))
+                clients.append(client)
+
+            def click(n):
+                try:
+                    response = clients[n % len(clients)].post(url, {'quantity': options['quantity']})
+                    return response.status_code == 302
+                except Exception:
+                    return False
+                finally:
+                    connections.close_all()
+
+            start = time.monotonic()
+            with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+                results = list(pool.map(click, range(options['clicks'])))
+            elapsed = time.monotonic() - start
+
+            ok = sum(results)
+            lineas = list(CartItem.objects.filter(product=product).values_list('user_id', 'quantity'))
+            total = sum(quantity for _, quantity in lineas)
+            self.stdout.write(
+                f'{options["clicks"]} clics en {elapsed:.2f}s ({options["clicks"] / elapsed:.0f} clics/s): '
+                f'{ok} con éxito, {len(lineas)} líneas, {total} unidades')
+            # Cada línea se queda en MAX_QUANTITY aunque sus clics sumen más
+            esperado = sum(
+                min(len(range(i, options['clicks'], len(clients))) * options['quantity'], MAX_QUANTITY)
+                for i in range(len(clients)))
+            if total != esperado or len(lineas) != len(clients) or ok != options['clicks']:
+                raise CommandError('Se han perdido incrementos o hay líneas duplicadas')
+            self.stdout.write(self.style.SUCCESS('Sin incrementos perdidos.'))
+        finally:
+            if not options['keep']:
+                User.objects.filter(username__startswith=prefix).delete()
+                product.delete()
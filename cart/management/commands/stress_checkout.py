@@ -0,0 +1,78 @@
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.urls import reverse
+
+from cart.models import CartItem
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = ('Lanza compras contrareembolso en paralelo sobre un producto con stock limitado '
+            'y comprueba que no se vende más de lo que hay')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=200, help='Compradores simultáneos')
+        parser.add_argument('--workers', type=int, default=32, help='Hilos que lanzan las compras')
+        parser.add_argument('--stock', type=int, default=50, help='Stock inicial del producto')
+        parser.add_argument('--quantity', type=int, default=1, help='Unidades en cada carrito')
+        parser.add_argument('--keep', action='store_true', help='No borra los datos de prueba')
+
+    def handle(self, *args, **options):
+        buyers, quantity, stock = options['buyers'], options['quantity'], options['stock']
+        prefix = f'stress-{uuid.uuid4().hex[:8]}'
+        product = Product.objects.create(
+            nombre=f'Prueba de carga {prefix}', descripcion='', precio=1, stock=stock)
+        url = reverse('checkout_cod')
+        host = next((h.lstrip('.') for h in settings.ALLOWED_HOSTS if h != '*'), 'localhost')
+
+        def checkout(client):
+            try:
+                response = client.post(url)
+                if response.status_code != 302:
+                    return 'error'
+                return 'ok' if response.url == reverse('home') else 'agotado'
+            except Exception:
+                return 'error'
+            finally:
+                connections.close_all()
+
+        try:
+            # Usuarios, carritos y sesiones se crean antes para medir solo las compras
+            users = [User.objects.create(username=f'{prefix}-{i}') for i in range(buyers)]
+            CartItem.objects.bulk_create([
+                CartItem(user=user, product=product, quantity=quantity) for user in users])
+            clients = []
+            for user in users:
+                client = Client(HTTP_HOST=host)
+                client.force_login(user)
+                clients.append(client)
+
+            start = time.monotonic()
+            with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+                results = list(pool.map(checkout, clients))
+            elapsed = time.monotonic() - start
+
+            ok, agotados = results.count('ok'), results.count('agotado')
+            errores = buyers - ok - agotados
+            final = Product.objects.values_list('stock', flat=True).get(pk=product.pk)
+            pending = CartItem.objects.filter(product=product).count()
+            self.stdout.write(
+                f'{buyers} compras en {elapsed:.2f}s ({buyers / elapsed:.0f} compras/s): '
+                f'{ok} con éxito, {agotados} sin stock, {errores} con errores; stock final {final}')
+            expected = min(buyers, stock // quantity)
+            if final != stock - ok * quantity or pending != buyers - ok or ok != expected or errores:
+                raise CommandError(
+                    f'Inconsistencia: {ok} compras con éxito (esperadas {expected}), {errores} errores, '
+                    f'stock final {final}, {pending} carritos sin procesar')
+            self.stdout.write(self.style.SUCCESS('Sin sobreventa.'))
+        finally:
+            if not options['keep']:
+                User.objects.filter(username__startswith=prefix).delete()
+                product.delete()
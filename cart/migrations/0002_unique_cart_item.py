@@ -0,0 +1,41 @@
+# Generated by Django 5.1.15 on 2026-10-18 07:24
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def fusionar_duplicados(apps, schema_editor):
+    # Antes de la restricción única, las líneas repetidas de un mismo
+    # producto se suman en la más antigua
+    CartItem = apps.get_model("cart", "CartItem")
+    duplicados = (
+        CartItem.objects.values("user_id", "product_id")
+        .annotate(filas=Count("id"), primera=Min("id"), total=Sum("quantity"))
+        .filter(filas__gt=1)
+    )
+    for grupo in duplicados:
+        lineas = CartItem.objects.filter(
+            user_id=grupo["user_id"], product_id=grupo["product_id"]
+        )
+        lineas.exclude(id=grupo["primera"]).delete()
+        lineas.filter(id=grupo["primera"]).update(quantity=grupo["total"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("cart", "0001_initial"),
+        ("products", "0009_product_stock"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(fusionar_duplicados, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="cartitem",
+            constraint=models.UniqueConstraint(
+                fields=("user", "product"), name="unique_cart_item"
+            ),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.1.15 on 2026-10-18 07:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("cart", "0003_orders"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="stripe_session_id",
+            field=models.CharField(blank=True, max_length=255, null=True, unique=True),
+        ),
+        migrations.CreateModel(
+            name="WebhookEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("event_id", models.CharField(max_length=255, unique=True)),
+                ("type", models.CharField(max_length=100)),
+                ("payload", models.JSONField()),
+                ("received_at", models.DateTimeField(auto_now_add=True)),
+                ("processed_at", models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("processed_at__isnull", True)),
+                        fields=["id"],
+                        name="webhook_pending_idx",
+                    )
+                ],
+            },
+        ),
+    ]
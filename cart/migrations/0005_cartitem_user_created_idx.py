@@ -0,0 +1,22 @@
+# Generated by Django 5.1.15 on 2026-10-18 07:53
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("cart", "0004_stripe_webhooks"),
+        ("products", "0009_product_stock"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="cartitem",
+            index=models.Index(
+                fields=["user", "created_at"], name="cartitem_user_created_idx"
+            ),
+        ),
+    ]
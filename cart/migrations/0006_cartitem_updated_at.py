@@ -0,0 +1,40 @@
+# Generated by Django 5.1.15 on 2026-10-18 08:30
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copiar_created_at(apps, schema_editor):
+    # Las líneas existentes no se han tocado desde que se añadieron; con la
+    # fecha de la migración parecerían recientes
+    CartItem = apps.get_model("cart", "CartItem")
+    CartItem.objects.update(updated_at=F("created_at"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("cart", "0005_cartitem_user_created_idx"),
+        ("products", "0009_product_stock"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="cartitem",
+            name="cartitem_user_created_idx",
+        ),
+        migrations.AddField(
+            model_name="cartitem",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(copiar_created_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="cartitem",
+            index=models.Index(
+                fields=["user", "updated_at"], name="cartitem_user_updated_idx"
+            ),
+        ),
+    ]
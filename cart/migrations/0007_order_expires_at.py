@@ -0,0 +1,28 @@
+# Generated by Django 5.1.15 on 2026-10-18 08:38
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("cart", "0006_cartitem_updated_at"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="expires_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                condition=models.Q(("estado", "pendiente")),
+                fields=["expires_at"],
+                name="order_pending_expires_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.15 on 2026-10-18 08:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("cart", "0007_order_expires_at"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="order",
+            name="estado",
+            field=models.CharField(
+                choices=[
+                    ("pendiente", "Pendiente de pago"),
+                    ("pagado", "Pagado"),
+                    ("cancelado", "Cancelado"),
+                    ("revision", "Pagado, pendiente de revisión"),
+                ],
+                default="pendiente",
+                max_length=20,
+            ),
+        ),
+    ]
@@ -1,12 +1,235 @@
 from django.db import models
 from django.contrib.auth.models import User
 from products.models import Product
+from django.db import IntegrityError, connection, transaction
+from django.db.models.functions import Least
+from django.utils import timezone
+from . import badge
+
+# Unidades máximas de un producto en el carrito
+MAX_QUANTITY = 99
+
+
+def product_id_in_range(product_id):
+    """
+    True si ``product_id`` cabe en la columna del id. El SQL directo no pasa
+    por la comprobación del ORM y un id enorme daría ``OverflowError``.
+    """
+    minimo, maximo = connection.ops.integer_field_range(Product._meta.pk.get_internal_type())
+    return (minimo is None or product_id >= minimo) and (maximo is None or product_id <= maximo)
+
+
+class CartItemManager(models.Manager):
+    def add(self, user_id, product_id, quantity=1):
+        """
+        Suma ``quantity`` unidades del producto al carrito en una sola
+        sentencia (INSERT ... ON CONFLICT DO UPDATE), sin perder incrementos
+        con clics simultáneos. Devuelve la cantidad resultante, o None si el
+        producto no existe.
+        """
+        if not product_id_in_range(product_id):
+            return None
+        quantity = min(quantity, MAX_QUANTITY)
+        # El SQL directo no envía señales: el contador se invalida aquí
+        badge.invalidate(user_id)
+        if connection.vendor in ('sqlite', 'postgresql'):
+            rows = self._upsert(user_id, {product_id: quantity})
+            return rows[0][1] if rows else None
+        # Otros motores: UPDATE con F() y, si no hay fila, INSERT
+        if self.filter(user_id=user_id, product_id=product_id).update(
+                quantity=Least(models.F('quantity') + quantity, MAX_QUANTITY), updated_at=timezone.now()):
+            return self.values_list('quantity', flat=True).get(user_id=user_id, product_id=product_id)
+        if not Product.objects.filter(pk=product_id).exists():
+            return None
+        try:
+            with transaction.atomic():
+                return self.create(user_id=user_id, product_id=product_id, quantity=quantity).quantity
+        except IntegrityError:
+            return self.add(user_id, product_id, quantity)
+
+    def merge(self, user_id, cantidades):
+        """
+        Suma al carrito del usuario varias líneas ``{product_id: cantidad}``
+        con una única sentencia. Los productos que ya no existen se ignoran.
+        Devuelve ``{product_id: cantidad_resultante}``.
+        """
+        cantidades = {product_id: min(quantity, MAX_QUANTITY) for product_id, quantity in cantidades.items()
+                      if product_id_in_range(product_id)}
+        if not cantidades:
+            return {}
+        badge.invalidate(user_id)
+        if connection.vendor in ('sqlite', 'postgresql'):
+            return dict(self._upsert(user_id, cantidades))
+        resultado = {}
+        for product_id, quantity in cantidades.items():
+            total = self.add(user_id, product_id, quantity)
+            if total is not None:
+                resultado[product_id] = total
+        return resultado
+
+    def purge_stale(self, cutoff, start, stop):
+        """
+        Borra los carritos abandonados (ninguna línea añadida ni cambiada
+        desde ``cutoff``) con ``start <= id < stop`` y devuelve cuántas
+        líneas ha borrado. El rango acota cada transacción; la comprobación
+        de que el usuario no ha tocado el carrito después usa el índice
+        (user, updated_at).
+        """
+        reciente = self.filter(user_id=models.OuterRef('user_id'), updated_at__gte=cutoff)
+        stale = self.filter(pk__gte=start, pk__lt=stop, updated_at__lt=cutoff).exclude(models.Exists(reciente))
+        with transaction.atomic():
+            users = set(stale.values_list('user_id', flat=True))
+            if not users:
+                return 0
+            # Las señales no invalidan el contador fila a fila: se hace
+            # una vez por usuario
+            with badge.deferred():
+                borrados, _ = stale.delete()
+            for user_id in users:
+                badge.invalidate(user_id)
+        return borrados
+
+    def _upsert(self, user_id, cantidades):
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        ids = list(cantidades)
+        # La cantidad de cada producto sale de un CASE sobre su id y el
+        # INSERT ... SELECT no inserta nada para los productos que no existen
+        casos = ' '.join('WHEN %s THEN %s' for _ in ids)
+        # La suma nunca pasa de MAX_QUANTITY, igual que en el carrito de sesión
+        minimo = 'MIN' if connection.vendor == 'sqlite' else 'LEAST'
+        sql = (
+            f'INSERT INTO {table} ({qn("user_id")}, {qn("product_id")}, {qn("quantity")}, '
+            f'{qn("created_at")}, {qn("updated_at")}) '
+            f'SELECT %s, {qn("id")}, CASE {qn("id")} {casos} END, %s, %s FROM {qn(Product._meta.db_table)} '
+            f'WHERE {qn("id")} IN ({", ".join(["%s"] * len(ids))}) '
+            f'ON CONFLICT ({qn("user_id")}, {qn("product_id")}) '
+            f'DO UPDATE SET {qn("quantity")} = {minimo}({table}.{qn("quantity")} + excluded.{qn("quantity")}, %s), '
+            f'{qn("updated_at")} = excluded.{qn("updated_at")} '
+            f'RETURNING {qn("product_id")}, {qn("quantity")}'
+        )
+        params = [user_id]
+        for product_id in ids:
+            params += [product_id, cantidades[product_id]]
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        params += [now, now]
+        params += ids
+        params.append(MAX_QUANTITY)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
 
 class CartItem(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
     created_at = models.DateTimeField(auto_now_add=True)
-    
+    # Último cambio de la línea; con él se decide si el carrito está abandonado
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = CartItemManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='unique_cart_item'),
+        ]
+        indexes = [
+            # Limpieza de carritos abandonados (purge_stale_carts)
+            models.Index(fields=['user', 'updated_at'], name='cartitem_user_updated_idx'),
+        ]
+
     def get_total(self):
         return self.product.precio * self.quantity
+
+
+class OrderQuerySet(models.QuerySet):
+    def for_user(self, user):
+        """Pedidos del usuario, los más recientes primero (índice order_user_created_idx)."""
+        return self.filter(user=user).order_by('-created_at', '-id')
+
+
+class Order(models.Model):
+    CONTRAREEMBOLSO = 'contrareembolso'
+    TARJETA = 'tarjeta'
+    METODOS_PAGO = [
+        (CONTRAREEMBOLSO, 'Contrareembolso'),
+        (TARJETA, 'Tarjeta'),
+    ]
+    PENDIENTE = 'pendiente'
+    PAGADO = 'pagado'
+    CANCELADO = 'cancelado'
+    # Pagado después de cancelarse y sin stock para servirlo: hay que
+    # revisarlo a mano o reembolsarlo
+    REVISION = 'revision'
+    ESTADOS = [
+        (PENDIENTE, 'Pendiente de pago'),
+        (PAGADO, 'Pagado'),
+        (CANCELADO, 'Cancelado'),
+        (REVISION, 'Pagado, pendiente de revisión'),
+    ]
+
+    # Los pedidos se conservan aunque se borre el usuario
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='orders')
+    metodo_pago = models.CharField(max_length=20, choices=METODOS_PAGO)
+    estado = models.CharField(max_length=20, choices=ESTADOS, default=PENDIENTE)
+    total = models.DecimalField(max_digits=12, decimal_places=2)
+    # Sesión de Stripe de los pedidos con tarjeta; el webhook la usa para
+    # marcar el pedido como pagado
+    stripe_session_id = models.CharField(max_length=255, unique=True, null=True, blank=True)
+    # Fin de la reserva de stock de un pedido con tarjeta pendiente; es
+    # también el expires_at de su sesión de Stripe
+    expires_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # "Mis pedidos": filtro por usuario y orden por fecha sin ordenar en memoria
+            models.Index(fields=['user', '-created_at', '-id'], name='order_user_created_idx'),
+            # Listado del admin, ordenado por fecha y filtrable por estado
+            models.Index(fields=['-created_at', '-id'], name='order_created_idx'),
+            models.Index(fields=['estado', '-created_at'], name='order_estado_created_idx'),
+            # Reservas caducadas (orders.expire_pending)
+            models.Index(fields=['expires_at'], condition=models.Q(estado='pendiente'),
+                         name='order_pending_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f'Pedido {self.pk}'
+
+
+class OrderLine(models.Model):
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='lines')
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True)
+    # Copia del producto en el momento de la compra
+    nombre = models.CharField(max_length=100)
+    precio = models.DecimalField(max_digits=10, decimal_places=2)
+    quantity = models.PositiveIntegerField()
+
+    def get_total(self):
+        return self.precio * self.quantity
+
+
+class WebhookEvent(models.Model):
+    """
+    Cola persistente de eventos de Stripe. El webhook solo inserta la fila
+    (``event_id`` es único, así que un reenvío no hace nada) y
+    ``process_webhooks`` los procesa por lotes.
+    """
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Solo los pendientes, en orden de llegada
+            models.Index(fields=['id'], condition=models.Q(processed_at__isnull=True),
+                         name='webhook_pending_idx'),
+        ]
+
+    def __str__(self):
+        return self.event_id
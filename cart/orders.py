@@ -0,0 +1,111 @@
+"""
+Creación de pedidos a partir del carrito.
+
+En una sola transacción se leen las líneas del carrito con el nombre y el
+precio actuales del producto, se crea el ``Order``, se insertan todas sus
+``OrderLine`` con un único ``bulk_create`` y se vacía el carrito. Si algo
+falla no queda ni el pedido a medias ni el carrito vacío.
+
+Los pagos con tarjeta reservan el stock y guardan el pedido pendiente en la
+misma transacción antes de ir a Stripe (``create_reserved``): la reserva son
+las líneas del pedido, no una entrada de la caché. El carrito se vacía
+cuando llega la confirmación por webhook (``cart.webhooks``); si la sesión
+caduca sin pagarse, ``cancel`` devuelve el stock.
+"""
+from django.db import connection, transaction
+from django.utils import timezone
+
+from products import inventory
+
+from .models import CartItem, Order, OrderLine
+
+# Pedidos por transacción al cancelar reservas caducadas
+EXPIRE_BATCH_SIZE = 500
+
+
+def create_from_cart(user, metodo_pago, estado=Order.PENDIENTE, reserve_stock=True):
+    """
+    Convierte el carrito de ``user`` en un pedido y lo devuelve, o None si
+    el carrito está vacío. Con ``reserve_stock`` descuenta también el stock
+    en la misma transacción (lanza ``inventory.StockError`` si falta).
+    """
+    with transaction.atomic():
+        items = list(
+            CartItem.objects.filter(user=user)
+            .order_by('created_at', 'id')
+            .values_list('pk', 'product_id', 'quantity', 'product__nombre', 'product__precio')
+        )
+        if not items:
+            return None
+        if reserve_stock:
+            inventory.reserve((product_id, quantity) for _, product_id, quantity, _, _ in items)
+        order = create(user, [row[1:] for row in items], metodo_pago, estado)
+        CartItem.objects.filter(pk__in=[pk for pk, _, _, _, _ in items]).delete()
+    return order
+
+
+def create(user, lines, metodo_pago, estado=Order.PENDIENTE, stripe_session_id=None, expires_at=None):
+    """
+    Guarda un pedido con ``lines`` (tuplas ``(product_id, cantidad, nombre,
+    precio)``) sin tocar el carrito.
+    """
+    with transaction.atomic():
+        order = Order.objects.create(
+            user=user,
+            metodo_pago=metodo_pago,
+            estado=estado,
+            total=sum(precio * quantity for _, quantity, _, precio in lines),
+            stripe_session_id=stripe_session_id,
+            expires_at=expires_at,
+        )
+        OrderLine.objects.bulk_create([
+            OrderLine(order=order, product_id=product_id, nombre=nombre, precio=precio, quantity=quantity)
+            for product_id, quantity, nombre, precio in lines
+        ])
+    return order
+
+
+def create_reserved(user, lines, metodo_pago, expires_at):
+    """
+    Reserva el stock de ``lines`` y guarda el pedido pendiente que lo
+    retiene hasta ``expires_at``, en una transacción. Lanza
+    ``inventory.StockError`` sin guardar nada si falta stock.
+    """
+    with transaction.atomic():
+        inventory.reserve((product_id, quantity) for product_id, quantity, _, _ in lines)
+        return create(user, lines, metodo_pago, expires_at=expires_at)
+
+
+def cancel(queryset):
+    """
+    Cancela los pedidos pendientes de ``queryset`` y devuelve su stock.
+    Solo se libera el de los pedidos que pasan aquí de pendiente a
+    cancelado, así que dos llamadas a la vez no lo devuelven dos veces.
+    Devuelve cuántos pedidos ha cancelado.
+    """
+    with transaction.atomic():
+        pendientes = queryset.filter(estado=Order.PENDIENTE)
+        if connection.features.has_select_for_update:
+            pendientes = pendientes.select_for_update()
+        ids = list(pendientes.values_list('pk', flat=True))
+        if not ids:
+            return 0
+        Order.objects.filter(pk__in=ids).update(estado=Order.CANCELADO)
+        inventory.release(
+            OrderLine.objects.filter(order_id__in=ids, product__isnull=False).values_list('product_id', 'quantity'))
+    return len(ids)
+
+
+def expire_pending(batch_size=EXPIRE_BATCH_SIZE):
+    """
+    Cancela los pedidos con tarjeta cuya sesión de Stripe ha caducado sin
+    pagarse y devuelve cuántos. Los contrareembolso no tienen ``expires_at``.
+    """
+    now = timezone.now()
+    caducados = Order.objects.filter(estado=Order.PENDIENTE, expires_at__lt=now).order_by('expires_at')
+    total = 0
+    while True:
+        ids = list(caducados.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return total
+        total += cancel(Order.objects.filter(pk__in=ids))
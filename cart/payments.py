@@ -0,0 +1,245 @@
+"""
+Sesiones de pago de Stripe.
+
+La llamada a Stripe se hace en un pool de hilos acotado
+(``STRIPE_MAX_CONCURRENCY``) y la petición espera como mucho
+``STRIPE_TIMEOUT`` segundos. Si el pool está lleno, la petición espera un
+hueco ``STRIPE_QUEUE_TIMEOUT`` segundos y después se rechaza, en lugar de
+acumular workers esperando a Stripe.
+
+La sesión creada se guarda en la caché con un hash del contenido del
+carrito: mientras el carrito no cambie, los siguientes clics en "Pagar con
+tarjeta" reutilizan la misma sesión sin volver a reservar stock ni llamar a
+Stripe. Un cerrojo en la caché hace que un doble clic espere a la primera
+petición en lugar de crear otra sesión, y la clave de idempotencia evita
+duplicados si la librería reintenta la llamada.
+
+La reserva de stock de cada sesión vive en su ``Order`` pendiente, que se
+guarda en la misma transacción que la reserva antes de llamar a Stripe; la
+caché solo sirve para no repetir la llamada. La sesión se crea con
+``expires_at`` igual al del pedido: si el cliente no paga, el webhook
+``checkout.session.expired`` o ``orders.expire_pending`` cancelan el pedido y
+devuelven el stock. ``cart.webhooks`` lo marca como pagado y vacía el
+carrito cuando Stripe confirma el pago.
+
+Con ``STRIPE_API_BASE`` apuntando a ``fake_stripe`` se pueden hacer pruebas
+de carga sin conectarse a Stripe.
+"""
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from datetime import timedelta
+from functools import partial
+
+import stripe
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.utils import timezone
+
+from products import inventory
+
+from . import orders
+from .models import CartItem, Order
+
+stripe.api_key = settings.STRIPE_SECRET_KEY
+stripe.max_network_retries = settings.STRIPE_MAX_RETRIES
+stripe.default_http_client = stripe.new_default_http_client(timeout=settings.STRIPE_TIMEOUT)
+if settings.STRIPE_API_BASE:
+    stripe.api_base = settings.STRIPE_API_BASE
+
+# Intervalo con el que un doble clic comprueba si la primera petición ha terminado
+WAIT_INTERVAL = 0.05
+
+
+class PaymentError(Exception):
+    """Error que se muestra al cliente; ``status`` es el código HTTP de la respuesta."""
+
+    def __init__(self, message, status=200):
+        self.status = status
+        super().__init__(message)
+
+
+_executor = None
+_slots = None
+_executor_lock = threading.Lock()
+
+
+def _pool():
+    global _executor, _slots
+    with _executor_lock:
+        if _executor is None:
+            _slots = threading.BoundedSemaphore(settings.STRIPE_MAX_CONCURRENCY)
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.STRIPE_MAX_CONCURRENCY, thread_name_prefix='stripe')
+    return _executor, _slots
+
+
+def _key(user_id):
+    return f'stripe:checkout:{user_id}'
+
+
+def _lock_key(user_id):
+    return f'stripe:checkout:lock:{user_id}'
+
+
+def _lock_timeout():
+    # Lo que puede tardar la llamada con todos sus reintentos
+    return int(settings.STRIPE_TIMEOUT * (settings.STRIPE_MAX_RETRIES + 1)) + 1
+
+
+def cart_hash(items, *urls):
+    contenido = hashlib.sha256()
+    for item in items:
+        contenido.update(f'{item.product_id}:{item.quantity}:{item.product.precio}|'.encode())
+    for url in urls:
+        contenido.update(url.encode())
+    return contenido.hexdigest()[:32]
+
+
+def line_items(items):
+    return [{
+        'price_data': {
+            'currency': 'eur',
+            'product_data': {
+                'name': item.product.nombre,
+            },
+            'unit_amount': int(item.product.precio * 100),
+        },
+        'quantity': item.quantity,
+    } for item in items]
+
+
+def _create(params, idempotency_key):
+    return stripe.checkout.Session.create(**params, idempotency_key=idempotency_key)
+
+
+def _pending(user_id):
+    return Order.objects.filter(user_id=user_id, metodo_pago=Order.TARJETA, estado=Order.PENDIENTE)
+
+
+def _remember(user, digest, session_id, order_id, expires_at, saved=True):
+    # La entrada nunca dura más que la sesión de Stripe
+    timeout = min(settings.STRIPE_SESSION_CACHE_TIMEOUT, (expires_at - timezone.now()).total_seconds())
+    if timeout <= 0:
+        return
+    cache.set(_key(user.pk), {
+        'hash': digest, 'id': session_id, 'order': order_id, 'expires_at': expires_at, 'saved': saved,
+    }, timeout)
+
+
+def _finish_late(user, digest, order_id, expires_at, request_thread, future):
+    """Termina una llamada que la petición dejó de esperar por el timeout."""
+    try:
+        if future.exception() is None:
+            # El siguiente clic reutilizará la sesión y la guardará en su
+            # pedido; el cliente no puede pagarla antes porque no tiene el id
+            _remember(user, digest, future.result().id, order_id, expires_at, saved=False)
+        else:
+            orders.cancel(Order.objects.filter(pk=order_id))
+    finally:
+        cache.delete(_lock_key(user.pk))
+        if threading.get_ident() != request_thread:
+            connection.close()
+
+
+def _wait(user_id, digest):
+    """Espera a la sesión que está creando otra petición del mismo usuario."""
+    deadline = time.monotonic() + settings.STRIPE_TIMEOUT
+    while time.monotonic() < deadline:
+        entry = cache.get(_key(user_id))
+        if entry and entry['hash'] == digest:
+            return entry['id']
+        if cache.get(_lock_key(user_id)) is None:
+            break
+        time.sleep(WAIT_INTERVAL)
+    raise PaymentError('Ya se está preparando el pago. Inténtalo de nuevo en unos segundos.', status=409)
+
+
+def checkout_session(user, success_url, cancel_url):
+    """
+    Id de la sesión de Stripe para el carrito de ``user``. Reserva el stock
+    la primera vez; lanza ``PaymentError`` si no se puede crear.
+    """
+    items = list(
+        CartItem.objects.filter(user=user)
+        .select_related('product')
+        .only('product_id', 'quantity', 'product__nombre', 'product__precio')
+        .order_by('product_id')
+    )
+    if not items:
+        raise PaymentError('El carrito está vacío')
+    digest = cart_hash(items, success_url, cancel_url)
+    entry = cache.get(_key(user.pk))
+    if entry and entry['hash'] == digest:
+        if not entry['saved']:
+            Order.objects.filter(pk=entry['order']).update(stripe_session_id=entry['id'])
+            _remember(user, digest, entry['id'], entry['order'], entry['expires_at'])
+        return entry['id']
+    if not cache.add(_lock_key(user.pk), digest, _lock_timeout()):
+        return _wait(user.pk, digest)
+
+    executor, slots = _pool()
+    if not slots.acquire(timeout=settings.STRIPE_QUEUE_TIMEOUT):
+        cache.delete(_lock_key(user.pk))
+        raise PaymentError('El servicio de pago está saturado. Inténtalo de nuevo en unos segundos.', status=503)
+    try:
+        # Un pedido con tarjeta pendiente es de un carrito anterior o de una
+        # sesión que la caché ha perdido: se cancela y su stock vuelve antes
+        # de reservar de nuevo
+        orders.cancel(_pending(user.pk))
+        cache.delete(_key(user.pk))
+        lines = [(item.product_id, item.quantity, item.product.nombre, item.product.precio) for item in items]
+        expires_at = timezone.now() + timedelta(seconds=settings.STRIPE_CHECKOUT_EXPIRES)
+        # El stock queda reservado en el pedido mientras el cliente paga en Stripe
+        try:
+            order = orders.create_reserved(user, lines, Order.TARJETA, expires_at)
+        except inventory.StockError as e:
+            raise PaymentError(f'No hay stock suficiente de: {", ".join(e.productos)}')
+        params = {
+            'payment_method_types': ['card'],
+            'line_items': line_items(items),
+            'mode': 'payment',
+            'success_url': success_url,
+            'cancel_url': cancel_url,
+            'client_reference_id': str(user.pk),
+            'metadata': {'order_id': str(order.pk)},
+            'expires_at': int(expires_at.timestamp()),
+        }
+        future = executor.submit(_create, params, f'checkout-{order.pk}')
+    except BaseException:
+        slots.release()
+        cache.delete(_lock_key(user.pk))
+        raise
+    future.add_done_callback(lambda _: slots.release())
+
+    try:
+        session = future.result(timeout=settings.STRIPE_TIMEOUT)
+    except TimeoutError:
+        # Se deja terminar en segundo plano: si Stripe responde, la sesión
+        # queda en caché para el siguiente clic; si falla, se cancela el pedido
+        future.add_done_callback(
+            partial(_finish_late, user, digest, order.pk, expires_at, threading.get_ident()))
+        raise PaymentError('El servicio de pago no responde. Inténtalo de nuevo.', status=504)
+    except Exception as e:
+        orders.cancel(Order.objects.filter(pk=order.pk))
+        cache.delete(_lock_key(user.pk))
+        raise PaymentError(str(e))
+    try:
+        Order.objects.filter(pk=order.pk).update(stripe_session_id=session.id)
+        _remember(user, digest, session.id, order.pk, expires_at)
+    finally:
+        cache.delete(_lock_key(user.pk))
+    return session.id
+
+
+def forget(user_id, release=False):
+    """
+    Olvida la sesión guardada al cerrar un pedido. Con ``release`` se
+    cancelan además los pedidos con tarjeta pendientes y se devuelve su
+    stock (el carrito se ha pagado de otra forma).
+    """
+    if release:
+        orders.cancel(_pending(user_id))
+    cache.delete(_key(user_id))
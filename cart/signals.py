@@ -0,0 +1,12 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import badge
+from .models import CartItem
+
+
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def invalidate_cart_badge(sender, instance, **kwargs):
+    if not badge.is_deferred():
+        badge.invalidate(instance.user_id)
@@ -1,12 +1,9 @@
 from django import template
-from cart.models import CartItem
-from django.db.models import Sum
+from cart.cart import get_cart
 
 register = template.Library()
 
 @register.filter(name='cart_item_count')
-def cart_item_count(user):
-    if user.is_authenticated:
-        return CartItem.objects.filter(user=user).aggregate(
-            total_items=Sum('quantity'))['total_items'] or 0
-    return 0
\ No newline at end of file
+def cart_item_count(request):
+    # Sirve igual para el carrito guardado y para el de sesión
+    return get_cart(request).count()
@@ -1,9 +1,21 @@
-from django.test import TestCase, Client
+from decimal import Decimal
+from datetime import timedelta
+from io import StringIO
+from django.core.cache import cache
+from django.db import IntegrityError, connection
+from django.test.utils import CaptureQueriesContext
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, Client, override_settings
 from django.urls import reverse
+from django.utils import timezone
 from django.contrib.auth.models import User
-from .models import CartItem
+from .models import CartItem, Order, OrderLine, WebhookEvent
+from products import inventory
 from products.models import Product
 import json
+import threading
+import time
+import urllib.request
 from unittest.mock import patch, MagicMock
 
 # Crear un mock para el módulo stripe
@@ -16,6 +28,8 @@ mock_stripe.checkout.Session.create.return_value = MagicMock(id='test_session_id
 mock_stripe.api_key = None
 sys.modules['stripe'] = mock_stripe
 
+from . import badge, fake_stripe, orders, payments, webhooks  # noqa: E402 (después del mock de stripe)
+
 # Create your tests here.
 
 class CartItemModelTest(TestCase):
@@ -93,15 +107,18 @@ class CartViewsTest(TestCase):
         self.assertTemplateUsed(response, 'cart/cart_detail.html')
         self.assertIn('cart_items', response.context)
         self.assertIn('total', response.context)
-        self.assertEqual(response.context['total'], 299.99)
+        self.assertEqual(response.context['total'], Decimal('299.99'))
     
     def test_cart_detail_view_unauthenticated(self):
+        # Los visitantes ven su carrito de sesión, pero no pueden pagar
         response = self.client.get(self.cart_detail_url)
-        self.assertNotEqual(response.status_code, 200)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cart_items'], [])
+        self.assertNotContains(response, reverse('checkout_cod'))
     
     def test_add_to_cart_authenticated(self):
         self.client.login(username='testuser', password='testpassword')
-        response = self.client.get(self.add_to_cart_url)
+        response = self.client.post(self.add_to_cart_url)
         self.assertRedirects(response, reverse('home'))
         
         # Verificar que se incrementó la cantidad
@@ -122,7 +139,7 @@ class CartViewsTest(TestCase):
         
         # Añadir al carrito
         add_url = reverse('add_to_cart', args=[new_product.id])
-        response = self.client.get(add_url)
+        response = self.client.post(add_url)
         self.assertRedirects(response, reverse('home'))
         
         # Verificar que se creó un nuevo item
@@ -145,8 +162,8 @@ class CartViewsTest(TestCase):
         response = self.client.get(self.payment_success_url)
         self.assertRedirects(response, reverse('home'))
         
-        # Verificar que el carrito se vacía
-        self.assertEqual(CartItem.objects.filter(user=self.user).count(), 0)
+        # El carrito no se vacía al volver de Stripe, sino con el webhook
+        self.assertEqual(CartItem.objects.filter(user=self.user).count(), 1)
     
     def test_create_checkout_session(self):
         # Skip si la URL no existe realmente
@@ -159,3 +176,658 @@ class CartViewsTest(TestCase):
         self.assertEqual(response.status_code, 200)
         response_data = json.loads(response.content)
         self.assertEqual(response_data['id'], 'test_session_id')
+
+
+class StockReservationTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='comprador', password='testpassword')
+        self.lavadora = Product.objects.create(nombre="Lavadora", descripcion="x", precio=299, stock=3)
+        self.nevera = Product.objects.create(nombre="Nevera", descripcion="x", precio=499, stock=1)
+        self.client.login(username='comprador', password='testpassword')
+
+    def test_checkout_descuenta_stock(self):
+        CartItem.objects.create(user=self.user, product=self.lavadora, quantity=2)
+        CartItem.objects.create(user=self.user, product=self.nevera, quantity=1)
+        response = self.client.post(reverse('checkout_cod'))
+        self.assertRedirects(response, reverse('home'))
+        self.assertEqual(Product.objects.get(pk=self.lavadora.pk).stock, 1)
+        self.assertEqual(Product.objects.get(pk=self.nevera.pk).stock, 0)
+        self.assertFalse(CartItem.objects.filter(user=self.user).exists())
+
+    def test_sin_stock_no_descuenta_nada(self):
+        CartItem.objects.create(user=self.user, product=self.lavadora, quantity=2)
+        CartItem.objects.create(user=self.user, product=self.nevera, quantity=2)
+        response = self.client.post(reverse('checkout_cod'), follow=True)
+        self.assertRedirects(response, reverse('cart_detail'))
+        self.assertEqual([str(m) for m in response.context['messages']], ['No hay stock suficiente de: Nevera.'])
+        # El descuento de la lavadora se deshace con el resto de la reserva
+        self.assertEqual(Product.objects.get(pk=self.lavadora.pk).stock, 3)
+        self.assertEqual(CartItem.objects.filter(user=self.user).count(), 2)
+
+    def test_reserva_en_una_sentencia(self):
+        with self.assertNumQueries(3):
+            # Savepoint, UPDATE condicional y liberación del savepoint
+            inventory.reserve([(self.lavadora.pk, 1), (self.nevera.pk, 1)])
+        with self.assertRaises(inventory.StockError):
+            inventory.reserve([(self.lavadora.pk, 1), (self.nevera.pk, 1)])
+        self.assertEqual(Product.objects.get(pk=self.lavadora.pk).stock, 2)
+
+    def test_stripe_reserva_y_libera_si_falla(self):
+        cache.clear()
+        item = CartItem.objects.create(user=self.user, product=self.lavadora, quantity=2)
+        self.client.post(reverse('create_checkout_session'))
+        self.assertEqual(Product.objects.get(pk=self.lavadora.pk).stock, 1)
+        # Con el mismo carrito se reutiliza la sesión sin volver a reservar
+        with patch.object(mock_stripe.checkout.Session, 'create', side_effect=Exception('caído')):
+            response = self.client.post(reverse('create_checkout_session'))
+        self.assertEqual(response.json()['id'], 'test_session_id')
+        self.assertEqual(Product.objects.get(pk=self.lavadora.pk).stock, 1)
+        # Si cambia, se devuelve la reserva anterior antes de reservar de nuevo
+        item.quantity = 3
+        item.save()
+        with patch.object(mock_stripe.checkout.Session, 'create', side_effect=Exception('caído')):
+            response = self.client.post(reverse('create_checkout_session'))
+        self.assertEqual(response.json()['error'], 'caído')
+        self.assertEqual(Product.objects.get(pk=self.lavadora.pk).stock, 3)
+        item.quantity = 4
+        item.save()
+        response = self.client.post(reverse('create_checkout_session'))
+        self.assertIn('No hay stock', response.json()['error'])
+
+
+class ConcurrentCheckoutTest(TransactionTestCase):
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('SQLite en memoria no admite escrituras concurrentes desde varios hilos')
+
+    def test_sin_sobreventa_con_compras_en_paralelo(self):
+        out = StringIO()
+        call_command('stress_checkout', buyers=100, workers=16, stock=30, stdout=out)
+        self.assertIn('30 con éxito, 70 sin stock, 0 con errores; stock final 0', out.getvalue())
+        self.assertIn('compras/s', out.getvalue())
+
+
+class CartBadgeTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='cliente', password='testpassword')
+        self.product = Product.objects.create(nombre="Horno", descripcion="x", precio=199)
+        CartItem.objects.create(user=self.user, product=self.product, quantity=2)
+        self.client.login(username='cliente', password='testpassword')
+
+    def _sumas(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        return response, [q['sql'] for q in queries if 'SUM(' in q['sql']]
+
+    def test_recuento_en_cache(self):
+        response, sumas = self._sumas(reverse('profile'))
+        self.assertContains(response, '<span class="badge bg-danger">2</span>', html=True)
+        self.assertEqual(len(sumas), 1)
+        response, sumas = self._sumas(reverse('profile'))
+        self.assertContains(response, '<span class="badge bg-danger">2</span>', html=True)
+        self.assertEqual(sumas, [])
+
+    def test_se_actualiza_al_cambiar_el_carrito(self):
+        self._sumas(reverse('profile'))
+        self.client.post(reverse('add_to_cart', args=[self.product.id]))
+        response, sumas = self._sumas(reverse('profile'))
+        self.assertContains(response, '<span class="badge bg-danger">3</span>', html=True)
+        self.client.post(reverse('checkout_cod'))
+        response, sumas = self._sumas(reverse('profile'))
+        self.assertNotContains(response, 'badge bg-danger')
+
+
+    def test_recuento_antiguo_no_sustituye_al_nuevo(self):
+        # Una petición lee el carrito y, antes de guardar el recuento, otra
+        # lo cambia y confirma
+        generation = badge.generation(self.user.pk)
+        antiguo = badge.cart_count(self.user.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            CartItem.objects.add(self.user.pk, self.product.pk, 5)
+        badge.remember(self.user.pk, generation, antiguo)
+        self.assertEqual(badge.cart_count(self.user.pk), antiguo + 5)
+
+
+class CartDetailQueriesTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='cliente', password='testpassword')
+        self.client.login(username='cliente', password='testpassword')
+
+    def _llenar(self, lineas):
+        productos = [Product.objects.create(nombre=f"Producto {i}", descripcion="x", precio=Decimal('19.99') + i)
+                     for i in range(lineas)]
+        for i, producto in enumerate(productos):
+            CartItem.objects.create(user=self.user, product=producto, quantity=i + 1)
+        cache.clear()
+
+    def test_consultas_constantes(self):
+        self._llenar(12)
+        # Sesión, usuario y una única consulta para el carrito (el contador
+        # de la barra sale de la misma consulta)
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('cart_detail'))
+        esperado = sum((Decimal('19.99') + i) * (i + 1) for i in range(12))
+        self.assertEqual(response.context['total'], esperado)
+        self.assertEqual(response.context['cart_items'][3].line_total, Decimal('22.99') * 4)
+        self.assertContains(response, f'€{esperado}')
+        self.assertContains(response, '<span class="badge bg-danger">78</span>', html=True)
+
+    def test_carrito_vacio(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('cart_detail'))
+        self.assertEqual(response.context['total'], Decimal('0.00'))
+        self.assertContains(response, 'Tu carrito está vacío.')
+
+
+class AddToCartUpsertTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='cliente', password='testpassword')
+        self.product = Product.objects.create(nombre="Horno", descripcion="x", precio=199)
+        self.client.login(username='cliente', password='testpassword')
+
+    def test_upsert_en_una_sentencia(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(CartItem.objects.add(self.user.pk, self.product.pk, 2), 2)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(CartItem.objects.add(self.user.pk, self.product.pk, 3), 5)
+        self.assertEqual(CartItem.objects.get(user=self.user).quantity, 5)
+        self.assertIsNone(CartItem.objects.add(self.user.pk, 999999))
+        self.assertEqual(CartItem.objects.count(), 1)
+
+    def test_parametro_quantity(self):
+        url = reverse('add_to_cart', args=[self.product.id])
+        self.assertRedirects(self.client.post(url, {'quantity': '4'}), reverse('home'))
+        self.assertRedirects(self.client.post(url), reverse('home'))
+        self.assertEqual(CartItem.objects.get(user=self.user).quantity, 5)
+        for cantidad in ('0', '-1', 'x', '1000'):
+            self.assertEqual(self.client.post(url, {'quantity': cantidad}).status_code, 400)
+        # Un GET (un enlace o una imagen de otra página) no añade nada
+        self.assertEqual(self.client.get(url, {'quantity': '4'}).status_code, 405)
+        self.assertEqual(CartItem.objects.get(user=self.user).quantity, 5)
+
+    def test_producto_inexistente(self):
+        response = self.client.post(reverse('add_to_cart', args=[999999]))
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_id_fuera_de_rango(self):
+        response = self.client.post(reverse('add_to_cart', args=[99999999999999999999999]))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(CartItem.objects.merge(self.user.pk, {99999999999999999999999: 1}), {})
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_cantidad_maxima(self):
+        url = reverse('add_to_cart', args=[self.product.id])
+        for _ in range(3):
+            self.client.post(url, {'quantity': '99'})
+        self.assertEqual(CartItem.objects.get(user=self.user).quantity, 99)
+        self.assertEqual(CartItem.objects.merge(self.user.pk, {self.product.pk: 5}), {self.product.pk: 99})
+
+    def test_restriccion_unica(self):
+        CartItem.objects.create(user=self.user, product=self.product)
+        with self.assertRaises(IntegrityError):
+            CartItem.objects.create(user=self.user, product=self.product)
+
+
+class ConcurrentAddToCartTest(TransactionTestCase):
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('SQLite en memoria no admite escrituras concurrentes desde varios hilos')
+
+    def test_sin_incrementos_perdidos(self):
+        out = StringIO()
+        # 80 unidades por usuario, por debajo de MAX_QUANTITY
+        call_command('stress_add_to_cart', clicks=200, workers=16, users=5, quantity=2, stdout=out)
+        self.assertIn('200 con éxito, 5 líneas, 400 unidades', out.getvalue())
+
+
+class GuestCartTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.horno = Product.objects.create(nombre="Horno", descripcion="x", precio=199)
+        self.nevera = Product.objects.create(nombre="Nevera", descripcion="x", precio='450.50')
+
+    def _add(self, product, quantity=1):
+        return self.client.post(reverse('add_to_cart', args=[product.pk]), {'quantity': quantity})
+
+    def test_sin_escrituras_en_el_carrito(self):
+        self.assertRedirects(self._add(self.horno, 2), reverse('home'))
+        self._add(self.horno)
+        self._add(self.nevera)
+        self.assertFalse(CartItem.objects.exists())
+        self.assertEqual(self.client.session['cart'], {str(self.horno.pk): 3, str(self.nevera.pk): 1})
+        self.assertEqual(self._add(Product(pk=999999)).status_code, 404)
+
+    def test_detalle_y_contador(self):
+        self._add(self.horno, 2)
+        self._add(self.nevera)
+        response = self.client.get(reverse('cart_detail'))
+        self.assertEqual(response.context['total'], Decimal('848.50'))
+        self.assertEqual([item.quantity for item in response.context['cart_items']], [2, 1])
+        self.assertContains(response, '<span class="badge bg-danger">3</span>', html=True)
+        self.assertContains(response, reverse('login'))
+
+    def test_pagina_cacheada_no_muestra_otro_carrito(self):
+        self._add(self.horno, 2)
+        response = self.client.get(reverse('catalog'))
+        self.assertContains(response, '<span class="badge bg-danger">2</span>', html=True)
+        response = Client().get(reverse('catalog'))
+        self.assertNotContains(response, 'badge bg-danger')
+
+    def test_fusion_al_iniciar_sesion(self):
+        user = User.objects.create_user(username='cliente', password='testpassword')
+        CartItem.objects.create(user=user, product=self.horno, quantity=1)
+        self._add(self.horno, 2)
+        self._add(self.nevera)
+        Product.objects.filter(pk=self.nevera.pk).delete()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('login'), {'username': 'cliente', 'password': 'testpassword'})
+        upserts = [q for q in queries.captured_queries if q['sql'].startswith('INSERT INTO "cart_cartitem"')]
+        self.assertEqual(len(upserts), 1)
+        self.assertEqual(dict(CartItem.objects.values_list('product_id', 'quantity')), {self.horno.pk: 3})
+        self.assertNotIn('cart', self.client.session)
+        response = self.client.get(reverse('cart_detail'))
+        self.assertEqual(response.context['total'], Decimal('597.00'))
+
+    def test_fusion_al_registrarse(self):
+        self._add(self.nevera, 4)
+        self.client.post(reverse('registro'), {
+            'username': 'nuevo', 'email': 'nuevo@example.com',
+            'password1': 'ClaveSegura123', 'password2': 'ClaveSegura123',
+        })
+        user = User.objects.get(username='nuevo')
+        self.assertEqual(CartItem.objects.get(user=user, product=self.nevera).quantity, 4)
+
+
+class CartApiTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='cliente', password='testpassword')
+        self.horno = Product.objects.create(nombre="Horno", descripcion="x", precio=199)
+        self.nevera = Product.objects.create(nombre="Nevera", descripcion="x", precio='450.50')
+
+    def _post(self, name, *args, data=None):
+        return self.client.post(reverse(name, args=args), data or {})
+
+    def _check_api(self):
+        data = self._post('api_cart_add', self.horno.pk, data={'quantity': 2}).json()
+        self.assertEqual(data['lines'], [{'product_id': self.horno.pk, 'quantity': 2, 'line_total': '398.00'}])
+        self.assertEqual((data['count'], data['total']), (2, '398.00'))
+
+        data = self._post('api_cart_set', self.nevera.pk, data={'quantity': 3}).json()
+        self.assertEqual(data['lines'][0]['quantity'], 3)
+        self.assertEqual((data['count'], data['total']), (5, '1749.50'))
+
+        response = self.client.post(reverse('api_cart_update'), json.dumps(
+            {'lines': {str(self.horno.pk): 1, str(self.nevera.pk): 0, '999999': 2}}),
+            content_type='application/json')
+        data = response.json()
+        self.assertEqual([line['quantity'] for line in data['lines']], [1, 0, 0])
+        self.assertEqual(data['ignored'], [999999])
+        self.assertEqual((data['count'], data['total']), (1, '199.00'))
+
+        data = self._post('api_cart_remove', self.horno.pk).json()
+        self.assertEqual((data['count'], data['total']), (0, '0.00'))
+        self.assertEqual(self.client.get(reverse('api_cart')).json()['lines'], [])
+
+    def test_usuario_identificado(self):
+        self.client.login(username='cliente', password='testpassword')
+        self._check_api()
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_visitante(self):
+        self._check_api()
+        self.assertEqual(self.client.session['cart'], {})
+
+    def test_bulk_update_en_un_update(self):
+        self.client.login(username='cliente', password='testpassword')
+        CartItem.objects.create(user=self.user, product=self.horno, quantity=1)
+        CartItem.objects.create(user=self.user, product=self.nevera, quantity=1)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('api_cart_update'), json.dumps(
+                {'lines': {str(self.horno.pk): 4, str(self.nevera.pk): 5}}), content_type='application/json')
+        updates = [q for q in queries.captured_queries if q['sql'].startswith('UPDATE "cart_cartitem"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(sorted(CartItem.objects.values_list('quantity', flat=True)), [4, 5])
+        # El contador de la barra de navegación se actualiza
+        self.assertEqual(self.client.get(reverse('api_cart')).json()['count'], 9)
+
+    def test_errores(self):
+        self._check_errores()
+        self.client.login(username='cliente', password='testpassword')
+        self._check_errores()
+        self.assertFalse(CartItem.objects.exists())
+
+    def _check_errores(self):
+        for name in ('api_cart_add', 'api_cart_set', 'api_cart_remove'):
+            response = self._post(name, 99999999999999999999999, data={'quantity': 1})
+            self.assertEqual(response.status_code, 404, name)
+        self.assertEqual(self._post('api_cart_add', 999999).status_code, 404)
+        self.assertEqual(self._post('api_cart_set', 999999, data={'quantity': 1}).status_code, 404)
+        self.assertEqual(self._post('api_cart_add', self.horno.pk, data={'quantity': 0}).status_code, 400)
+        self.assertEqual(self._post('api_cart_set', self.horno.pk, data={'quantity': 100}).status_code, 400)
+        response = self.client.post(reverse('api_cart_update'), 'x', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        for lines in ({'99999999999999999999999': 1}, {str(self.horno.pk): True}, {str(self.horno.pk): 1.7},
+                      {str(self.horno.pk): '2'}):
+            response = self.client.post(reverse('api_cart_update'), json.dumps({'lines': lines}),
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, 400, lines)
+        self.assertEqual(self.client.get(reverse('api_cart_add', args=[self.horno.pk])).status_code, 405)
+
+
+class OrderTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='cliente', password='testpassword')
+        self.horno = Product.objects.create(nombre="Horno", descripcion="x", precio=199, stock=5)
+        self.nevera = Product.objects.create(nombre="Nevera", descripcion="x", precio='450.50')
+        CartItem.objects.create(user=self.user, product=self.horno, quantity=2)
+        CartItem.objects.create(user=self.user, product=self.nevera, quantity=1)
+        self.client.login(username='cliente', password='testpassword')
+
+    def test_pedido_contrareembolso(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('checkout_cod'))
+        inserts = [q for q in queries.captured_queries if q['sql'].startswith('INSERT INTO "cart_orderline"')]
+        self.assertEqual(len(inserts), 1)
+        order = Order.objects.get()
+        self.assertEqual((order.user, order.metodo_pago, order.estado), (self.user, Order.CONTRAREEMBOLSO, Order.PENDIENTE))
+        self.assertEqual(order.total, Decimal('848.50'))
+        self.assertEqual(
+            list(order.lines.order_by('id').values_list('nombre', 'precio', 'quantity')),
+            [('Horno', Decimal('199.00'), 2), ('Nevera', Decimal('450.50'), 1)])
+        self.assertFalse(CartItem.objects.exists())
+        self.horno.refresh_from_db()
+        self.assertEqual(self.horno.stock, 3)
+
+    def test_precios_congelados(self):
+        self.client.post(reverse('checkout_cod'))
+        Product.objects.filter(pk=self.horno.pk).update(precio=1, nombre='Otro')
+        self.horno.delete()
+        line = OrderLine.objects.get(nombre='Horno')
+        self.assertEqual((line.product, line.precio, line.get_total()), (None, Decimal('199.00'), Decimal('398.00')))
+
+    def test_sin_stock_no_crea_pedido(self):
+        CartItem.objects.filter(product=self.horno).update(quantity=9)
+        self.client.post(reverse('checkout_cod'))
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(CartItem.objects.count(), 2)
+
+    def test_pago_con_tarjeta(self):
+        cache.clear()
+        self.client.post(reverse('create_checkout_session'))
+        order = Order.objects.get()
+        self.assertEqual((order.metodo_pago, order.estado), (Order.TARJETA, Order.PENDIENTE))
+        self.assertEqual((order.stripe_session_id, order.total), ('test_session_id', Decimal('848.50')))
+        self.assertEqual(order.lines.count(), 2)
+        # El stock se reserva al crear la sesión de Stripe
+        self.horno.refresh_from_db()
+        self.assertEqual(self.horno.stock, 3)
+        self.assertEqual(CartItem.objects.count(), 2)
+
+    def test_mis_pedidos(self):
+        self.client.post(reverse('checkout_cod'))
+        otro = User.objects.create_user(username='otro', password='testpassword')
+        Order.objects.create(user=otro, metodo_pago=Order.TARJETA, total=1)
+        response = self.client.get(reverse('order_history'))
+        self.assertEqual([order.user for order in response.context['orders']], [self.user])
+        self.assertContains(response, 'Nevera')
+
+    def test_benchmark(self):
+        out = StringIO()
+        call_command('benchmark_orders', orders=20, lines=2, stdout=out)
+        self.assertIn('20 pedidos de 2 líneas', out.getvalue())
+        self.assertEqual(Order.objects.count(), 0)
+
+
+class StripeCheckoutTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='cliente', password='testpassword')
+        self.horno = Product.objects.create(nombre="Horno", descripcion="x", precio='199.99', stock=5)
+        CartItem.objects.create(user=self.user, product=self.horno, quantity=2)
+        self.client.login(username='cliente', password='testpassword')
+        self.url = reverse('create_checkout_session')
+
+    def test_una_sesion_por_carrito(self):
+        with patch.object(mock_stripe.checkout.Session, 'create',
+                          return_value=MagicMock(id='cs_1')) as create:
+            ids = {self.client.post(self.url).json()['id'] for _ in range(3)}
+        self.assertEqual(ids, {'cs_1'})
+        create.assert_called_once()
+        kwargs = create.call_args.kwargs
+        self.assertEqual(kwargs['line_items'][0]['price_data']['unit_amount'], 19999)
+        self.assertEqual(kwargs['line_items'][0]['quantity'], 2)
+        order = Order.objects.get()
+        self.assertEqual(kwargs['idempotency_key'], f'checkout-{order.pk}')
+        self.assertEqual(kwargs['metadata'], {'order_id': str(order.pk)})
+        # La sesión de Stripe caduca a la vez que la reserva del pedido
+        self.assertEqual(kwargs['expires_at'], int(order.expires_at.timestamp()))
+        self.assertEqual(Product.objects.get(pk=self.horno.pk).stock, 3)
+
+    def test_cache_perdida_no_reserva_dos_veces(self):
+        with patch.object(mock_stripe.checkout.Session, 'create',
+                          side_effect=[MagicMock(id='cs_1'), MagicMock(id='cs_2')]):
+            self.client.post(self.url)
+            cache.clear()
+            self.client.post(self.url)
+        # El pedido pendiente anterior se cancela y devuelve su reserva
+        self.assertEqual(Product.objects.get(pk=self.horno.pk).stock, 3)
+        self.assertEqual(
+            list(Order.objects.order_by('pk').values_list('estado', flat=True)), [Order.CANCELADO, Order.PENDIENTE])
+
+    def test_reserva_caducada(self):
+        self.client.post(self.url)
+        Order.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        out = StringIO()
+        call_command('process_webhooks', once=True, stdout=out)
+        self.assertIn('1 pedidos caducados cancelados', out.getvalue())
+        self.assertEqual(Order.objects.get().estado, Order.CANCELADO)
+        self.assertEqual(Product.objects.get(pk=self.horno.pk).stock, 5)
+
+    def test_consulta_unica_del_carrito(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(self.url)
+        carrito = [q for q in queries.captured_queries if 'FROM "cart_cartitem"' in q['sql']]
+        self.assertEqual(len(carrito), 1)
+        self.assertIn('INNER JOIN "products_product"', carrito[0]['sql'])
+
+    @override_settings(STRIPE_TIMEOUT=0.05)
+    def test_timeout(self):
+        liberar = threading.Event()
+
+        def lenta(**kwargs):
+            liberar.wait(5)
+            return MagicMock(id='cs_lenta')
+
+        with patch.object(mock_stripe.checkout.Session, 'create', side_effect=lenta):
+            response = self.client.post(self.url)
+            self.assertEqual(response.status_code, 504)
+            # Cuando Stripe responde, la sesión queda para el siguiente clic
+            liberar.set()
+            for _ in range(100):
+                if cache.get(payments._key(self.user.pk)):
+                    break
+                time.sleep(0.01)
+        self.assertEqual(self.client.post(self.url).json()['id'], 'cs_lenta')
+        self.assertEqual(Order.objects.get().stripe_session_id, 'cs_lenta')
+
+    def test_contrareembolso_devuelve_la_reserva_de_stripe(self):
+        self.client.post(self.url)
+        self.assertEqual(Product.objects.get(pk=self.horno.pk).stock, 3)
+        self.client.post(reverse('checkout_cod'))
+        self.assertEqual(Product.objects.get(pk=self.horno.pk).stock, 3)
+        self.assertIsNone(cache.get(payments._key(self.user.pk)))
+        self.assertEqual(
+            dict(Order.objects.values_list('metodo_pago', 'estado')),
+            {Order.TARJETA: Order.CANCELADO, Order.CONTRAREEMBOLSO: Order.PENDIENTE})
+
+    def test_fake_stripe(self):
+        server = fake_stripe.start()
+        try:
+            body = 'mode=payment&line_items[0][quantity]=2&line_items[0][price_data][unit_amount]=500'.encode()
+            sesiones = []
+            for key in ('a', 'a', 'b'):
+                request = urllib.request.Request(
+                    server.url + '/v1/checkout/sessions', data=body, headers={'Idempotency-Key': key})
+                with urllib.request.urlopen(request) as response:
+                    sesiones.append(json.loads(response.read()))
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(sesiones[0]['id'], sesiones[1]['id'])
+        self.assertNotEqual(sesiones[0]['id'], sesiones[2]['id'])
+        self.assertEqual((sesiones[0]['amount_total'], server.created), (1000, 2))
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET='whsec_test')
+class StripeWebhookTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='cliente', password='testpassword')
+        self.horno = Product.objects.create(nombre="Horno", descripcion="x", precio=199)
+        self.nevera = Product.objects.create(nombre="Nevera", descripcion="x", precio=450)
+        CartItem.objects.create(user=self.user, product=self.horno, quantity=2)
+        self.client.login(username='cliente', password='testpassword')
+        self.client.post(reverse('create_checkout_session'))
+        self.order = Order.objects.get()
+
+    def _event(self, event_id='evt_1', session_id='test_session_id', type='checkout.session.completed',
+               secret='whsec_test', timestamp=None, metadata=None):
+        payload = json.dumps({
+            'id': event_id,
+            'type': type,
+            'data': {'object': {'id': session_id, 'payment_status': 'paid', 'metadata': metadata}},
+        }).encode()
+        return self.client.post(
+            reverse('stripe_webhook'), payload, content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=webhooks.sign(payload, secret, timestamp))
+
+    def test_firma(self):
+        self.assertEqual(self._event(secret='otro').status_code, 400)
+        self.assertEqual(self._event(timestamp=int(time.time()) - 3600).status_code, 400)
+        response = self.client.post(reverse('stripe_webhook'), '{}', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_reenvios_baratos(self):
+        self.assertEqual(self._event().status_code, 200)
+        with self.assertNumQueries(1):
+            self.assertEqual(self._event().status_code, 200)
+        self._event(type='payment_intent.created', event_id='evt_2')
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+
+    def test_worker_confirma_y_vacia_carrito(self):
+        self._event()
+        # Añadido después de pagar: no se toca
+        CartItem.objects.create(user=self.user, product=self.nevera, quantity=1)
+        self.assertEqual(CartItem.objects.count(), 2)
+        out = StringIO()
+        call_command('process_webhooks', once=True, stdout=out)
+        self.assertIn('1 eventos procesados', out.getvalue())
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.estado, Order.PAGADO)
+        self.assertEqual(list(CartItem.objects.values_list('product_id', flat=True)), [self.nevera.pk])
+        self.assertIsNone(cache.get(payments._key(self.user.pk)))
+        # Un reenvío posterior no se vuelve a procesar
+        self._event()
+        self.assertEqual(webhooks.process_pending(), 0)
+
+    def test_sesion_caducada_devuelve_el_stock(self):
+        # El horno no lleva control de stock al reservar; se pone ahora para
+        # ver lo que se devuelve
+        Product.objects.filter(pk=self.horno.pk).update(stock=5)
+        # La sesión que aún no se había guardado en el pedido se encuentra
+        # por los metadatos
+        Order.objects.update(stripe_session_id=None)
+        self._event(type='checkout.session.expired', session_id='cs_otra', metadata={'order_id': str(self.order.pk)})
+        self.assertEqual(webhooks.process_pending(), 1)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.estado, Order.CANCELADO)
+        self.assertEqual(Product.objects.get(pk=self.horno.pk).stock, 7)
+
+    def test_pago_de_pedido_cancelado(self):
+        Product.objects.filter(pk=self.horno.pk).update(stock=3)
+        # La reserva caducó antes de que llegara el pago
+        orders.cancel(Order.objects.all())
+        self.assertEqual(Product.objects.get(pk=self.horno.pk).stock, 5)
+        self._event()
+        webhooks.process_pending()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.estado, Order.PAGADO)
+        self.assertEqual(Product.objects.get(pk=self.horno.pk).stock, 3)
+
+    def test_pago_de_pedido_cancelado_sin_stock(self):
+        orders.cancel(Order.objects.all())
+        Product.objects.filter(pk=self.horno.pk).update(stock=1)
+        self._event()
+        webhooks.process_pending()
+        self.order.refresh_from_db()
+        # No se da por pagado ni se descuenta stock que no hay
+        self.assertEqual(self.order.estado, Order.REVISION)
+        self.assertEqual(Product.objects.get(pk=self.horno.pk).stock, 1)
+        self.assertEqual(CartItem.objects.filter(user=self.user).count(), 1)
+
+    def test_lote(self):
+        otros = []
+        for i in range(5):
+            user = User.objects.create_user(username=f'u{i}')
+            otros.append(orders.create(user, [(self.horno.pk, 1, 'Horno', 199)], Order.TARJETA,
+                                       stripe_session_id=f'cs_{i}'))
+            CartItem.objects.create(user=user, product=self.horno)
+            self._event(event_id=f'evt_{i}', session_id=f'cs_{i}')
+        with self.assertNumQueries(8):
+            # Savepoint, eventos, pedidos, UPDATE de pedidos, líneas a borrar
+            # del carrito, DELETE, eventos procesados y fin del savepoint
+            self.assertEqual(webhooks.process_pending(batch_size=10), 5)
+        self.assertEqual(Order.objects.filter(estado=Order.PAGADO).count(), 5)
+        self.assertEqual(CartItem.objects.count(), 1)
+
+
+class PurgeStaleCartsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.producto = Product.objects.create(nombre="Horno", descripcion="x", precio=199)
+        self.otro = Product.objects.create(nombre="Nevera", descripcion="x", precio=450)
+        self.abandonado = User.objects.create_user(username='abandonado', password='testpassword')
+        self.activo = User.objects.create_user(username='activo', password='testpassword')
+        antiguo = timezone.now() - timedelta(days=40)
+        CartItem.objects.create(user=self.abandonado, product=self.producto, quantity=3)
+        CartItem.objects.create(user=self.activo, product=self.producto)
+        CartItem.objects.create(user=self.activo, product=self.otro)
+        CartItem.objects.exclude(user=self.activo, product=self.otro).update(created_at=antiguo, updated_at=antiguo)
+
+    def test_borra_solo_carritos_abandonados(self):
+        self.assertEqual(badge.cart_count(self.abandonado.pk), 3)
+        out = StringIO()
+        call_command('purge_stale_carts', days=30, batch_size=1, stdout=out)
+        self.assertIn('1 líneas de carrito borradas', out.getvalue())
+        # Un carrito con algo reciente se conserva entero
+        self.assertEqual(list(CartItem.objects.values_list('user__username', flat=True)), ['activo', 'activo'])
+        self.assertEqual(badge.cart_count(self.abandonado.pk), 0)
+
+    def test_sumar_unidades_mantiene_el_carrito(self):
+        # El único cambio es añadir más unidades de una línea antigua
+        CartItem.objects.filter(user=self.activo, product=self.otro).delete()
+        CartItem.objects.add(self.activo.pk, self.producto.pk)
+        call_command('purge_stale_carts', days=30, stdout=StringIO())
+        self.assertEqual(CartItem.objects.get(user=self.activo).quantity, 2)
+
+    def test_consultas_por_lote(self):
+        ids = list(CartItem.objects.order_by('pk').values_list('pk', flat=True))
+        with self.assertNumQueries(5):
+            # Savepoint, usuarios afectados, filas a borrar, DELETE y fin del savepoint
+            CartItem.objects.purge_stale(timezone.now() - timedelta(days=30), ids[0], ids[-1] + 1)
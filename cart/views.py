@@ -1,18 +1,20 @@
+import json
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from .models import CartItem
-from products.models import Product
-import stripe
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from .cart import MAX_LINES, MAX_QUANTITY, get_cart
+from . import orders, payments, webhooks
+from .models import Order, product_id_in_range
+from products import inventory
 from django.conf import settings
-from django.http import JsonResponse
+from django.core.paginator import Paginator
+from django.http import Http404, HttpResponseBadRequest, JsonResponse
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
-
-@login_required
 def cart_detail(request):
-    cart_items = CartItem.objects.filter(user=request.user)
-    total = sum(item.get_total() for item in cart_items)
+    # Carrito de la base de datos o de la sesión, según haya usuario
+    cart_items, total = get_cart(request).lines()
     context = {
         'cart_items': cart_items,
         'total': total,
@@ -20,69 +22,173 @@ def cart_detail(request):
     }
     return render(request, 'cart/cart_detail.html', context)
 
-@login_required
+def _parse_quantity(value, minimum=1):
+    quantity = int(value)
+    if not minimum <= quantity <= MAX_QUANTITY:
+        raise ValueError(value)
+    return quantity
+
+
+@require_POST
 def add_to_cart(request, product_id):
-    product = Product.objects.get(id=product_id)
-    cart_item, created = CartItem.objects.get_or_create(
-        user=request.user,
-        product=product
-    )
-    if not created:
-        cart_item.quantity += 1
-        cart_item.save()
+    # Solo POST, con la comprobación CSRF: un enlace o una imagen no pueden
+    # llenar el carrito
+    try:
+        quantity = _parse_quantity(request.POST.get('quantity') or 1)
+    except ValueError:
+        return HttpResponseBadRequest('Cantidad no válida.')
+    # Con sesión iniciada, una sola sentencia que crea la línea o suma la
+    # cantidad; los visitantes solo modifican su sesión
+    if get_cart(request).add(product_id, quantity) is None:
+        raise Http404('No existe el producto.')
     messages.success(request, 'Producto añadido al carrito.')
     return redirect('home')
 
+
+# API JSON del carrito (static/js/cart.js). Cada respuesta lleva las líneas
+# afectadas y los totales del carrito, así que la página no se recarga.
+
+def _cart_json(cart, product_ids=None, ignored=()):
+    items, total = cart.lines()
+    if product_ids is None:
+        product_ids = [item.product.pk for item in items]
+    por_producto = {item.product.pk: item for item in items}
+    lines = []
+    for product_id in product_ids:
+        item = por_producto.get(product_id)
+        lines.append({
+            'product_id': product_id,
+            'quantity': item.quantity if item else 0,
+            'line_total': f'{item.line_total:.2f}' if item else '0.00',
+        })
+    return JsonResponse({
+        'lines': lines,
+        'count': sum(item.quantity for item in items),
+        'total': f'{total:.2f}',
+        'ignored': sorted(ignored),
+    })
+
+
+def _json_error(message, status=400):
+    return JsonResponse({'error': message}, status=status)
+
+
+@require_GET
+def api_cart(request):
+    return _cart_json(get_cart(request))
+
+
+@require_POST
+def api_cart_add(request, product_id):
+    if not product_id_in_range(product_id):
+        return _json_error('No existe el producto.', status=404)
+    try:
+        quantity = _parse_quantity(request.POST.get('quantity') or 1)
+    except ValueError:
+        return _json_error('Cantidad no válida.')
+    cart = get_cart(request)
+    if cart.add(product_id, quantity) is None:
+        return _json_error('No existe el producto.', status=404)
+    return _cart_json(cart, [product_id])
+
+
+@require_POST
+def api_cart_set(request, product_id):
+    if not product_id_in_range(product_id):
+        return _json_error('No existe el producto.', status=404)
+    try:
+        quantity = _parse_quantity(request.POST.get('quantity', ''), minimum=0)
+    except ValueError:
+        return _json_error('Cantidad no válida.')
+    cart = get_cart(request)
+    if cart.update({product_id: quantity}):
+        return _json_error('No existe el producto.', status=404)
+    return _cart_json(cart, [product_id])
+
+
+@require_POST
+def api_cart_remove(request, product_id):
+    if not product_id_in_range(product_id):
+        return _json_error('No existe el producto.', status=404)
+    cart = get_cart(request)
+    cart.update({product_id: 0})
+    return _cart_json(cart, [product_id])
+
+
+@require_POST
+def api_cart_update(request):
+    """
+    Cambia varias líneas a la vez. Cuerpo JSON:
+    ``{"lines": {"<product_id>": cantidad, ...}}``; cantidad 0 quita la línea.
+    """
+    try:
+        lines = json.loads(request.body)['lines']
+        cantidades = {}
+        for pk, quantity in lines.items():
+            pk = int(pk)
+            # true o 1.7 no son cantidades aunque int() los acepte
+            if type(quantity) is not int or not product_id_in_range(pk):
+                raise ValueError(pk)
+            cantidades[pk] = _parse_quantity(quantity, minimum=0)
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return _json_error('Formato no válido.')
+    if len(cantidades) > MAX_LINES:
+        return _json_error('Demasiadas líneas.')
+    cart = get_cart(request)
+    ignored = cart.update(cantidades)
+    return _cart_json(cart, list(cantidades), ignored)
+
 @login_required
 def checkout_cod(request):
     if request.method == 'POST':
-        cart_items = CartItem.objects.filter(user=request.user)
-        # Procesar pedido contrareembolso
-        cart_items.delete()
+        # Procesar pedido contrareembolso: en la misma transacción se reserva
+        # el stock, se guarda el pedido y se vacía el carrito
+        # Si había una sesión de Stripe abierta, su reserva de stock se devuelve
+        payments.forget(request.user.pk, release=True)
+        try:
+            orders.create_from_cart(request.user, Order.CONTRAREEMBOLSO)
+        except inventory.StockError as e:
+            messages.error(request, f'No hay stock suficiente de: {", ".join(e.productos)}.')
+            return redirect('cart_detail')
         messages.success(request, 'Pedido realizado correctamente. Pagarás al recibir.')
         return redirect('home')
 
 @login_required
 def create_checkout_session(request):
     if request.method == 'POST':
-        cart_items = CartItem.objects.filter(user=request.user)
-        
-        if not cart_items.exists():
-            return JsonResponse({'error': 'El carrito está vacío'})
-
+        base = request.build_absolute_uri('/')
         try:
-            checkout_session = stripe.checkout.Session.create(
-                payment_method_types=['card'],
-                line_items=[{
-                    'price_data': {
-                        'currency': 'eur',
-                        'product_data': {
-                            'name': item.product.nombre,
-                        },
-                        'unit_amount': int(item.product.precio * 100),
-                    },
-                    'quantity': item.quantity,
-                } for item in cart_items],
-                mode='payment',
-                success_url=request.build_absolute_uri('/') + 'payment/success/',
-                cancel_url=request.build_absolute_uri('/') + 'cart/',
-            )
-            return JsonResponse({'id': checkout_session.id})
-        except Exception as e:
-            return JsonResponse({'error': str(e)})
-    
+            session_id = payments.checkout_session(request.user, base + 'payment/success/', base + 'cart/')
+        except payments.PaymentError as e:
+            return JsonResponse({'error': str(e)}, status=e.status)
+        return JsonResponse({'id': session_id})
+
     return JsonResponse({'error': 'Método no permitido'}, status=405)
 
 @login_required
 def checkout_success(request):
-    # Limpiar el carrito después del pago exitoso
-    CartItem.objects.filter(user=request.user).delete()
+    # Stripe vuelve aquí tras el pago (success_url). El pedido se confirma
+    # y el carrito se vacía al procesar el webhook, no en esta visita.
     messages.success(request, '¡Pago realizado con éxito! Gracias por tu compra.')
     return redirect('home')
 
+@csrf_exempt
+@require_POST
+def stripe_webhook(request):
+    # Solo se verifica y se encola: el worker (process_webhooks) hace el resto
+    try:
+        webhooks.receive(request.body, request.headers.get('Stripe-Signature'))
+    except webhooks.SignatureError:
+        return JsonResponse({'error': 'Firma no válida'}, status=400)
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Evento no válido'}, status=400)
+    return JsonResponse({'received': True})
+
+ORDERS_PER_PAGE = 20
+
 @login_required
-def payment_success(request):
-    cart_items = CartItem.objects.filter(user=request.user)
-    cart_items.delete()
-    messages.success(request, '¡Pago realizado con éxito! Gracias por tu compra.')
-    return redirect('home')
+def order_history(request):
+    # El índice (user, -created_at, -id) sirve tanto el filtro como el orden
+    page = Paginator(Order.objects.for_user(request.user), ORDERS_PER_PAGE).get_page(request.GET.get('page'))
+    pedidos = list(page.object_list.prefetch_related('lines'))
+    return render(request, 'cart/order_history.html', {'page': page, 'orders': pedidos})
@@ -0,0 +1,164 @@
+"""
+Confirmación de pagos por webhook de Stripe.
+
+``receive`` comprueba la firma de la petición y guarda el evento en
+``WebhookEvent`` con un único INSERT que ignora los ids ya recibidos, así
+que la vista responde al momento y un reenvío masivo de Stripe cuesta una
+sentencia por evento. ``process_pending`` (comando ``process_webhooks``)
+procesa los pendientes por lotes: marca como pagados los pedidos de todas
+las sesiones del lote con un UPDATE, quita de los carritos lo comprado con
+un DELETE y marca los eventos como procesados, todo en una transacción.
+Un pedido que se canceló (y devolvió su stock) antes de que llegara el pago
+vuelve a reservarlo; si ya no queda, pasa a ``Order.REVISION`` en lugar de
+darse por pagado.
+Las sesiones caducadas (``checkout.session.expired``) cancelan su pedido
+pendiente y devuelven el stock reservado.
+
+La firma sigue el esquema de Stripe: la cabecera ``Stripe-Signature`` trae
+``t=<timestamp>,v1=<firma>`` y la firma es el HMAC-SHA256 de
+``"<timestamp>.<cuerpo>"`` con el secreto del endpoint.
+"""
+import hashlib
+import hmac
+import json
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from products import inventory
+
+from . import orders, payments
+from .models import CartItem, Order, OrderLine, WebhookEvent
+
+# Eventos que confirman el pago de una sesión
+PAID_EVENTS = ('checkout.session.completed', 'checkout.session.async_payment_succeeded')
+# Eventos de sesiones que ya no se pueden pagar
+EXPIRED_EVENTS = ('checkout.session.expired',)
+
+
+class SignatureError(Exception):
+    pass
+
+
+def sign(payload, secret, timestamp=None):
+    """Cabecera ``Stripe-Signature`` para ``payload`` (bytes); la usan las pruebas."""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    firma = hmac.new(secret.encode(), f'{timestamp}.'.encode() + payload, hashlib.sha256).hexdigest()
+    return f't={timestamp},v1={firma}'
+
+
+def verify(payload, header, secret, tolerance=None):
+    tolerance = settings.STRIPE_WEBHOOK_TOLERANCE if tolerance is None else tolerance
+    partes = {}
+    for item in (header or '').split(','):
+        clave, _, valor = item.strip().partition('=')
+        partes.setdefault(clave, []).append(valor)
+    try:
+        timestamp = int(partes['t'][0])
+    except (KeyError, ValueError):
+        raise SignatureError('Cabecera de firma no válida')
+    esperada = hmac.new(secret.encode(), f'{timestamp}.'.encode() + payload, hashlib.sha256).hexdigest()
+    if not any(hmac.compare_digest(esperada, firma) for firma in partes.get('v1', [])):
+        raise SignatureError('Firma incorrecta')
+    if abs(time.time() - timestamp) > tolerance:
+        raise SignatureError('Firma caducada')
+
+
+def receive(payload, header):
+    """
+    Verifica y encola un evento. Devuelve False si es de un tipo que no
+    interesa. Lanza ``SignatureError`` o ``ValueError`` si la petición no es
+    válida.
+    """
+    if not settings.STRIPE_WEBHOOK_SECRET:
+        raise SignatureError('STRIPE_WEBHOOK_SECRET no está configurado')
+    verify(payload, header, settings.STRIPE_WEBHOOK_SECRET)
+    event = json.loads(payload)
+    if event.get('type') not in PAID_EVENTS + EXPIRED_EVENTS:
+        return False
+    session = event['data']['object']
+    # INSERT ... ON CONFLICT DO NOTHING: los reenvíos no hacen nada
+    WebhookEvent.objects.bulk_create([WebhookEvent(
+        event_id=event['id'],
+        type=event['type'],
+        payload={
+            'session_id': session['id'],
+            'payment_status': session.get('payment_status'),
+            'client_reference_id': session.get('client_reference_id'),
+            'order_id': (session.get('metadata') or {}).get('order_id'),
+        },
+    )], ignore_conflicts=True)
+    return True
+
+
+def _orders_for(events):
+    """
+    Pedidos de las sesiones de ``events``. Se buscan también por el
+    ``order_id`` de los metadatos: si la petición dejó de esperar a Stripe,
+    el pedido puede no tener aún el id de la sesión.
+    """
+    sesiones = {event.payload['session_id'] for event in events}
+    ids = {int(event.payload['order_id']) for event in events
+           if str(event.payload.get('order_id') or '').isdigit()}
+    return Order.objects.filter(Q(stripe_session_id__in=sesiones) | Q(pk__in=ids))
+
+
+def _reserve_again(order_id):
+    """
+    Vuelve a reservar el stock de un pedido cancelado que el cliente ha
+    pagado. Devuelve False si falta stock o algún producto ya no existe.
+    """
+    lines = list(OrderLine.objects.filter(order_id=order_id).values_list('product_id', 'quantity'))
+    if any(product_id is None for product_id, _ in lines):
+        return False
+    try:
+        inventory.reserve(lines)
+    except inventory.StockError:
+        return False
+    return True
+
+
+def process_pending(batch_size=None):
+    """Procesa un lote de eventos pendientes y devuelve cuántos había."""
+    batch_size = batch_size or settings.STRIPE_WEBHOOK_BATCH_SIZE
+    with transaction.atomic():
+        pendientes = WebhookEvent.objects.filter(processed_at__isnull=True).order_by('id')
+        if connection.features.has_select_for_update_skip_locked:
+            # Varios workers pueden repartirse la cola
+            pendientes = pendientes.select_for_update(skip_locked=True)
+        events = list(pendientes.only('pk', 'type', 'payload')[:batch_size])
+        if not events:
+            return 0
+        caducados = [event for event in events if event.type in EXPIRED_EVENTS]
+        if caducados:
+            orders.cancel(_orders_for(caducados))
+        confirmados = [event for event in events if event.type in PAID_EVENTS
+                       and event.payload.get('payment_status') in ('paid', 'no_payment_required')]
+        # Un pedido cancelado porque el carrito cambió o la reserva caducó
+        # también se da por pagado si el cliente llegó a pagar la sesión,
+        # siempre que se pueda volver a reservar su stock
+        pagados, revision = [], []
+        encontrados = list(_orders_for(confirmados).exclude(estado__in=(Order.PAGADO, Order.REVISION))
+                           .values_list('pk', 'user_id', 'estado'))
+        for pk, user_id, estado in encontrados:
+            if estado == Order.CANCELADO and not _reserve_again(pk):
+                revision.append((pk, user_id))
+            else:
+                pagados.append((pk, user_id))
+        if revision:
+            Order.objects.filter(pk__in=[pk for pk, _ in revision]).update(estado=Order.REVISION)
+        if pagados:
+            ids = [pk for pk, _ in pagados]
+            Order.objects.filter(pk__in=ids).update(estado=Order.PAGADO)
+            # Solo se quitan del carrito los productos comprados
+            comprado = OrderLine.objects.filter(
+                order_id__in=ids, order__user_id=OuterRef('user_id'), product_id=OuterRef('product_id'))
+            CartItem.objects.filter(user_id__in={user_id for _, user_id in pagados}).filter(
+                Exists(comprado)).delete()
+        WebhookEvent.objects.filter(pk__in=[event.pk for event in events]).update(processed_at=timezone.now())
+    for user_id in {user_id for _, user_id in pagados + revision if user_id}:
+        payments.forget(user_id)
+    return len(events)
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 
 from pathlib import Path
 import os
+import django
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -85,8 +86,73 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Segundos que una escritura espera al bloqueo de la base de datos
+            # antes de fallar con 'database is locked' (5 por defecto)
+            'timeout': int(os.environ.get('SQLITE_TIMEOUT', 20)),
+        },
+        # Base de datos de pruebas en un fichero: en memoria, las pruebas de
+        # concurrencia (stress_checkout, stress_add_to_cart) no pueden
+        # escribir desde varios hilos y se omiten
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
+if django.VERSION >= (5, 1):
+    # Las transacciones toman el bloqueo de escritura al empezar: si una
+    # transacción que ya ha leído intenta escribir mientras otra escribe,
+    # SQLite falla al momento sin esperar el 'timeout'. También los bloques
+    # atomic() de solo lectura toman el bloqueo. La opción no existe antes
+    # de Django 5.1 (se pasaría a sqlite3.connect() y fallaría)
+    DATABASES['default']['OPTIONS']['transaction_mode'] = 'IMMEDIATE'
+
+
+# Caché
+# CACHE_BACKEND puede ser 'locmem', 'file', 'redis' o 'memcached'. Con varios
+# procesos conviene un backend compartido para que las invalidaciones lleguen
+# a todos.
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+    'memcached': 'django.core.cache.backends.memcached.PyMemcacheCache',
+}
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'locmem')
+CACHE_DEFAULT_LOCATIONS = {
+    'locmem': 'ecommerce',
+    'file': str(BASE_DIR / '.cache'),
+    'redis': 'redis://127.0.0.1:6379/1',
+    'memcached': '127.0.0.1:11211',
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND],
+        'LOCATION': os.environ.get('CACHE_LOCATION', CACHE_DEFAULT_LOCATIONS[CACHE_BACKEND]),
+    }
+}
+if CACHE_BACKEND in ('locmem', 'file'):
+    # Django guarda por defecto solo 300 entradas en estos backends y borra
+    # un tercio al llenarse: se quedan cortas con contadores y sesiones de
+    # pago por usuario
+    CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': int(os.environ.get('CACHE_MAX_ENTRIES', 100000))}
+
+# Segundos que se guardan los fragmentos y páginas del catálogo
+CATALOG_CACHE_TIMEOUT = int(os.environ.get('CATALOG_CACHE_TIMEOUT', 60 * 60))
+# Contadores de aciertos/fallos (manage.py catalog_cache_stats)
+CATALOG_CACHE_STATS = os.environ.get('CATALOG_CACHE_STATS', '1') == '1'
+
+# Instantánea del catálogo en memoria de cada proceso (products.snapshot).
+# Con varios procesos requiere un CACHE_BACKEND compartido.
+CATALOG_SNAPSHOT_ENABLED = os.environ.get('CATALOG_SNAPSHOT_ENABLED', '0') == '1'
+# Segundos tras los que se recarga entera aunque no haya cambios
+CATALOG_SNAPSHOT_MAX_AGE = int(os.environ.get('CATALOG_SNAPSHOT_MAX_AGE', 15 * 60))
+# Segundos que el refresco incremental vuelve a leer antes del último cambio
+# visto: ``actualizado`` se fija al guardar, no al confirmar, y una
+# transacción más lenta puede confirmar después de otra más reciente. Debe
+# superar la duración de la transacción más larga que escriba productos
+CATALOG_SNAPSHOT_SAFETY_WINDOW = int(os.environ.get('CATALOG_SNAPSHOT_SAFETY_WINDOW', 60))
 
 
 # Password validation
@@ -132,6 +198,27 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 # Configuración de medios (imágenes de productos)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# Anchuras en píxeles de los derivados WebP/JPEG de las imágenes de producto
+PRODUCT_IMAGE_WIDTHS = (320, 640, 1024)
+
+# Productos relacionados (compute_related_products): vecinos guardados por
+# producto y dimensiones de los vectores TF-IDF
+RELATED_PRODUCTS_TOP_K = int(os.environ.get('RELATED_PRODUCTS_TOP_K', 8))
+RELATED_PRODUCTS_DIMENSIONS = int(os.environ.get('RELATED_PRODUCTS_DIMENSIONS', 512))
+
+# Segundos que se guarda el contador del carrito de la barra de navegación
+# (se borra en cada cambio del carrito, así que puede ser largo)
+CART_BADGE_TIMEOUT = int(os.environ.get('CART_BADGE_TIMEOUT', 24 * 60 * 60))
+
+# Días sin cambios en el carrito tras los que purge_stale_carts borra un carrito
+CART_STALE_DAYS = int(os.environ.get('CART_STALE_DAYS', 30))
+
+# Autocompletado en memoria (products.autocomplete): resultados como máximo
+# por consulta y segundos tras los que se reconstruye aunque no haya cambios
+# en el catálogo (la popularidad sale de los carritos)
+AUTOCOMPLETE_LIMIT = int(os.environ.get('AUTOCOMPLETE_LIMIT', 10))
+AUTOCOMPLETE_MAX_AGE = int(os.environ.get('AUTOCOMPLETE_MAX_AGE', 10 * 60))
+AUTOCOMPLETE_BACKGROUND_REFRESH = True
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
@@ -142,9 +229,46 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 LOGIN_REDIRECT_URL = 'home'
 LOGOUT_REDIRECT_URL = 'home'
 LOGIN_URL = 'login'
+# El usuario de cada petición se carga con su perfil en la misma consulta.
+# ModelBackend sigue en la lista para las sesiones iniciadas antes con él:
+# la sesión guarda la ruta del backend y sin ella se cerrarían todas
+AUTHENTICATION_BACKENDS = [
+    'users.backends.ProfileModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
 
 # Configuración de mensajes
-MESSAGE_STORAGE = 'django.contrib.messages.storage.session.SessionStorage'
+# En una cookie y solo en la sesión si no caben: un mensaje no escribe la
+# sesión al mostrarse ni al consumirse en la página siguiente
+MESSAGE_STORAGE = 'django.contrib.messages.storage.fallback.FallbackStorage'
+
+# Sesiones: lectura desde la caché y escritura en la base de datos. Con
+# 'locmem' cada proceso tendría su copia y podría leer una sesión antigua,
+# así que solo se usa cached_db con un backend de caché compartido
+SESSION_ENGINE = os.environ.get('SESSION_ENGINE', 'django.contrib.sessions.backends.' + (
+    'db' if CACHE_BACKEND == 'locmem' else 'cached_db'))
 
 STRIPE_PUBLISHABLE_KEY = os.environ.get('STRIPE_PUBLISHABLE_KEY')
 STRIPE_SECRET_KEY = os.environ.get('STRIPE_SECRET_KEY')
+# Permite usar un servidor local (python manage.py fake_stripe) en las pruebas de carga
+STRIPE_API_BASE = os.environ.get('STRIPE_API_BASE')
+# Segundos que una petición espera a Stripe y reintentos de la librería
+STRIPE_TIMEOUT = float(os.environ.get('STRIPE_TIMEOUT', 10))
+STRIPE_MAX_RETRIES = int(os.environ.get('STRIPE_MAX_RETRIES', 2))
+# Llamadas simultáneas a Stripe por proceso y segundos que una petición
+# espera un hueco libre antes de rechazarse
+STRIPE_MAX_CONCURRENCY = int(os.environ.get('STRIPE_MAX_CONCURRENCY', 16))
+STRIPE_QUEUE_TIMEOUT = float(os.environ.get('STRIPE_QUEUE_TIMEOUT', 2))
+# Secreto del endpoint del webhook (whsec_...), margen en segundos para la
+# marca de tiempo de la firma y eventos por lote de process_webhooks
+STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET', '')
+STRIPE_WEBHOOK_TOLERANCE = int(os.environ.get('STRIPE_WEBHOOK_TOLERANCE', 300))
+STRIPE_WEBHOOK_BATCH_SIZE = int(os.environ.get('STRIPE_WEBHOOK_BATCH_SIZE', 200))
+# Segundos que se reutiliza la sesión de pago de un carrito sin cambios
+STRIPE_SESSION_CACHE_TIMEOUT = int(os.environ.get('STRIPE_SESSION_CACHE_TIMEOUT', 30 * 60))
+# Segundos que dura la sesión de Stripe y la reserva de stock de su pedido;
+# Stripe acepta entre 30 minutos y 24 horas
+STRIPE_CHECKOUT_EXPIRES = int(os.environ.get('STRIPE_CHECKOUT_EXPIRES', 60 * 60))
+
+# Número de productos por página en los listados del catálogo
+CATALOG_PAGE_SIZE = int(os.environ.get('CATALOG_PAGE_SIZE', 12))
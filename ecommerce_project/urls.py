@@ -18,7 +18,7 @@ from django.contrib import admin
 from django.urls import path
 from django.conf import settings
 from django.conf.urls.static import static
-from products.views import home, product_detail
+from products.views import home, catalog, product_detail, search, search_json, product_feed, autocomplete
 from users import views as user_views
 from cart import views as cart_views
 
@@ -30,10 +30,23 @@ urlpatterns = [
     path('logout/', user_views.cerrar_sesion, name='logout'),
     path('cart/', cart_views.cart_detail, name='cart_detail'),
     path('cart/add/<int:product_id>/', cart_views.add_to_cart, name='add_to_cart'),
+    path('api/cart/', cart_views.api_cart, name='api_cart'),
+    path('api/cart/add/<int:product_id>/', cart_views.api_cart_add, name='api_cart_add'),
+    path('api/cart/set/<int:product_id>/', cart_views.api_cart_set, name='api_cart_set'),
+    path('api/cart/remove/<int:product_id>/', cart_views.api_cart_remove, name='api_cart_remove'),
+    path('api/cart/update/', cart_views.api_cart_update, name='api_cart_update'),
+    path('pedidos/', cart_views.order_history, name='order_history'),
     path('checkout/cod/', cart_views.checkout_cod, name='checkout_cod'),
     path('create-checkout-session/', cart_views.create_checkout_session, name='create_checkout_session'),
     path('checkout/success/', cart_views.checkout_success, name='checkout_success'),
+    path('payment/success/', cart_views.checkout_success, name='payment_success'),
+    path('stripe/webhook/', cart_views.stripe_webhook, name='stripe_webhook'),
     path('product/<int:product_id>/', product_detail, name='product_detail'),
+    path('catalogo/', catalog, name='catalog'),
+    path('search/', search, name='search'),
+    path('api/search/', search_json, name='search_json'),
+    path('api/autocomplete/', autocomplete, name='autocomplete'),
+    path('feed/productos.<str:formato>', product_feed, name='product_feed'),
     path('profile/', user_views.profile, name='profile'),
 ]
 
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerce_project.settings')
 
 application = get_wsgi_application()
+
+# Índices en memoria que conviene tener listos antes de la primera petición
+from products import autocomplete  # noqa: E402
+
+autocomplete.warm_up()
@@ -1,8 +1,15 @@
 from django.contrib import admin
+from . import search
 from .models import Product
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('nombre', 'precio', 'destacado', 'promocion')
+    list_display = ('nombre', 'sku', 'precio', 'stock', 'destacado', 'promocion')
     list_filter = ('destacado', 'promocion')
-    search_fields = ('nombre', 'descripcion')
\ No newline at end of file
+    search_fields = ('nombre', 'descripcion')
+
+    def get_search_results(self, request, queryset, search_term):
+        # Se usa el índice de texto completo en lugar de icontains
+        if not search_term.strip() or not search.is_supported():
+            return super().get_search_results(request, queryset, search_term)
+        return queryset.filter(id__in=search.match_subquery(search_term)), False
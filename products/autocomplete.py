@@ -0,0 +1,194 @@
+"""
+Autocompletado de nombres de producto en memoria.
+
+El índice es un array ordenado de claves normalizadas (minúsculas y sin
+tildes, ``products.text.normalizar``) con una clave por cada palabra del
+nombre hasta el final, de modo que "combi" encuentra "Frigorífico Combi". Un
+prefijo se resuelve con dos ``bisect`` sobre ese array. Los productos se
+numeran por popularidad, así que los N mejores de un rango son los N números
+más pequeños; para los prefijos cortos que abarcan muchos productos el
+resultado se precalcula al construir el índice.
+
+Cada proceso construye su índice al arrancar (``warm_up`` desde wsgi.py) y lo
+reconstruye en un hilo cuando cambia la versión del catálogo, mientras sigue
+respondiendo con el anterior.
+"""
+import heapq
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left, bisect_right
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.db.models import Sum
+
+from . import cache as catalog_cache
+from .text import normalizar
+
+logger = logging.getLogger(__name__)
+
+# A partir de este tamaño de rango el resultado del prefijo se precalcula
+SCAN_LIMIT = 256
+MAX_QUERY_LENGTH = 64
+_WORD = re.compile(r'\w+')
+_SPACES = re.compile(r'\s+')
+
+
+def normalize_name(text):
+    return _SPACES.sub(' ', normalizar(text)).strip()
+
+
+def normalize_query(text):
+    # Solo se recorta la búsqueda: los nombres se indexan enteros para que
+    # las palabras del final (la marca, por ejemplo) también se encuentren
+    return normalize_name(text)[:MAX_QUERY_LENGTH]
+
+
+class AutocompleteIndex:
+    __slots__ = ('keys', 'refs', 'products', 'top', 'limit', 'version', 'built_at')
+
+    def __init__(self, rows, limit, version=None):
+        """
+        ``rows``: iterable de ``(id, nombre, precio, popularidad)``. Se
+        precalculan como mucho ``limit`` resultados por prefijo.
+        """
+        # Más popular primero; a igual popularidad, el nombre más corto
+        self.products = sorted(rows, key=lambda row: (-row[3], len(row[1]), row[0]))
+        self.limit = limit
+        self.version = version
+        self.built_at = time.monotonic()
+        entries = []
+        for ref, (pk, nombre, precio, popularidad) in enumerate(self.products):
+            clave = normalize_name(nombre)
+            for match in _WORD.finditer(clave):
+                entries.append((clave[match.start():], ref))
+        entries.sort()
+        self.keys = [key for key, ref in entries]
+        self.refs = [ref for key, ref in entries]
+        self.top = {}
+        self._precompute()
+
+    def _range(self, prefix):
+        lo = bisect_left(self.keys, prefix)
+        return lo, bisect_left(self.keys, prefix + '\uffff', lo)
+
+    def _best(self, lo, hi, limit):
+        return heapq.nsmallest(limit, set(self.refs[lo:hi]))
+
+    def _precompute(self):
+        # Solo los prefijos con rangos grandes, nivel a nivel: un prefijo de
+        # longitud n+1 solo puede ser grande si el de longitud n lo es. Los
+        # hijos de cada prefijo se recorren saltando de rango en rango.
+        pending = [('', 0, len(self.keys))]
+        while pending:
+            siguientes = []
+            for prefix, lo, hi in pending:
+                if prefix:
+                    self.top[prefix] = self._best(lo, hi, self.limit)
+                length = len(prefix) + 1
+                i = bisect_right(self.keys, prefix, lo, hi)
+                while i < hi:
+                    child = self.keys[i][:length]
+                    end = bisect_left(self.keys, child + '\uffff', i, hi)
+                    if end - i > SCAN_LIMIT:
+                        siguientes.append((child, i, end))
+                    i = end
+            pending = siguientes
+
+    def search(self, query, limit=None):
+        """
+        Productos ``(id, nombre, precio, popularidad)`` con alguna palabra
+        del nombre que empieza por ``query``, los más populares primero.
+        """
+        limit = min(limit or self.limit, self.limit)
+        prefix = normalize_query(query)
+        if not prefix:
+            return []
+        refs = self.top.get(prefix)
+        if refs is None:
+            lo, hi = self._range(prefix)
+            refs = self._best(lo, hi, limit)
+        return [self.products[ref] for ref in refs[:limit]]
+
+
+def _popularity():
+    """Unidades de cada producto en carritos, como medida de popularidad."""
+    from cart.models import CartItem
+
+    return dict(CartItem.objects.values('product_id').annotate(total=Sum('quantity'))
+                .values_list('product_id', 'total'))
+
+
+def build(version=None):
+    from .models import Product
+
+    version = catalog_cache.catalog_version() if version is None else version
+    popularidad = _popularity()
+    rows = (
+        (pk, nombre, precio, popularidad.get(pk, 0))
+        for pk, nombre, precio in Product.objects.values_list('id', 'nombre', 'precio').iterator(
+            chunk_size=5000)
+    )
+    return AutocompleteIndex(rows, settings.AUTOCOMPLETE_LIMIT, version)
+
+
+_index = None
+_lock = threading.Lock()
+_refreshing = False
+
+
+def _refresh(version):
+    global _index, _refreshing
+    try:
+        _index = build(version)
+    except DatabaseError:
+        logger.exception('No se pudo reconstruir el índice de autocompletado')
+    finally:
+        _refreshing = False
+        connection.close()
+
+
+def get_index():
+    """
+    Índice al día. Si ya hay uno cargado y el catálogo ha cambiado, se
+    devuelve el anterior y el nuevo se construye en segundo plano.
+    """
+    global _index, _refreshing
+    version = catalog_cache.catalog_version()
+    current = _index
+    stale = current is None or current.version != version or (
+        time.monotonic() - current.built_at > settings.AUTOCOMPLETE_MAX_AGE)
+    if not stale:
+        return current
+    with _lock:
+        if _index is None:
+            _index = build(version)
+            return _index
+        if _index is current and not _refreshing:
+            _refreshing = True
+            if settings.AUTOCOMPLETE_BACKGROUND_REFRESH:
+                threading.Thread(target=_refresh, args=(version,), daemon=True).start()
+            else:
+                _index = build(version)
+                _refreshing = False
+        return _index
+
+
+def warm_up():
+    """Construye el índice al arrancar el proceso (llamado desde wsgi.py)."""
+    try:
+        get_index()
+    except DatabaseError:
+        # Por ejemplo, antes de aplicar las migraciones
+        logger.warning('Índice de autocompletado no disponible al arrancar', exc_info=True)
+    finally:
+        # Con gunicorn --preload los workers no deben heredar la conexión
+        connection.close()
+
+
+def reset():
+    global _index
+    with _lock:
+        _index = None
@@ -0,0 +1,160 @@
+"""
+Caché del escaparate: fragmentos por producto y páginas completas para
+usuarios anónimos.
+
+Las páginas se guardan bajo una versión del catálogo que se incrementa en
+cada escritura de ``Product``, de modo que una edición en el admin deja
+obsoletas todas las páginas a la vez sin tener que enumerarlas. Los
+fragmentos de cada producto se borran explícitamente al guardarlo y sus
+claves cambian con la plantilla que los genera.
+"""
+import hashlib
+import re
+import time
+from functools import cache as memoize, wraps
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.template.loader import get_template
+
+from cart.cart import has_session_cart
+
+VERSION_KEY = 'catalog:version'
+FRAGMENT_TEMPLATES = {
+    'card': 'products/_product_card.html',
+    'detail': 'products/_product_detail_body.html',
+}
+FRAGMENTS = tuple(FRAGMENT_TEMPLATES)
+# Las claves de los fragmentos llevan un hash de su plantilla, así que un
+# despliegue que la cambia no sirve el HTML anterior. Hay que subir este
+# número si cambia otra cosa que afecte al HTML (los datos que recibe la
+# plantilla o las plantillas que incluye)
+FRAGMENT_VERSION = 1
+
+# El token CSRF es distinto para cada visitante, así que en la caché se
+# guarda este marcador y se sustituye al servir la respuesta.
+CSRF_PLACEHOLDER = '__csrf_token__'
+_CSRF_INPUT = re.compile(r'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+
+
+def _timeout():
+    return settings.CATALOG_CACHE_TIMEOUT
+
+
+def catalog_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Si la clave se ha expulsado se parte de un valor nuevo para no
+        # reutilizar versiones que puedan seguir en caché.
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    try:
+        return cache.incr(VERSION_KEY)
+    except ValueError:
+        return catalog_version()
+
+
+@memoize
+def _template_version(kind):
+    source = get_template(FRAGMENT_TEMPLATES[kind]).template.source
+    return hashlib.md5(source.encode(), usedforsecurity=False).hexdigest()[:12]
+
+
+def fragment_key(kind, pk):
+    return f'catalog:fragment:{FRAGMENT_VERSION}:{_template_version(kind)}:{kind}:{pk}'
+
+
+def invalidate_product(pk):
+    cache.delete_many([fragment_key(kind, pk) for kind in FRAGMENTS])
+    bump_catalog_version()
+
+
+# Contadores de aciertos y fallos
+
+def _stats_key(name, result):
+    return f'catalog:stats:{name}:{result}'
+
+
+def _count(name, hit):
+    if not settings.CATALOG_CACHE_STATS:
+        return
+    key = _stats_key(name, 'hits' if hit else 'misses')
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key)
+
+
+def stats():
+    """Devuelve {nombre: (aciertos, fallos)} para páginas y fragmentos."""
+    names = ('page',) + FRAGMENTS
+    keys = [_stats_key(name, result) for name in names for result in ('hits', 'misses')]
+    values = cache.get_many(keys)
+    return {
+        name: (values.get(_stats_key(name, 'hits'), 0), values.get(_stats_key(name, 'misses'), 0))
+        for name in names
+    }
+
+
+def reset_stats():
+    cache.delete_many([
+        _stats_key(name, result)
+        for name in ('page',) + FRAGMENTS for result in ('hits', 'misses')
+    ])
+
+
+# Fragmentos
+
+def cached_fragment(kind, pk, render):
+    """Devuelve el HTML del fragmento, generándolo con ``render`` si falta."""
+    key = fragment_key(kind, pk)
+    html = cache.get(key)
+    _count(kind, html is not None)
+    if html is None:
+        html = render()
+        cache.set(key, html, _timeout())
+    return html
+
+
+def fill_csrf(html, token):
+    return html.replace(CSRF_PLACEHOLDER, token)
+
+
+# Páginas completas
+
+def _page_key(request):
+    path = hashlib.md5(request.get_full_path().encode(), usedforsecurity=False).hexdigest()
+    return f'catalog:page:{catalog_version()}:{path}'
+
+
+def cache_anonymous_page(view):
+    """
+    Cachea la respuesta de ``view`` para visitantes anónimos. No se cachean
+    peticiones con mensajes pendientes ni de visitantes con carrito de
+    sesión, porque la página muestra ambos.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if (request.method not in ('GET', 'HEAD') or request.user.is_authenticated
+                or len(get_messages(request)) or has_session_cart(request)):
+            return view(request, *args, **kwargs)
+        key = _page_key(request)
+        content = cache.get(key)
+        _count('page', content is not None)
+        if content is not None:
+            return HttpResponse(fill_csrf(content, get_token(request)))
+        response = view(request, *args, **kwargs)
+        if response.status_code == 200 and not response.streaming:
+            content = response.content.decode(response.charset)
+            content = _CSRF_INPUT.sub(rf'\g<1>{CSRF_PLACEHOLDER}\g<2>', content)
+            cache.set(key, content, _timeout())
+        return response
+    return wrapper
@@ -0,0 +1,105 @@
+"""
+Peticiones condicionales (ETag / Last-Modified) para las páginas del catálogo.
+
+Los validadores se calculan con consultas que no cargan filas completas y se
+combinan con una variante de la petición: las páginas muestran el usuario y
+el contador del carrito en la barra de navegación, así que un usuario nunca
+puede recibir un 304 validado con la copia de otro.
+"""
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.db.models import Max
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from cart.templatetags.cart_tags import cart_item_count
+
+from . import cache as catalog_cache
+from . import snapshot as catalog_snapshot
+from .models import Product
+
+
+def request_variant(request):
+    """
+    Parte de la ETag que depende de quién hace la petición, o None si la
+    respuesta no debe validarse (por ejemplo, porque hay mensajes pendientes).
+    """
+    if len(get_messages(request)):
+        return None
+    user = request.user
+    if user.is_authenticated:
+        variant = f'user:{user.pk}:{user.username}:{cart_item_count(request)}'
+    else:
+        # Los visitantes también ven el contador de su carrito de sesión
+        variant = f'anon:{cart_item_count(request)}'
+    # La página incluye un token derivado del secreto CSRF de la cookie
+    return f'{variant}:{request.COOKIES.get(settings.CSRF_COOKIE_NAME, "")}'
+
+
+def catalog_validators(request, *args, **kwargs):
+    snapshot = catalog_snapshot.get_snapshot()
+    if snapshot is not None:
+        ultimo, version = snapshot.last_modified, snapshot.version
+    else:
+        ultimo = Product.objects.aggregate(ultimo=Max('actualizado'))['ultimo']
+        version = catalog_cache.catalog_version()
+    # La versión del catálogo cambia también con los borrados
+    return f'{ultimo}:{version}', ultimo
+
+
+def product_validators(request, product_id, *args, **kwargs):
+    snapshot = catalog_snapshot.get_snapshot()
+    if snapshot is not None:
+        product = snapshot.get(product_id)
+        actualizado = product.actualizado if product is not None else None
+        version = snapshot.version
+    else:
+        actualizado = Product.objects.filter(pk=product_id).values_list(
+            'actualizado', flat=True).first()
+        version = catalog_cache.catalog_version()
+    if actualizado is None:
+        return None
+    # La página incluye tarjetas de productos relacionados, que pueden
+    # cambiar sin que cambie este producto
+    return f'{product_id}:{actualizado}:{version}', actualizado
+
+
+def conditional_page(validators, per_user=True):
+    """
+    Responde 304 si el cliente ya tiene la versión actual de la página.
+
+    ``validators`` recibe los argumentos de la vista y devuelve
+    ``(base_etag, last_modified)`` o None para servir la vista sin validar.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            variant = request_variant(request) if per_user else 'public'
+            state = validators(request, *args, **kwargs) if variant is not None else None
+            if state is None:
+                return view(request, *args, **kwargs)
+            base, last_modified = state
+            etag = quote_etag(hashlib.sha1(f'{base}|{variant}'.encode(), usedforsecurity=False).hexdigest())
+            # Last-Modified no distingue variantes, así que solo se envía
+            # cuando la respuesta es la misma para cualquiera.
+            if per_user and request.user.is_authenticated:
+                last_modified = None
+            timestamp = int(last_modified.timestamp()) if last_modified else None
+
+            response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+            if response is None:
+                response = view(request, *args, **kwargs)
+            if response.status_code in (200, 304):
+                response.headers.setdefault('ETag', etag)
+                if timestamp is not None and not response.has_header('Last-Modified'):
+                    response.headers['Last-Modified'] = http_date(timestamp)
+                scope = {'private': True} if per_user else {'public': True}
+                patch_cache_control(response, no_cache=True, **scope)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,150 @@
+"""
+Recuentos de facetas del catálogo (banda de precio, destacado, promoción).
+
+En lugar de hacer un COUNT(*) por faceta en cada petición se mantiene la
+tabla ``FacetCount`` con una fila por combinación de valores. Las señales de
+``Product`` la actualizan de forma incremental (+1/-1) y los recuentos de
+cualquier combinación de filtros se obtienen sumando esas pocas filas.
+Añadir más facetas (p. ej. categorías) es añadir una columna a la clave.
+"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, IntegerField, Value, When
+
+from . import cache as catalog_cache
+
+# Bandas de precio: (mínimo incluido, máximo excluido, etiqueta)
+PRICE_BANDS = (
+    (Decimal('0'), Decimal('100'), 'Menos de 100 €'),
+    (Decimal('100'), Decimal('300'), '100 € - 300 €'),
+    (Decimal('300'), Decimal('600'), '300 € - 600 €'),
+    (Decimal('600'), Decimal('1000'), '600 € - 1000 €'),
+    (Decimal('1000'), None, 'Más de 1000 €'),
+)
+FACET_FIELDS = ('precio', 'destacado', 'promocion')
+
+
+def price_band(precio):
+    precio = Decimal(str(precio))
+    for index, (low, high, label) in enumerate(PRICE_BANDS):
+        if high is None or precio < high:
+            return index
+    return len(PRICE_BANDS) - 1
+
+
+def band_filter(index):
+    low, high, label = PRICE_BANDS[index]
+    lookup = {'precio__gte': low} if index else {}
+    if high is not None:
+        lookup['precio__lt'] = high
+    return lookup
+
+
+def facet_key(product):
+    return price_band(product.precio), product.destacado, product.promocion
+
+
+# Mantenimiento incremental
+
+def adjust(key, delta):
+    from .models import FacetCount
+
+    banda, destacado, promocion = key
+    lookup = {'banda_precio': banda, 'destacado': destacado, 'promocion': promocion}
+    if FacetCount.objects.filter(**lookup).update(total=F('total') + delta):
+        return
+    try:
+        with transaction.atomic():
+            FacetCount.objects.create(total=max(delta, 0), **lookup)
+    except IntegrityError:
+        FacetCount.objects.filter(**lookup).update(total=F('total') + delta)
+
+
+def product_changed(old_key, new_key):
+    if old_key == new_key:
+        return
+    if old_key is not None:
+        adjust(old_key, -1)
+    if new_key is not None:
+        adjust(new_key, 1)
+
+
+def rebuild_counts(Product=None, FacetCount=None):
+    """
+    Recalcula la tabla completa con una única consulta agrupada. Admite los
+    modelos históricos para poder usarse desde una migración.
+    """
+    if Product is None:
+        from .models import FacetCount, Product
+
+    banda = Case(
+        *[When(then=Value(i), **band_filter(i)) for i in range(len(PRICE_BANDS) - 1)],
+        default=Value(len(PRICE_BANDS) - 1),
+        output_field=IntegerField(),
+    )
+    rows = list(Product.objects.annotate(banda=banda)
+                .values('banda', 'destacado', 'promocion')
+                .annotate(total=Count('id'))
+                .order_by())
+    with transaction.atomic():
+        FacetCount.objects.all().delete()
+        FacetCount.objects.bulk_create([
+            FacetCount(banda_precio=row['banda'], destacado=row['destacado'],
+                       promocion=row['promocion'], total=row['total'])
+            for row in rows
+        ])
+    return sum(row['total'] for row in rows)
+
+
+# Consulta
+
+def _counts_table():
+    """Filas de recuentos, cacheadas con la versión del catálogo."""
+    from .models import FacetCount
+
+    key = f'catalog:facets:{catalog_cache.catalog_version()}'
+    table = cache.get(key)
+    if table is None:
+        table = list(FacetCount.objects.filter(total__gt=0).values_list(
+            'banda_precio', 'destacado', 'promocion', 'total'))
+        cache.set(key, table, settings.CATALOG_CACHE_TIMEOUT)
+    return table
+
+
+def _matches(row, filtros, skip):
+    banda, destacado, promocion, total = row
+    return (
+        (skip == 'precio' or filtros.get('precio') is None or banda == filtros['precio'])
+        and (skip == 'destacado' or not filtros.get('destacado') or destacado)
+        and (skip == 'promocion' or not filtros.get('promocion') or promocion)
+    )
+
+
+def facet_counts(filtros):
+    """
+    Recuentos de cada valor de faceta teniendo en cuenta el resto de
+    filtros activos (la propia faceta no se filtra a sí misma).
+    """
+    table = _counts_table()
+    precio = [0] * len(PRICE_BANDS)
+    destacado = promocion = total = 0
+    for row in table:
+        if _matches(row, filtros, 'precio'):
+            precio[row[0]] += row[3]
+        if _matches(row, filtros, 'destacado') and row[1]:
+            destacado += row[3]
+        if _matches(row, filtros, 'promocion') and row[2]:
+            promocion += row[3]
+        if _matches(row, filtros, None):
+            total += row[3]
+    return {
+        'precio': [
+            {'banda': i, 'etiqueta': PRICE_BANDS[i][2], 'total': n} for i, n in enumerate(precio)
+        ],
+        'destacado': destacado,
+        'promocion': promocion,
+        'total': total,
+    }
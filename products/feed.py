@@ -0,0 +1,104 @@
+"""
+Feeds del catálogo completo en CSV y JSONL para comparadores de precios.
+
+La tabla se recorre por cursor sobre ``id`` en bloques de ``CHUNK_SIZE``
+filas y cada bloque se escribe en la respuesta antes de leer el siguiente,
+así que la memoria no depende del tamaño del catálogo. Si el cliente lo
+acepta, la salida se comprime con gzip a medida que se genera.
+"""
+import csv
+import io
+import json
+import re
+import zlib
+
+from django.urls import reverse
+
+from .conditional import catalog_validators
+from .images import derivative_url
+from .models import Product
+
+CHUNK_SIZE = 1000
+FEED_FIELDS = ('id', 'sku', 'nombre', 'descripcion', 'precio', 'imagen', 'destacado', 'promocion')
+COLUMNS = ('id', 'sku', 'nombre', 'descripcion', 'precio', 'url', 'imagen', 'destacado', 'promocion')
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+_GZIP = re.compile(r'\bgzip\b')
+
+
+def accepts_gzip(request):
+    return bool(_GZIP.search(request.headers.get('Accept-Encoding', '')))
+
+
+def feed_validators(request, formato, *args, **kwargs):
+    state = catalog_validators(request)
+    # Cada codificación es una representación distinta y necesita su ETag
+    encoding = 'gzip' if accepts_gzip(request) else 'identity'
+    base, last_modified = state
+    return f'feed:{formato}:{encoding}:{base}', last_modified
+
+
+def iter_chunks(chunk_size=CHUNK_SIZE):
+    """Bloques de filas (tuplas de ``FEED_FIELDS``) ordenados por id."""
+    last_id = 0
+    while True:
+        rows = list(Product.objects.filter(id__gt=last_id).order_by('id')
+                    .values_list(*FEED_FIELDS)[:chunk_size])
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def _records(request, rows):
+    # reverse() por fila es caro: se resuelve una vez y se sustituye el id
+    url = request.build_absolute_uri(reverse('product_detail', args=[0]))
+    prefix, suffix = url.rsplit('0', 1)
+    base = request.build_absolute_uri('/')[:-1]
+    for pk, sku, nombre, descripcion, precio, imagen, destacado, promocion in rows:
+        imagen_url = derivative_url(imagen) if imagen else ''
+        if imagen_url.startswith('/'):
+            imagen_url = base + imagen_url
+        yield (pk, sku or '', nombre, descripcion, str(precio), f'{prefix}{pk}{suffix}',
+               imagen_url, destacado, promocion)
+
+
+def _csv_chunks(request, chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # La cabecera sale aunque el catálogo esté vacío
+    writer.writerow(COLUMNS)
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    for rows in chunks:
+        writer.writerows(
+            record[:-2] + (int(record[-2]), int(record[-1])) for record in _records(request, rows))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def _jsonl_chunks(request, chunks):
+    for rows in chunks:
+        yield ''.join(
+            json.dumps(dict(zip(COLUMNS, record)), ensure_ascii=False) + '\n'
+            for record in _records(request, rows))
+
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream(request, formato, gzip=False, chunk_size=CHUNK_SIZE):
+    """Generador de bytes del feed ``formato`` ('csv' o 'jsonl')."""
+    encoder = _csv_chunks if formato == 'csv' else _jsonl_chunks
+    chunks = (text.encode() for text in encoder(request, iter_chunks(chunk_size)))
+    return _gzip(chunks) if gzip else chunks
@@ -0,0 +1,120 @@
+"""
+Derivados de ``Product.imagen``: varias anchuras en WebP y JPEG de respaldo.
+
+Los derivados se guardan junto al original con el hash de su contenido en
+el nombre (``productos/nevera.640w.3f9a1c2b7d.webp``), así que un nombre
+nunca cambia de contenido y se puede servir con caché inmutable.
+"""
+import hashlib
+import logging
+import os
+import posixpath
+from functools import lru_cache
+from io import BytesIO
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def _widths():
+    return sorted(settings.PRODUCT_IMAGE_WIDTHS)
+
+
+def _open(data):
+    image = Image.open(BytesIO(data))
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        # El JPEG no admite transparencia: se compone sobre fondo blanco
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def _encode(image, fmt):
+    pil_format, options = FORMATS[fmt]
+    buffer = BytesIO()
+    image.save(buffer, pil_format, **options)
+    return buffer.getvalue()
+
+
+def generate_derivatives(name, storage=None):
+    """
+    Genera los derivados de la imagen ``name`` y devuelve el diccionario que
+    se guarda en ``Product.imagen_derivados``.
+    """
+    storage = storage or default_storage
+    with storage.open(name, 'rb') as original:
+        image = _open(original.read())
+    stem = os.path.splitext(name)[0]
+    # Las anchuras mayores que la imagen se sustituyen por la suya, sin ampliar
+    widths = sorted({min(w, image.width) for w in _widths()})
+    derivados = {'original': name, 'webp': {}, 'jpeg': {}}
+    for width in widths:
+        resized = image.copy()
+        resized.thumbnail((width, width * 10), Image.LANCZOS)
+        for fmt in FORMATS:
+            data = _encode(resized, fmt)
+            digest = hashlib.sha256(data).hexdigest()[:10]
+            path = f'{stem}.{width}w.{digest}.{fmt}'
+            if not storage.exists(path):
+                storage.save(path, ContentFile(data))
+            derivados[fmt][str(width)] = path
+    return derivados
+
+
+def needs_derivatives(product):
+    return bool(product.imagen) and product.imagen_derivados.get('original') != product.imagen.name
+
+
+def process_image(job):
+    """Tarea para el pool de procesos: ``job`` es ``(pk, nombre_imagen)``."""
+    pk, name = job
+    try:
+        return pk, generate_derivatives(name)
+    except (OSError, Image.DecompressionBombError) as exc:
+        logger.warning('No se pudieron generar los derivados de %s: %s', name, exc)
+        return pk, None
+
+
+@lru_cache(maxsize=64)
+def _directory_url(directory):
+    return default_storage.url(f'{directory}/')
+
+
+def derivative_url(path):
+    # Los derivados están siempre junto al original, así que basta con
+    # resolver una vez la URL del directorio (storage.url es caro y al
+    # cargar la instantánea del catálogo se llama cientos de miles de veces).
+    directory, filename = posixpath.split(path)
+    return _directory_url(directory) + quote(filename)
+
+
+def srcset(derivados, fmt):
+    return ', '.join(
+        f'{derivative_url(path)} {width}w'
+        for width, path in sorted(derivados.get(fmt, {}).items(), key=lambda item: int(item[0]))
+    )
+
+
+def picture_sources(name, derivados):
+    """
+    ``(srcset_webp, srcset_jpeg, src_respaldo)`` para la etiqueta
+    ``<picture>``, o None si la imagen no tiene derivados al día.
+    """
+    if not name or not derivados.get('jpeg') or derivados.get('original') != name:
+        return None
+    jpeg = srcset(derivados, 'jpeg')
+    # El src de respaldo es el derivado JPEG más grande
+    return srcset(derivados, 'webp'), jpeg, jpeg.rsplit(', ', 1)[-1].rsplit(' ', 1)[0]
@@ -0,0 +1,246 @@
+"""
+Importación masiva de productos desde CSV o JSONL (manage.py import_products).
+
+El fichero se lee fila a fila y se procesa en lotes: cada lote se inserta o
+actualiza con ``bulk_create``/``bulk_update`` dentro de una transacción,
+emparejando por ``sku``. Las filas que no han cambiado no se tocan, así que
+reimportar el mismo fichero no escribe nada. Las imágenes se descargan y
+redimensionan en un pool de hilos mientras se siguen leyendo lotes.
+"""
+import csv
+import hashlib
+import json
+import os
+import urllib.request
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from . import cache as catalog_cache
+from . import facets, images, search
+from .models import Product, resumir_descripcion
+
+IMPORT_FIELDS = ('nombre', 'descripcion', 'precio', 'destacado', 'promocion')
+IMAGE_DIR = 'productos/importadas'
+MAX_IMAGE_BYTES = 20 * 1024 * 1024
+MAX_IMAGE_WIDTH = 2048
+TRUE_VALUES = {'1', 'true', 'si', 'sí', 'yes', 'x'}
+# Primer precio que ya no cabe en Product.precio (max_digits=10, decimal_places=2)
+_precio = Product._meta.get_field('precio')
+MAX_PRECIO = Decimal(10) ** (_precio.max_digits - _precio.decimal_places)
+
+
+class RowError(ValueError):
+    pass
+
+
+def iter_rows(path, fmt=None):
+    """
+    Recorre el fichero sin cargarlo entero en memoria. Una línea JSONL que
+    no se puede leer se devuelve como ``RowError`` en lugar de cortar la
+    importación, para que cuente como fila con error.
+    """
+    fmt = fmt or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+    with open(path, newline='', encoding='utf-8') as handle:
+        if fmt == 'csv':
+            yield from csv.DictReader(handle)
+        else:
+            for line in handle:
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError as exc:
+                    row = RowError(f'JSON no válido: {exc.msg}')
+                else:
+                    if not isinstance(row, dict):
+                        row = RowError('la línea no es un objeto JSON')
+                yield row
+
+
+def _bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or '').strip().lower() in TRUE_VALUES
+
+
+def clean_row(row):
+    if isinstance(row, RowError):
+        raise row
+    sku = str(row.get('sku') or '').strip()
+    nombre = str(row.get('nombre') or '').strip()
+    if not sku or not nombre:
+        raise RowError('faltan sku o nombre')
+    try:
+        precio = Decimal(str(row.get('precio')))
+        # NaN e Infinity no se pueden guardar; un precio con más cifras de
+        # las que admite el campo haría fallar el bulk_create de todo el lote
+        if not precio.is_finite():
+            raise InvalidOperation
+        precio = precio.quantize(Decimal('0.01'))
+        if abs(precio) >= MAX_PRECIO:
+            raise InvalidOperation
+    except (InvalidOperation, TypeError):
+        raise RowError(f'precio no válido: {row.get("precio")!r}')
+    return {
+        'sku': sku[:64],
+        'nombre': nombre[:100],
+        'descripcion': str(row.get('descripcion') or ''),
+        'precio': precio,
+        'destacado': _bool(row.get('destacado')),
+        'promocion': _bool(row.get('promocion')),
+        'imagen': str(row.get('imagen') or '').strip(),
+    }
+
+
+def image_name(sku, source):
+    digest = hashlib.sha1(source.encode(), usedforsecurity=False).hexdigest()[:10]
+    safe_sku = ''.join(c if c.isalnum() or c in '-_' else '_' for c in sku)
+    return f'{IMAGE_DIR}/{safe_sku}-{digest}.jpg'
+
+
+def _read_source(source, images_dir):
+    if source.startswith(('http://', 'https://')):
+        with urllib.request.urlopen(source, timeout=15) as response:  # nosec B310
+            return response.read(MAX_IMAGE_BYTES + 1)
+    path = os.path.join(images_dir or '', source)
+    with open(path, 'rb') as handle:
+        return handle.read(MAX_IMAGE_BYTES + 1)
+
+
+def fetch_image(pk, name, source, images_dir=None):
+    """Descarga, redimensiona y guarda la imagen; devuelve (pk, nombre, derivados)."""
+    if not default_storage.exists(name):
+        data = _read_source(source, images_dir)
+        if len(data) > MAX_IMAGE_BYTES:
+            raise OSError('imagen demasiado grande')
+        image = ImageOps.exif_transpose(Image.open(BytesIO(data))).convert('RGB')
+        image.thumbnail((MAX_IMAGE_WIDTH, MAX_IMAGE_WIDTH * 10), Image.LANCZOS)
+        buffer = BytesIO()
+        image.save(buffer, 'JPEG', quality=88, optimize=True)
+        default_storage.save(name, ContentFile(buffer.getvalue()))
+    return pk, name, images.generate_derivatives(name)
+
+
+@dataclass
+class ImportStats:
+    rows: int = 0
+    created: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    errors: list = field(default_factory=list)
+    images: int = 0
+    image_errors: int = 0
+
+
+class ProductImporter:
+    def __init__(self, batch_size=1000, workers=8, images_dir=None, fetch_images=True):
+        self.batch_size = batch_size
+        self.workers = workers
+        self.images_dir = images_dir
+        self.fetch_images = fetch_images
+        self.stats = ImportStats()
+        self._pending = set()
+        self._image_updates = []
+
+    def run(self, rows, progress=None):
+        pool = ThreadPoolExecutor(max_workers=self.workers) if self.fetch_images else None
+        self._pool = pool
+        try:
+            batch = []
+            for line, row in enumerate(rows, start=1):
+                self.stats.rows += 1
+                try:
+                    batch.append(clean_row(row))
+                except RowError as exc:
+                    self.stats.errors.append((line, str(exc)))
+                if len(batch) >= self.batch_size:
+                    self._import_batch(batch)
+                    batch = []
+                    if progress:
+                        progress(self.stats)
+            if batch:
+                self._import_batch(batch)
+            self._drain(wait_all=True)
+        finally:
+            if pool:
+                pool.shutdown()
+        # bulk_create/bulk_update no envían señales: se reconstruyen las
+        # estructuras derivadas de una vez al final
+        facets.rebuild_counts()
+        catalog_cache.bump_catalog_version()
+        return self.stats
+
+    def _import_batch(self, batch):
+        # La última aparición de cada sku dentro del lote es la que vale
+        by_sku = {row['sku']: row for row in batch}
+        existing = Product.objects.in_bulk(list(by_sku), field_name='sku')
+        now = timezone.now()
+        new, changed = [], []
+        for sku, row in by_sku.items():
+            product = existing.get(sku)
+            values = {name: row[name] for name in IMPORT_FIELDS}
+            if product is None:
+                product = Product(sku=sku, descripcion_corta=resumir_descripcion(values['descripcion']),
+                                  **values)
+                new.append(product)
+            elif any(getattr(product, name) != value for name, value in values.items()):
+                for name, value in values.items():
+                    setattr(product, name, value)
+                product.descripcion_corta = resumir_descripcion(product.descripcion)
+                product.actualizado = now
+                changed.append(product)
+            else:
+                self.stats.unchanged += 1
+
+        with transaction.atomic():
+            Product.objects.bulk_create(new, batch_size=self.batch_size)
+            Product.objects.bulk_update(
+                changed, IMPORT_FIELDS + ('descripcion_corta', 'actualizado'), batch_size=self.batch_size)
+            if new and new[0].pk is None:
+                # Backends que no devuelven los ids en bulk_create
+                ids = dict(Product.objects.filter(sku__in=[p.sku for p in new]).values_list('sku', 'id'))
+                for product in new:
+                    product.pk = ids[product.sku]
+            search.index_products(new + changed)
+        self.stats.created += len(new)
+        self.stats.updated += len(changed)
+        for product in changed:
+            catalog_cache.invalidate_product(product.pk)
+
+        if self._pool is not None:
+            for product in new + list(existing.values()):
+                source = by_sku[product.sku]['imagen']
+                if not source:
+                    continue
+                name = image_name(product.sku, source)
+                if product.imagen.name == name:
+                    continue
+                self._pending.add(self._pool.submit(fetch_image, product.pk, name, source, self.images_dir))
+            self._drain()
+
+    def _drain(self, wait_all=False):
+        # Limita las imágenes en vuelo para acotar la memoria
+        while self._pending and (wait_all or len(self._pending) > self.workers * 4):
+            done, self._pending = wait(self._pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    pk, name, derivados = future.result()
+                except (OSError, ValueError, Image.DecompressionBombError):
+                    self.stats.image_errors += 1
+                    continue
+                self._image_updates.append(
+                    Product(pk=pk, imagen=name, imagen_derivados=derivados, actualizado=timezone.now()))
+        if self._image_updates and (wait_all or len(self._image_updates) >= self.batch_size):
+            Product.objects.bulk_update(self._image_updates, ['imagen', 'imagen_derivados', 'actualizado'])
+            for product in self._image_updates:
+                catalog_cache.invalidate_product(product.pk)
+            self.stats.images += len(self._image_updates)
+            self._image_updates = []
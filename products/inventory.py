@@ -0,0 +1,89 @@
+"""
+Reserva de stock sin sobreventa.
+
+Un carrito entero se reserva con un único UPDATE condicional:
+
+    UPDATE products_product
+       SET stock = CASE id WHEN 1 THEN stock - 2 WHEN 7 THEN stock - 1 END
+     WHERE id IN (1, 7)
+       AND (stock IS NULL OR stock >= CASE id WHEN 1 THEN 2 WHEN 7 THEN 1 END)
+
+La base de datos evalúa la condición y el descuento de forma atómica, así
+que dos compras simultáneas no pueden llevarse la misma unidad. Si el número
+de filas actualizadas no coincide con el de productos, a alguno le falta
+stock y la transacción se deshace entera. En PostgreSQL las filas se
+bloquean antes con ``select_for_update`` en orden de id para que dos
+carritos con los mismos productos no se bloqueen mutuamente.
+
+``stock`` nulo significa que el producto no lleva control de existencias.
+"""
+from django.db import connection, transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+
+
+class StockError(Exception):
+    """No hay stock suficiente para alguno de los productos."""
+
+    def __init__(self, productos):
+        self.productos = productos
+        super().__init__('Sin stock suficiente: ' + ', '.join(productos))
+
+
+def _quantities(items):
+    cantidades = {}
+    for product_id, quantity in items:
+        cantidades[product_id] = cantidades.get(product_id, 0) + quantity
+    return cantidades
+
+
+def _per_product(cantidades, value):
+    return Case(
+        *[When(pk=pk, then=value(quantity)) for pk, quantity in cantidades.items()],
+        output_field=IntegerField(),
+    )
+
+
+def reserve(items):
+    """
+    Descuenta las cantidades de ``items`` (pares ``(product_id, cantidad)``)
+    o lanza ``StockError`` sin descontar nada.
+    """
+    from .models import Product
+
+    cantidades = _quantities(items)
+    if not cantidades:
+        return
+    with transaction.atomic():
+        productos = Product.objects.filter(pk__in=cantidades)
+        if connection.features.has_select_for_update:
+            list(productos.select_for_update().order_by('pk').values_list('pk', flat=True))
+        updated = productos.filter(
+            Q(stock__isnull=True) | Q(stock__gte=_per_product(cantidades, Value))
+        ).update(stock=_per_product(cantidades, lambda quantity: F('stock') - quantity))
+        if updated == len(cantidades):
+            return
+        # A algún producto le falta stock: se deshace el descuento del resto
+        transaction.set_rollback(True)
+    raise StockError(_agotados(cantidades))
+
+
+def _agotados(cantidades):
+    from .models import Product
+
+    filas = {pk: (nombre, stock) for pk, nombre, stock in
+             Product.objects.filter(pk__in=cantidades).values_list('pk', 'nombre', 'stock')}
+    # Un producto que ya no existe también cuenta como agotado
+    return [
+        filas.get(pk, (str(pk), 0))[0] for pk, quantity in cantidades.items()
+        if pk not in filas or (filas[pk][1] is not None and filas[pk][1] < quantity)
+    ]
+
+
+def release(items):
+    """Devuelve al stock las cantidades de una reserva que no se ha completado."""
+    from .models import Product
+
+    cantidades = _quantities(items)
+    if cantidades:
+        Product.objects.filter(pk__in=cantidades, stock__isnull=False).update(
+            stock=_per_product(cantidades, lambda quantity: F('stock') + quantity))
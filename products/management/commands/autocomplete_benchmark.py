@@ -0,0 +1,70 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from products import autocomplete
+
+TIPOS = ('Frigorífico', 'Lavadora', 'Secadora', 'Lavavajillas', 'Horno', 'Microondas',
+         'Cafetera', 'Aspiradora', 'Placa de inducción', 'Campana extractora', 'Congelador',
+         'Televisor', 'Batidora', 'Plancha de vapor', 'Tostadora')
+MARCAS = ('Bosch', 'Balay', 'Siemens', 'Samsung', 'LG', 'Teka', 'Zanussi', 'Whirlpool',
+          'Cecotec', 'Philips', 'Rowenta', 'Beko', 'Candy', 'Haier', 'Aeg')
+EXTRAS = ('combi', 'no frost', 'inox', 'blanco', 'integrable', 'compacto', 'eficiencia A',
+          'con grill', 'pirolítico', 'sin cable', '9 kg', 'XL', 'silencioso')
+
+
+class Command(BaseCommand):
+    help = 'Mide la latencia del autocompletado (p50/p99) sobre el catálogo o uno sintético'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--synthetic', type=int, metavar='N',
+                            help='Usa N productos generados en lugar de la base de datos')
+        parser.add_argument('--queries', type=int, default=20000, help='Consultas a medir')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        start = time.perf_counter()
+        if options['synthetic']:
+            rows = [
+                (pk, f'{rng.choice(TIPOS)} {rng.choice(MARCAS)} {rng.choice(EXTRAS)} {rng.randint(100, 999)}',
+                 Decimal(rng.randint(1000, 200000)) / 100, rng.randint(0, 500))
+                for pk in range(1, options['synthetic'] + 1)
+            ]
+            index = autocomplete.AutocompleteIndex(rows, settings.AUTOCOMPLETE_LIMIT)
+        else:
+            index = autocomplete.build(version=0)
+        build = time.perf_counter() - start
+        if not index.products:
+            self.stdout.write('No hay productos.')
+            return
+
+        # Prefijos de 1 a 8 letras de palabras reales del catálogo, a veces
+        # en mayúsculas o sin tildes como los escribiría un usuario
+        palabras = [p for row in rng.sample(index.products, min(len(index.products), 2000))
+                    for p in row[1].split()]
+        consultas = []
+        for _ in range(options['queries']):
+            palabra = rng.choice(palabras)
+            consulta = palabra[:rng.randint(1, 8)]
+            consultas.append(consulta.upper() if rng.random() < 0.1 else consulta)
+
+        tiempos = []
+        for consulta in consultas:
+            t0 = time.perf_counter_ns()
+            index.search(consulta)
+            tiempos.append(time.perf_counter_ns() - t0)
+        tiempos.sort()
+        percentil = lambda p: tiempos[min(len(tiempos) - 1, int(len(tiempos) * p))] / 1000
+
+        self.stdout.write(f'Productos: {len(index.products)}  Claves: {len(index.keys)}  '
+                          f'Prefijos precalculados: {len(index.top)}')
+        self.stdout.write(f'Construcción: {build:.2f}s')
+        self.stdout.write(
+            f'{len(tiempos)} consultas: media {statistics.fmean(tiempos) / 1000:.1f}µs  '
+            f'p50 {percentil(0.5):.1f}µs  p90 {percentil(0.9):.1f}µs  '
+            f'p99 {percentil(0.99):.1f}µs  máx {tiempos[-1] / 1000:.1f}µs')
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from products import cache as catalog_cache
+
+
+class Command(BaseCommand):
+    help = 'Muestra los aciertos y fallos de la caché del catálogo'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Pone los contadores a cero')
+
+    def handle(self, *args, **options):
+        for name, (hits, misses) in catalog_cache.stats().items():
+            total = hits + misses
+            rate = hits / total * 100 if total else 0
+            self.stdout.write(f'{name:<8} aciertos={hits} fallos={misses} tasa={rate:.1f}%')
+        if options['reset']:
+            catalog_cache.reset_stats()
+            self.stdout.write(self.style.SUCCESS('Contadores reiniciados'))
@@ -0,0 +1,58 @@
+import time
+import tracemalloc
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from products import snapshot as catalog_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Mide el tiempo de carga y la memoria de la instantánea del catálogo'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--synthetic', type=int, metavar='N',
+                            help='Mide una instantánea de N productos generados, sin base de datos')
+        parser.add_argument('--descripcion', type=int, default=400,
+                            help='Longitud de la descripción de los productos generados')
+
+    def handle(self, *args, **options):
+        # Se carga dos veces: la primera para medir el tiempo y la segunda
+        # para medir la memoria, porque tracemalloc ralentiza mucho la carga.
+        start = time.monotonic()
+        self._load(options)
+        elapsed = time.monotonic() - start
+        tracemalloc.start()
+        snapshot = self._load(options)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        total = len(snapshot.by_id)
+        self.stdout.write(f'Productos: {total}')
+        self.stdout.write(f'Destacados: {len(snapshot.destacados)}  Promociones: {len(snapshot.promociones)}')
+        self.stdout.write(f'Carga: {elapsed:.2f}s')
+        self.stdout.write(f'Memoria: {current / 2**20:.1f} MiB (pico {peak / 2**20:.1f} MiB)')
+        if total:
+            self.stdout.write(f'Por producto: {current / total:.0f} bytes')
+
+    def _load(self, options):
+        if options['synthetic']:
+            return self._synthetic(options['synthetic'], options['descripcion'])
+        return catalog_snapshot.load(version=0)
+
+    def _synthetic(self, n, descripcion):
+        now = timezone.now()
+        texto = 'x' * descripcion
+        by_id = {}
+        for pk in range(1, n + 1):
+            derivados = {
+                'original': f'productos/producto-{pk}.jpg',
+                'webp': {str(w): f'productos/producto-{pk}.{w}w.0123456789.webp' for w in (320, 640, 1024)},
+                'jpeg': {str(w): f'productos/producto-{pk}.{w}w.0123456789.jpeg' for w in (320, 640, 1024)},
+            }
+            by_id[pk] = catalog_snapshot.ProductSnapshot(
+                pk, f'Producto {pk}', f'{texto}{pk}', texto[:99], Decimal(pk) / 100,
+                f'productos/producto-{pk}.jpg', derivados, pk % 10 == 0, pk % 7 == 0, now,
+            )
+        return catalog_snapshot.CatalogSnapshot(by_id, 0, time.monotonic())
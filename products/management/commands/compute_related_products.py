@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from products import related
+
+
+class Command(BaseCommand):
+    help = 'Calcula los productos relacionados a partir del nombre y la descripción'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Recalcula todos los productos (por defecto, solo los modificados)')
+        parser.add_argument('--top-k', type=int,
+                            help='Vecinos guardados por producto (RELATED_PRODUCTS_TOP_K)')
+        parser.add_argument('--dimensions', type=int,
+                            help='Dimensiones de los vectores (RELATED_PRODUCTS_DIMENSIONS)')
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        stats = related.compute(full=options['full'], top_k=options['top_k'],
+                                dimensions=options['dimensions'])
+        elapsed = time.monotonic() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'{stats.computed} de {stats.products} productos recalculados, '
+            f'{stats.written} listas guardadas en {elapsed:.1f}s'))
@@ -0,0 +1,66 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.utils import timezone
+
+from products import cache as catalog_cache
+from products import images
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Genera los derivados WebP/JPEG de las imágenes de producto existentes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Procesos del pool (por defecto, uno por CPU)')
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help='Productos por cada bulk_update')
+        parser.add_argument('--force', action='store_true',
+                            help='Regenera también los que ya tienen derivados')
+
+    def handle(self, *args, **options):
+        productos = Product.objects.exclude(imagen='').only('id', 'imagen', 'imagen_derivados')
+        jobs = [
+            (p.pk, p.imagen.name)
+            for p in productos.iterator(chunk_size=2000)
+            if options['force'] or images.needs_derivatives(p)
+        ]
+        if not jobs:
+            self.stdout.write('No hay imágenes pendientes.')
+            return
+
+        start = time.monotonic()
+        # Los procesos hijos no deben heredar las conexiones abiertas. Dentro
+        # de una transacción (call_command desde una prueba) no se pueden
+        # cerrar; los hijos no usan la base de datos
+        if not connection.in_atomic_block:
+            connections.close_all()
+        done, failed, batch = 0, 0, []
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as pool:
+            for pk, derivados in pool.map(images.process_image, jobs, chunksize=8):
+                if derivados is None:
+                    failed += 1
+                    continue
+                batch.append(Product(pk=pk, imagen_derivados=derivados, actualizado=timezone.now()))
+                if len(batch) >= options['batch_size']:
+                    done += self._save(batch)
+                    batch = []
+        if batch:
+            done += self._save(batch)
+
+        elapsed = time.monotonic() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'{done} imágenes procesadas, {failed} con errores, '
+            f'en {elapsed:.1f}s ({done / elapsed:.1f} img/s)'))
+
+    def _save(self, batch):
+        # bulk_update no envía señales, así que se invalida la caché a mano
+        Product.objects.bulk_update(batch, ['imagen_derivados', 'actualizado'])
+        for producto in batch:
+            catalog_cache.invalidate_product(producto.pk)
+        return len(batch)
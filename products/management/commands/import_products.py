@@ -0,0 +1,53 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.importer import ProductImporter, iter_rows
+
+
+class Command(BaseCommand):
+    help = 'Importa productos desde un fichero CSV o JSONL, emparejando por sku'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Fichero .csv o .jsonl')
+        parser.add_argument('--format', choices=('csv', 'jsonl'),
+                            help='Formato del fichero (por defecto, según la extensión)')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Filas por transacción de bulk_create/bulk_update')
+        parser.add_argument('--workers', type=int, default=8,
+                            help='Hilos para descargar y redimensionar imágenes')
+        parser.add_argument('--images-dir',
+                            help='Directorio base de las imágenes con ruta relativa '
+                                 '(por defecto, el del fichero)')
+        parser.add_argument('--no-images', action='store_true',
+                            help='No descarga ni procesa imágenes')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f'No existe el fichero {path}')
+
+        start = time.monotonic()
+
+        def progress(stats):
+            elapsed = time.monotonic() - start
+            self.stdout.write(f'{stats.rows} filas ({stats.rows / elapsed:.0f} filas/s)')
+
+        importer = ProductImporter(
+            batch_size=options['batch_size'],
+            workers=options['workers'],
+            images_dir=options['images_dir'] or os.path.dirname(os.path.abspath(path)),
+            fetch_images=not options['no_images'],
+        )
+        stats = importer.run(iter_rows(path, options['format']),
+                             progress=progress if options['verbosity'] > 1 else None)
+
+        for line, error in stats.errors[:20]:
+            self.stderr.write(f'Fila {line}: {error}')
+        elapsed = time.monotonic() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'{stats.rows} filas en {elapsed:.1f}s ({stats.rows / elapsed:.0f} filas/s): '
+            f'{stats.created} creados, {stats.updated} actualizados, '
+            f'{stats.unchanged} sin cambios, {len(stats.errors)} con errores; '
+            f'{stats.images} imágenes ({stats.image_errors} con errores)'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from products import cache as catalog_cache
+from products import facets
+
+
+class Command(BaseCommand):
+    help = 'Recalcula los recuentos precalculados de las facetas del catálogo'
+
+    def handle(self, *args, **options):
+        total = facets.rebuild_counts()
+        catalog_cache.bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(f'Recuentos recalculados para {total} productos'))
@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from products import search
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye el índice de búsqueda de texto completo del catálogo'
+
+    def handle(self, *args, **options):
+        if not search.is_supported():
+            self.stdout.write(self.style.WARNING(
+                'La base de datos no soporta el índice de texto completo.'))
+            return
+        start = time.monotonic()
+        total = search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexados {total} productos en {time.monotonic() - start:.2f}s'))
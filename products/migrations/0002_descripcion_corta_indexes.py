@@ -0,0 +1,46 @@
+# Generated by Django 5.1.15 on 2026-10-18 06:45
+
+from django.db import migrations, models
+from django.utils.text import Truncator
+
+
+def rellenar_descripcion_corta(apps, schema_editor):
+    Product = apps.get_model("products", "Product")
+    productos = Product.objects.only("id", "descripcion")
+    lote = []
+    for producto in productos.iterator(chunk_size=1000):
+        producto.descripcion_corta = Truncator(producto.descripcion).chars(100)
+        lote.append(producto)
+        if len(lote) >= 1000:
+            Product.objects.bulk_update(lote, ["descripcion_corta"])
+            lote = []
+    if lote:
+        Product.objects.bulk_update(lote, ["descripcion_corta"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="descripcion_corta",
+            field=models.CharField(blank=True, editable=False, max_length=100),
+        ),
+        migrations.RunPython(rellenar_descripcion_corta, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["destacado", "id"], name="product_destacado_id_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["promocion", "id"], name="product_promocion_id_idx"
+            ),
+        ),
+    ]
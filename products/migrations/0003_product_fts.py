@@ -0,0 +1,23 @@
+from django.db import migrations
+
+from products import search
+
+
+def crear_indice(apps, schema_editor):
+    search.create_index(schema_editor)
+    search.populate_index(schema_editor)
+
+
+def eliminar_indice(apps, schema_editor):
+    search.drop_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0002_descripcion_corta_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indice, eliminar_indice),
+    ]
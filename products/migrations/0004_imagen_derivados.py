@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-18 06:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0003_product_fts"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="imagen_derivados",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.15 on 2026-10-18 07:02
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0004_imagen_derivados"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="actualizado",
+            field=models.DateTimeField(
+                auto_now=True, db_index=True, default=django.utils.timezone.now
+            ),
+            preserve_default=False,
+        ),
+    ]
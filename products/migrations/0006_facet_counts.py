@@ -0,0 +1,51 @@
+# Generated by Django 5.1.15 on 2026-10-18 07:02
+
+from django.db import migrations, models
+
+from products import facets
+
+
+def calcular_recuentos(apps, schema_editor):
+    facets.rebuild_counts(
+        apps.get_model("products", "Product"), apps.get_model("products", "FacetCount")
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0005_product_actualizado"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FacetCount",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("banda_precio", models.PositiveSmallIntegerField()),
+                ("destacado", models.BooleanField()),
+                ("promocion", models.BooleanField()),
+                ("total", models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(fields=["precio", "id"], name="product_precio_id_idx"),
+        ),
+        migrations.AddConstraint(
+            model_name="facetcount",
+            constraint=models.UniqueConstraint(
+                fields=("banda_precio", "destacado", "promocion"),
+                name="unique_facet_combination",
+            ),
+        ),
+        migrations.RunPython(calcular_recuentos, migrations.RunPython.noop),
+    ]
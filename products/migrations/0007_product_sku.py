@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-18 07:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0006_facet_counts"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="sku",
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+    ]
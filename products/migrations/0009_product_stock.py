@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-18 07:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0008_related_products"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="stock",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.15 on 2026-10-18 08:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0009_product_stock"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DeletedProduct",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("product_id", models.BigIntegerField()),
+                ("deleted_at", models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+    ]
@@ -1,12 +1,110 @@
 from django.db import models
+from django.utils.text import Truncator
+
+DESCRIPCION_CORTA_LENGTH = 100
+
+
+def resumir_descripcion(descripcion):
+    return Truncator(descripcion).chars(DESCRIPCION_CORTA_LENGTH)
+
 
 class Product(models.Model):
+    # Referencia del proveedor, clave de las importaciones (import_products)
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     nombre = models.CharField(max_length=100)
     descripcion = models.TextField()
+    # Copia recortada de la descripción para los listados, así las tarjetas
+    # no necesitan cargar el TextField completo.
+    descripcion_corta = models.CharField(max_length=DESCRIPCION_CORTA_LENGTH, blank=True, editable=False)
     precio = models.DecimalField(max_digits=10, decimal_places=2)
     imagen = models.ImageField(upload_to='productos/')
+    # Rutas de los derivados de la imagen por formato y anchura (products.images)
+    imagen_derivados = models.JSONField(default=dict, blank=True, editable=False)
     destacado = models.BooleanField(default=False)
     promocion = models.BooleanField(default=False)
+    actualizado = models.DateTimeField(auto_now=True, db_index=True)
+    # Unidades disponibles; nulo si el producto no lleva control de stock.
+    # Se descuenta con products.inventory.reserve, nunca leyendo y guardando.
+    stock = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['destacado', 'id'], name='product_destacado_id_idx'),
+            models.Index(fields=['promocion', 'id'], name='product_promocion_id_idx'),
+            models.Index(fields=['precio', 'id'], name='product_precio_id_idx'),
+        ]
+
+    def __str__(self):
+        return self.nombre
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Valores de faceta con los que se cargó, para ajustar los recuentos
+        # precalculados al guardar (products.facets)
+        from .facets import FACET_FIELDS, facet_key
+        if not instance.get_deferred_fields() & set(FACET_FIELDS):
+            instance._loaded_facet_key = facet_key(instance)
+        return instance
+
+    @property
+    def picture_sources(self):
+        from .images import picture_sources
+        return picture_sources(self.imagen.name, self.imagen_derivados)
+
+    def save(self, *args, **kwargs):
+        self.descripcion_corta = resumir_descripcion(self.descripcion)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            update_fields = {*update_fields, 'actualizado'}
+            if 'descripcion' in update_fields:
+                update_fields.add('descripcion_corta')
+            kwargs['update_fields'] = update_fields
+        super().save(*args, **kwargs)
+
+
+class FacetCount(models.Model):
+    """Número de productos por combinación de valores de faceta."""
+    banda_precio = models.PositiveSmallIntegerField()
+    destacado = models.BooleanField()
+    promocion = models.BooleanField()
+    total = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['banda_precio', 'destacado', 'promocion'], name='unique_facet_combination'),
+        ]
+
+    def __str__(self):
+        return f'{self.banda_precio}/{self.destacado}/{self.promocion}: {self.total}'
+
+
+class RelatedProduct(models.Model):
+    """Vecinos más parecidos de cada producto, calculados por products.related."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='relacionados')
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='relacionado_en')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+    calculado = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            # También es el índice de la consulta de product_detail
+            models.UniqueConstraint(fields=['product', 'rank'], name='unique_related_rank'),
+        ]
+
+    def __str__(self):
+        return f'{self.product_id} -> {self.related_id} ({self.score:.2f})'
+
+
+class DeletedProduct(models.Model):
+    """
+    Productos borrados recientemente. Las instantáneas del catálogo
+    (products.snapshot) quitan los suyos sin recorrer todos los ids.
+    """
+    product_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
     def __str__(self):
-        return self.nombre
\ No newline at end of file
+        return f'{self.product_id} ({self.deleted_at})'
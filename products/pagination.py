@@ -0,0 +1,71 @@
+from collections.abc import Sequence
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Q
+
+# Ordenaciones soportadas por la paginación por cursor (keyset). Cada una
+# termina en 'id' para que la clave sea única y el orden estable.
+ORDER_ID = ('id',)
+ORDER_PRECIO = ('precio', 'id')
+
+
+class KeysetPage(Sequence):
+    """Página de resultados más el cursor para pedir la siguiente."""
+
+    def __init__(self, items, next_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+    def __len__(self):
+        return len(self.items)
+
+
+def encode_cursor(obj, order=ORDER_ID):
+    if order == ORDER_PRECIO:
+        return f'{obj.precio}_{obj.id}'
+    return str(obj.id)
+
+
+def decode_cursor(cursor, order=ORDER_ID):
+    """Devuelve la clave del cursor o None si no es válido."""
+    if not cursor:
+        return None
+    try:
+        if order == ORDER_PRECIO:
+            precio, pk = cursor.split('_', 1)
+            precio = Decimal(precio)
+            # NaN, sNaN e Infinity son Decimal válidos pero no precios
+            if not precio.is_finite():
+                return None
+            return precio, int(pk)
+        return (int(cursor),)
+    except (ValueError, InvalidOperation):
+        return None
+
+
+def keyset_page(queryset, cursor=None, size=12, order=ORDER_ID):
+    """
+    Devuelve la página que sigue a ``cursor`` buscando directamente en el
+    índice (WHERE clave > cursor ... LIMIT) en lugar de usar OFFSET, de forma
+    que el coste no crece con la profundidad de la página.
+    """
+    key = decode_cursor(cursor, order)
+    if key is not None:
+        if order == ORDER_PRECIO:
+            precio, pk = key
+            queryset = queryset.filter(Q(precio__gt=precio) | Q(precio=precio, id__gt=pk))
+        else:
+            queryset = queryset.filter(id__gt=key[0])
+    items = list(queryset.order_by(*order)[:size + 1])
+    next_cursor = None
+    if len(items) > size:
+        items = items[:size]
+        next_cursor = encode_cursor(items[-1], order)
+    return KeysetPage(items, next_cursor)
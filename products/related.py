@@ -0,0 +1,193 @@
+"""
+Productos relacionados calculados fuera de línea (compute_related_products).
+
+Cada producto se representa con un vector TF-IDF de su nombre (con doble
+peso) y su descripción. Para no depender del tamaño del vocabulario los
+términos se proyectan con *feature hashing* sobre
+``RELATED_PRODUCTS_DIMENSIONS`` columnas con signo aleatorio, lo que
+conserva aproximadamente el coseno. La similitud se calcula por bloques de
+filas con NumPy y se guardan los ``RELATED_PRODUCTS_TOP_K`` vecinos de cada
+producto en ``RelatedProduct``.
+
+En modo incremental solo se recalculan los productos modificados desde su
+último cálculo y aquellos cuya lista de vecinos puede cambiar por ellos.
+El IDF se recalcula siempre con el catálogo entero, así que las listas que
+no se tocan pueden quedar con pesos algo antiguos; ``--full`` lo rehace todo.
+"""
+import zlib
+from dataclasses import dataclass
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Max, Q
+from django.utils import timezone
+
+from . import cache as catalog_cache
+from .text import tokens
+
+BLOCK_SIZE = 256
+# Por debajo de esta similitud dos productos no se consideran relacionados
+MIN_SCORE = 0.05
+
+
+@dataclass
+class RelatedStats:
+    products: int = 0
+    computed: int = 0
+    written: int = 0
+
+
+def _documents(Product):
+    rows = Product.objects.order_by('id').values_list('id', 'nombre', 'descripcion')
+    for pk, nombre, descripcion in rows.iterator(chunk_size=2000):
+        terms = tokens(nombre)
+        yield pk, terms + terms + tokens(descripcion)
+
+
+def vectorize(documents, dimensions):
+    """
+    Devuelve ``(ids, matriz)`` con una fila normalizada (L2) por documento.
+    ``documents`` es un iterable de ``(id, lista_de_términos)``.
+    """
+    vocabulario = {}
+    ids, doc_index, term_ids, counts = [], [], [], []
+    for row, (pk, terms) in enumerate(documents):
+        ids.append(pk)
+        frecuencias = {}
+        for term in terms:
+            term_id = vocabulario.setdefault(term, len(vocabulario))
+            frecuencias[term_id] = frecuencias.get(term_id, 0) + 1
+        doc_index.extend([row] * len(frecuencias))
+        term_ids.extend(frecuencias)
+        counts.extend(frecuencias.values())
+
+    n = len(ids)
+    matriz = np.zeros((n, dimensions), dtype=np.float32)
+    if not term_ids:
+        return np.array(ids, dtype=np.int64), matriz
+    doc_index = np.array(doc_index, dtype=np.int64)
+    term_ids = np.array(term_ids, dtype=np.int64)
+    counts = np.array(counts, dtype=np.float32)
+
+    df = np.bincount(term_ids, minlength=len(vocabulario))
+    idf = (np.log((1 + n) / (1 + df)) + 1).astype(np.float32)
+    hashes = np.array([zlib.crc32(term.encode()) for term in vocabulario], dtype=np.uint32)
+    bucket = (hashes % dimensions).astype(np.int64)
+    sign = np.where(hashes >> 31, -1, 1).astype(np.float32)
+
+    pesos = (1 + np.log(counts)) * idf[term_ids] * sign[term_ids]
+    np.add.at(matriz, (doc_index, bucket[term_ids]), pesos)
+    normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+    np.divide(matriz, normas, out=matriz, where=normas > 0)
+    return np.array(ids, dtype=np.int64), matriz
+
+
+def _neighbours(matriz, rows, top_k):
+    """Para cada bloque de ``rows``: (filas, índices de vecinos, similitudes, máximo por columna)."""
+    n = matriz.shape[0]
+    k = min(top_k, n - 1)
+    for start in range(0, len(rows), BLOCK_SIZE):
+        block = rows[start:start + BLOCK_SIZE]
+        sim = matriz[block] @ matriz.T
+        sim[np.arange(len(block)), block] = -1
+        if k <= 0:
+            yield block, np.empty((len(block), 0), dtype=np.int64), sim[:, :0], sim
+            continue
+        top = np.argpartition(-sim, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(sim, top, axis=1)
+        order = np.argsort(-scores, axis=1, kind='stable')
+        yield block, np.take_along_axis(top, order, axis=1), np.take_along_axis(scores, order, axis=1), sim
+
+
+def _stored(RelatedProduct):
+    """Listas guardadas: {product_id: [(related_id, score), ...]} ordenadas por rank."""
+    stored = {}
+    rows = RelatedProduct.objects.order_by('product_id', 'rank').values_list(
+        'product_id', 'related_id', 'score')
+    for product_id, related_id, score in rows.iterator(chunk_size=5000):
+        stored.setdefault(product_id, []).append((related_id, score))
+    return stored
+
+
+def _stale(Product):
+    # Los productos sin ninguna fila (nuevos o sin vecinos por encima de
+    # MIN_SCORE) se consideran siempre pendientes
+    return set(Product.objects.annotate(calculado=Max('relacionados__calculado'))
+               .filter(Q(calculado__isnull=True) | Q(actualizado__gt=F('calculado')))
+               .values_list('id', flat=True))
+
+
+def compute(full=False, top_k=None, dimensions=None):
+    from .models import Product, RelatedProduct
+
+    top_k = top_k or settings.RELATED_PRODUCTS_TOP_K
+    dimensions = dimensions or settings.RELATED_PRODUCTS_DIMENSIONS
+    calculado = timezone.now()
+    ids, matriz = vectorize(_documents(Product), dimensions)
+    stats = RelatedStats(products=len(ids))
+    position = {int(pk): row for row, pk in enumerate(ids)}
+
+    stored = {} if full else _stored(RelatedProduct)
+    if full or not stored:
+        changed = np.arange(len(ids))
+        affected = np.empty(0, dtype=np.int64)
+    else:
+        stale = _stale(Product)
+        changed = np.array(sorted(position[pk] for pk in stale if pk in position), dtype=np.int64)
+        # Un producto sin cambios puede necesitar otra lista si alguno de los
+        # modificados le resulta ahora más parecido que su último vecino, si
+        # tenía alguno de ellos en su lista o si le falta algún vecino.
+        best = np.full(len(ids), -1, dtype=np.float32)
+        results = []
+        for block, top, scores, sim in _neighbours(matriz, changed, top_k):
+            np.maximum(best, sim.max(axis=0), out=best)
+            results.append((block, top, scores))
+        changed_ids = {int(ids[row]) for row in changed}
+        affected = []
+        for row, pk in enumerate(ids.tolist()):
+            if pk in changed_ids:
+                continue
+            actual = stored.get(pk, [])
+            umbral = actual[-1][1] if len(actual) >= top_k else MIN_SCORE
+            if best[row] > umbral or any(related in changed_ids for related, _ in actual):
+                affected.append(row)
+        affected = np.array(affected, dtype=np.int64)
+
+    def listas(rows, precomputed=None):
+        for block, top, scores in precomputed or (r[:3] for r in _neighbours(matriz, rows, top_k)):
+            for row, vecinos, similitudes in zip(block, top, scores):
+                yield int(ids[row]), [
+                    (int(ids[v]), float(s)) for v, s in zip(vecinos, similitudes) if s >= MIN_SCORE]
+
+    def pending():
+        yield from listas(changed, results if not full and stored else None)
+        for pk, vecinos in listas(affected):
+            # Solo se reescriben las listas que cambian de verdad
+            if [related for related, _ in vecinos] != [related for related, _ in stored.get(pk, [])]:
+                yield pk, vecinos
+
+    stats.computed = len(changed) + len(affected)
+    batch = []
+    for item in pending():
+        batch.append(item)
+        if len(batch) >= 1000:
+            stats.written += _save(RelatedProduct, batch, calculado)
+            batch = []
+    if batch:
+        stats.written += _save(RelatedProduct, batch, calculado)
+    if stats.written:
+        catalog_cache.bump_catalog_version()
+    return stats
+
+
+def _save(RelatedProduct, batch, calculado):
+    with transaction.atomic():
+        RelatedProduct.objects.filter(product_id__in=[pk for pk, _ in batch]).delete()
+        RelatedProduct.objects.bulk_create([
+            RelatedProduct(product_id=pk, related_id=related, rank=rank, score=score, calculado=calculado)
+            for pk, vecinos in batch
+            for rank, (related, score) in enumerate(vecinos)
+        ])
+    return len(batch)
+
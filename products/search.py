@@ -0,0 +1,245 @@
+"""
+Índice de búsqueda de texto completo para el catálogo.
+
+En SQLite se usa una tabla virtual FTS5 y en PostgreSQL una tabla con un
+``tsvector`` y un índice GIN. En ambos casos la tabla se llama
+``products_product_fts`` y está indexada por el id del producto.
+"""
+import re
+from collections import namedtuple
+
+from django.db import connection, transaction
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+FTS_TABLE = 'products_product_fts'
+PG_CONFIG = 'spanish'
+MAX_TERMS = 8
+
+# Marcas que el motor inserta alrededor de las coincidencias. Son caracteres
+# de control para poder escapar el texto antes de convertirlas en <mark>.
+_START, _STOP = '\x02', '\x03'
+
+SearchResult = namedtuple('SearchResult', 'id rank nombre fragmento')
+
+
+def _vendor():
+    return connection.vendor
+
+
+def is_supported():
+    return _vendor() in ('sqlite', 'postgresql')
+
+
+def _terms(query):
+    return re.findall(r'\w+', query.lower())[:MAX_TERMS]
+
+
+def _highlight(text):
+    text = escape(text or '')
+    return mark_safe(text.replace(_START, '<mark>').replace(_STOP, '</mark>'))
+
+
+# Creación de la tabla (la usan las migraciones)
+
+def create_index(schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5('
+            "nombre, descripcion, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            f'CREATE TABLE IF NOT EXISTS {FTS_TABLE} ('
+            'product_id bigint PRIMARY KEY REFERENCES products_product (id) '
+            'ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+            'document tsvector NOT NULL)'
+        )
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {FTS_TABLE}_document_idx '
+            f'ON {FTS_TABLE} USING GIN (document)'
+        )
+
+
+def drop_index(schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+# Mantenimiento del índice
+
+def index_products(products):
+    """Inserta o actualiza en el índice los productos dados."""
+    rows = [(p.pk, p.nombre, p.descripcion) for p in products]
+    if not rows or not is_supported():
+        return
+    with transaction.atomic(), connection.cursor() as cursor:
+        if _vendor() == 'sqlite':
+            cursor.execute(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({", ".join(["%s"] * len(rows))})',
+                [row[0] for row in rows],
+            )
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, nombre, descripcion) VALUES (%s, %s, %s)',
+                rows,
+            )
+        else:
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (product_id, document) VALUES '
+                f"(%s, setweight(to_tsvector('{PG_CONFIG}', %s), 'A') || "
+                f"setweight(to_tsvector('{PG_CONFIG}', %s), 'B')) "
+                'ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document',
+                rows,
+            )
+
+
+def remove_products(pks):
+    pks = list(pks)
+    if not pks or not is_supported():
+        return
+    column = 'rowid' if _vendor() == 'sqlite' else 'product_id'
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {FTS_TABLE} WHERE {column} IN ({", ".join(["%s"] * len(pks))})',
+            pks,
+        )
+
+
+def _populate(cursor, vendor):
+    if vendor == 'sqlite':
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, nombre, descripcion) '
+            'SELECT id, nombre, descripcion FROM products_product'
+        )
+    else:
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (product_id, document) '
+            f"SELECT id, setweight(to_tsvector('{PG_CONFIG}', nombre), 'A') || "
+            f"setweight(to_tsvector('{PG_CONFIG}', descripcion), 'B') "
+            'FROM products_product'
+        )
+    return cursor.rowcount
+
+
+def populate_index(schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor in ('sqlite', 'postgresql'):
+        with schema_editor.connection.cursor() as cursor:
+            _populate(cursor, vendor)
+
+
+def rebuild_index():
+    """Reconstruye el índice completo y devuelve el número de productos."""
+    if not is_supported():
+        return 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        return _populate(cursor, _vendor())
+
+
+# Consultas
+
+def _sqlite_match(terms):
+    # Cada término se cita para neutralizar la sintaxis de FTS5 y se busca
+    # por prefijo con '*'.
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def _pg_tsquery(terms):
+    return ' & '.join(f'{term}:*' for term in terms)
+
+
+def match_subquery(query):
+    """
+    Subconsulta con los ids que coinciden con ``query``, para filtrar un
+    queryset con ``id__in`` sin traer la lista de ids a Python.
+    """
+    terms = _terms(query)
+    if not terms:
+        return RawSQL('SELECT NULL WHERE 1 = 0', [])
+    if _vendor() == 'sqlite':
+        return RawSQL(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+            [_sqlite_match(terms)],
+        )
+    return RawSQL(
+        f'SELECT product_id FROM {FTS_TABLE} '
+        f"WHERE document @@ to_tsquery('{PG_CONFIG}', %s)",
+        [_pg_tsquery(terms)],
+    )
+
+
+def search_ids(query, limit=None):
+    """Ids de los productos que coinciden con ``query``, por relevancia."""
+    from .models import Product
+
+    terms = _terms(query)
+    if not terms:
+        return []
+    if not is_supported():
+        queryset = Product.objects.all()
+        for term in terms:
+            queryset = queryset.filter(nombre__icontains=term)
+        return list(queryset.values_list('id', flat=True)[:limit])
+    with connection.cursor() as cursor:
+        if _vendor() == 'sqlite':
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                f'ORDER BY bm25({FTS_TABLE}, 10.0, 1.0) LIMIT %s',
+                [_sqlite_match(terms), -1 if limit is None else limit],
+            )
+        else:
+            cursor.execute(
+                f'SELECT product_id FROM {FTS_TABLE}, '
+                f"to_tsquery('{PG_CONFIG}', %s) query WHERE document @@ query "
+                'ORDER BY ts_rank(document, query) DESC LIMIT %s',
+                [_pg_tsquery(terms), limit],
+            )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search(query, limit=20):
+    """
+    Devuelve una lista de ``SearchResult`` ordenada por relevancia, con el
+    nombre y un fragmento de la descripción resaltados con ``<mark>``.
+    """
+    from .models import Product
+
+    terms = _terms(query)
+    if not terms:
+        return []
+    if not is_supported():
+        return [
+            SearchResult(pk, 0, escape(nombre), escape(corta))
+            for pk, nombre, corta in Product.objects.filter(
+                id__in=search_ids(query, limit)
+            ).values_list('id', 'nombre', 'descripcion_corta')
+        ]
+    with connection.cursor() as cursor:
+        if _vendor() == 'sqlite':
+            cursor.execute(
+                f'SELECT rowid, bm25({FTS_TABLE}, 10.0, 1.0) AS rank, '
+                f"highlight({FTS_TABLE}, 0, %s, %s), "
+                f"snippet({FTS_TABLE}, 1, %s, %s, '…', 16) "
+                f'FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s ORDER BY rank LIMIT %s',
+                [_START, _STOP, _START, _STOP, _sqlite_match(terms), limit],
+            )
+        else:
+            options = f'StartSel={_START}, StopSel={_STOP}'
+            cursor.execute(
+                'SELECT p.id, r.rank, '
+                f"ts_headline('{PG_CONFIG}', p.nombre, r.query, %s), "
+                f"ts_headline('{PG_CONFIG}', p.descripcion, r.query, %s) "
+                'FROM (SELECT product_id, query, ts_rank(document, query) AS rank '
+                f"FROM {FTS_TABLE}, to_tsquery('{PG_CONFIG}', %s) query "
+                'WHERE document @@ query ORDER BY rank DESC LIMIT %s) r '
+                'JOIN products_product p ON p.id = r.product_id ORDER BY r.rank DESC',
+                [f'{options}, HighlightAll=true', f'{options}, MaxWords=25, MinWords=10',
+                 _pg_tsquery(terms), limit],
+            )
+        return [
+            SearchResult(pk, rank, _highlight(nombre), _highlight(fragmento))
+            for pk, rank, nombre, fragmento in cursor.fetchall()
+        ]
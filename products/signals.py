@@ -0,0 +1,94 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import cache as catalog_cache
+from . import facets, images, search
+from .models import DeletedProduct, Product
+
+SEARCH_FIELDS = {'nombre', 'descripcion'}
+
+
+@receiver(post_save, sender=Product)
+def generate_image_derivatives(sender, instance, raw=False, **kwargs):
+    # Se ejecuta antes de invalidar la caché para que las tarjetas que se
+    # rendericen a continuación ya incluyan el srcset.
+    if raw or not images.needs_derivatives(instance):
+        return
+    pk, derivados = images.process_image((instance.pk, instance.imagen.name))
+    if derivados is not None:
+        instance.imagen_derivados = derivados
+        instance.actualizado = timezone.now()
+        Product.objects.filter(pk=pk).update(
+            imagen_derivados=derivados, actualizado=instance.actualizado)
+
+
+def _stored_facet_key(pk):
+    row = Product.objects.filter(pk=pk).values_list(*facets.FACET_FIELDS).first()
+    return (facets.price_band(row[0]), row[1], row[2]) if row is not None else None
+
+
+@receiver(pre_save, sender=Product)
+def remember_facet_key(sender, instance, **kwargs):
+    if instance._state.adding or hasattr(instance, '_loaded_facet_key'):
+        return
+    # Instancia cargada sin los campos de faceta: se leen los valores actuales
+    instance._loaded_facet_key = _stored_facet_key(instance.pk)
+
+
+@receiver(pre_delete, sender=Product)
+def remember_facet_key_on_delete(sender, instance, **kwargs):
+    # En post_delete la fila ya no existe y leer un campo diferido fallaría
+    if not hasattr(instance, '_loaded_facet_key'):
+        instance._loaded_facet_key = _stored_facet_key(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+def update_facet_counts(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and not set(facets.FACET_FIELDS) & set(update_fields):
+        return
+    old_key = None if created else getattr(instance, '_loaded_facet_key', None)
+    new_key = facets.facet_key(instance)
+    facets.product_changed(old_key, new_key)
+    instance._loaded_facet_key = new_key
+
+
+@receiver(post_delete, sender=Product)
+def discount_facet_counts(sender, instance, **kwargs):
+    facets.product_changed(instance._loaded_facet_key, None)
+
+
+@receiver(post_delete, sender=Product)
+def record_deleted_product(sender, instance, **kwargs):
+    DeletedProduct.objects.create(product_id=instance.pk)
+    # Una instantánea más antigua que CATALOG_SNAPSHOT_MAX_AGE se recarga
+    # entera, así que no necesita los borrados anteriores
+    limite = timezone.now() - timedelta(
+        seconds=settings.CATALOG_SNAPSHOT_MAX_AGE + settings.CATALOG_SNAPSHOT_SAFETY_WINDOW)
+    DeletedProduct.objects.filter(deleted_at__lt=limite).delete()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_cache(sender, instance, **kwargs):
+    pk = instance.pk
+    catalog_cache.invalidate_product(pk)
+    # Se repite al confirmar la transacción por si otra petición ha
+    # guardado en caché datos anteriores mientras tanto.
+    transaction.on_commit(lambda: catalog_cache.invalidate_product(pk))
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not SEARCH_FIELDS & set(update_fields):
+        return
+    search.index_products([instance])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    search.remove_products([instance.pk])
@@ -0,0 +1,208 @@
+"""
+Instantánea inmutable del catálogo en memoria de cada proceso.
+
+Cuando ``CATALOG_SNAPSHOT_ENABLED`` está activo, ``home`` y
+``product_detail`` se sirven desde aquí sin consultas SQL. Cada proceso carga
+la instantánea una vez y, cuando cambia la versión del catálogo (que se
+incrementa en cada escritura de ``Product``), construye una nueva aplicando
+solo las filas modificadas desde la anterior y quitando las borradas según
+``DeletedProduct``. Como ``actualizado`` se fija al guardar y no al
+confirmar, se vuelve a leer ``CATALOG_SNAPSHOT_SAFETY_WINDOW`` segundos antes
+del último cambio visto. La instantánea nunca se
+modifica: se sustituye la referencia entera, así que las peticiones en curso
+siguen viendo una copia coherente.
+
+Con varios procesos la versión tiene que vivir en una caché compartida
+(``CACHE_BACKEND``) para que todos vean los cambios; ``CATALOG_SNAPSHOT_MAX_AGE``
+fuerza además una recarga completa periódica.
+"""
+import threading
+import time
+from bisect import bisect_right
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from . import cache as catalog_cache
+from .images import picture_sources
+from .pagination import KeysetPage
+
+FIELDS = (
+    'id', 'nombre', 'descripcion', 'descripcion_corta', 'precio', 'imagen',
+    'imagen_derivados', 'destacado', 'promocion', 'actualizado',
+)
+
+
+class ImagenSnapshot:
+    """Sustituto de ``FieldFile`` con lo que usan las plantillas."""
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+    @property
+    def url(self):
+        return default_storage.url(self.name) if self.name else ''
+
+    def __bool__(self):
+        return bool(self.name)
+
+    def __str__(self):
+        return self.name
+
+
+class ProductSnapshot:
+    # En lugar del JSON de derivados se guardan ya calculados los srcset,
+    # que ocupan bastante menos que los diccionarios anidados.
+    __slots__ = tuple(f for f in FIELDS if f != 'imagen_derivados') + ('picture_sources',)
+
+    def __init__(self, id, nombre, descripcion, descripcion_corta, precio, imagen,
+                 imagen_derivados, destacado, promocion, actualizado):
+        self.id = id
+        self.nombre = nombre
+        self.descripcion = descripcion
+        self.descripcion_corta = descripcion_corta
+        self.precio = precio
+        self.imagen = ImagenSnapshot(imagen)
+        self.picture_sources = picture_sources(imagen, imagen_derivados)
+        self.destacado = destacado
+        self.promocion = promocion
+        self.actualizado = actualizado
+
+    @property
+    def pk(self):
+        return self.id
+
+    def __str__(self):
+        return self.nombre
+
+
+class CatalogSnapshot:
+    __slots__ = ('by_id', 'related', 'related_calculado', 'destacados', 'promociones', 'version',
+                 'last_modified', 'loaded_at', 'deleted_since')
+
+    def __init__(self, by_id, version, loaded_at, related=None, related_calculado=None, deleted_since=None):
+        self.by_id = by_id
+        self.version = version
+        self.loaded_at = loaded_at
+        # Los borrados anteriores a este momento ya están aplicados
+        self.deleted_since = deleted_since
+        # Ids de los productos relacionados de cada uno (products.related)
+        self.related = related or {}
+        self.related_calculado = related_calculado
+        # Listas de ids ordenadas para paginar por cursor con bisect
+        self.destacados = tuple(sorted(pk for pk, p in by_id.items() if p.destacado))
+        self.promociones = tuple(sorted(pk for pk, p in by_id.items() if p.promocion))
+        self.last_modified = max((p.actualizado for p in by_id.values()), default=None)
+
+    def get(self, pk):
+        return self.by_id.get(pk)
+
+    def related_products(self, pk, limit):
+        productos = (self.by_id.get(related) for related in self.related.get(pk, ()))
+        return [producto for producto in productos if producto is not None][:limit]
+
+    def page(self, section, cursor=None, size=12):
+        ids = getattr(self, section)
+        try:
+            start = bisect_right(ids, int(cursor)) if cursor else 0
+        except ValueError:
+            start = 0
+        page_ids = ids[start:start + size]
+        has_next = start + size < len(ids)
+        return KeysetPage(
+            [self.by_id[pk] for pk in page_ids],
+            str(page_ids[-1]) if has_next else None,
+        )
+
+
+def _rows(queryset):
+    rows = queryset.values_list(*FIELDS).iterator(chunk_size=2000)
+    return {row[0]: ProductSnapshot(*row) for row in rows}
+
+
+def _related(queryset):
+    related, calculado = {}, None
+    rows = queryset.order_by('product_id', 'rank').values_list('product_id', 'related_id', 'calculado')
+    for product_id, related_id, row_calculado in rows.iterator(chunk_size=10000):
+        related.setdefault(product_id, []).append(related_id)
+        calculado = max(calculado, row_calculado) if calculado else row_calculado
+    return {pk: tuple(ids) for pk, ids in related.items()}, calculado
+
+
+def load(version=None):
+    from .models import Product, RelatedProduct
+
+    version = catalog_cache.catalog_version() if version is None else version
+    deleted_since = timezone.now()
+    related, calculado = _related(RelatedProduct.objects.all())
+    return CatalogSnapshot(
+        _rows(Product.objects.all()), version, time.monotonic(), related, calculado, deleted_since)
+
+
+def refresh(snapshot, version):
+    """Nueva instantánea con los cambios posteriores a ``snapshot``."""
+    from .models import DeletedProduct, Product, RelatedProduct
+
+    window = timedelta(seconds=settings.CATALOG_SNAPSHOT_SAFETY_WINDOW)
+    deleted_since = timezone.now()
+    by_id = dict(snapshot.by_id)
+    if snapshot.last_modified is not None:
+        changed = Product.objects.filter(actualizado__gte=snapshot.last_modified - window)
+    else:
+        changed = Product.objects.all()
+    by_id.update(_rows(changed))
+    borrados = set(DeletedProduct.objects.filter(deleted_at__gte=snapshot.deleted_since - window)
+                   .values_list('product_id', flat=True))
+    if borrados:
+        # Un id puede volver a existir (SQLite reutiliza el último)
+        borrados -= set(Product.objects.filter(pk__in=borrados).values_list('id', flat=True))
+        for pk in borrados:
+            by_id.pop(pk, None)
+
+    related, calculado = snapshot.related, snapshot.related_calculado
+    if calculado is not None:
+        nuevas = RelatedProduct.objects.filter(calculado__gte=calculado)
+    else:
+        nuevas = RelatedProduct.objects.all()
+    cambios, nuevo_calculado = _related(nuevas)
+    if cambios:
+        related = {**related, **cambios}
+        calculado = nuevo_calculado
+    return CatalogSnapshot(by_id, version, snapshot.loaded_at, related, calculado, deleted_since)
+
+
+_snapshot = None
+_lock = threading.Lock()
+
+
+def enabled():
+    return settings.CATALOG_SNAPSHOT_ENABLED
+
+
+def get_snapshot():
+    """Devuelve la instantánea al día, o None si está desactivada."""
+    global _snapshot
+    if not enabled():
+        return None
+    version = catalog_cache.catalog_version()
+    current = _snapshot
+    expired = (current is not None
+               and time.monotonic() - current.loaded_at > settings.CATALOG_SNAPSHOT_MAX_AGE)
+    if current is not None and current.version == version and not expired:
+        return current
+    with _lock:
+        if _snapshot is current:
+            if current is None or expired:
+                _snapshot = load(version)
+            else:
+                _snapshot = refresh(current, version)
+        return _snapshot
+
+
+def reset():
+    global _snapshot
+    with _lock:
+        _snapshot = None
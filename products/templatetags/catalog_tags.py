@@ -0,0 +1,51 @@
+from django import template
+from django.template.loader import render_to_string
+from django.templatetags.static import static
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+
+from products import cache as catalog_cache
+
+register = template.Library()
+
+
+def _cached_fragment(context, kind, product_context, pk):
+    html = catalog_cache.cached_fragment(kind, pk, lambda: render_to_string(
+        catalog_cache.FRAGMENT_TEMPLATES[kind], {**product_context, 'csrf_token': catalog_cache.CSRF_PLACEHOLDER}))
+    return mark_safe(catalog_cache.fill_csrf(html, str(context.get('csrf_token', ''))))
+
+
+@register.simple_tag(takes_context=True)
+def product_card(context, producto):
+    return _cached_fragment(
+        context, 'card', {'producto': producto}, producto.pk)
+
+
+@register.simple_tag(takes_context=True)
+def product_detail_body(context, product):
+    return _cached_fragment(
+        context, 'detail', {'product': product}, product.pk)
+
+
+@register.simple_tag
+def product_picture(producto, sizes='100vw', css_class='', loading='lazy'):
+    """
+    ``<picture>`` con ``srcset`` WebP y JPEG a partir de los derivados de la
+    imagen del producto, o un ``<img>`` simple si todavía no existen.
+    """
+    if not producto.imagen:
+        return format_html(
+            '<img src="{}" alt="{}" class="{}">',
+            static('images/default-product.jpg'), producto.nombre, css_class)
+    sources = producto.picture_sources
+    if sources is None:
+        return format_html(
+            '<img src="{}" alt="{}" class="{}" loading="{}">',
+            producto.imagen.url, producto.nombre, css_class, loading)
+    webp_srcset, jpeg_srcset, fallback = sources
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" alt="{}" class="{}" loading="{}">'
+        '</picture>',
+        webp_srcset, sizes, fallback, jpeg_srcset, sizes, producto.nombre, css_class, loading)
@@ -1,7 +1,30 @@
-from django.test import TestCase, Client
+import csv
+import gzip
+import json
+import re
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+from PIL import Image
+from django.contrib.admin.sites import site
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import connection, models
+from django.test.utils import CaptureQueriesContext
+from django.core.management import call_command
+from django.test import TestCase, Client, RequestFactory, override_settings
 from django.urls import reverse
 from django.core.files.uploadedfile import SimpleUploadedFile
-from .models import Product
+from django.middleware.csrf import _does_token_match
+from cart.models import CartItem
+from . import autocomplete
+from . import cache as catalog_cache
+from . import facets, images, related
+from . import snapshot as catalog_snapshot
+from .models import FacetCount, Product, RelatedProduct
 
 # Create your tests here.
 
@@ -25,6 +48,13 @@ class ProductModelTest(TestCase):
     def test_product_str(self):
         self.assertEqual(str(self.product), "Lavadora Test")
 
+    def test_descripcion_corta(self):
+        self.product.descripcion = "x" * 300
+        self.product.save(update_fields=['descripcion'])
+        self.product.refresh_from_db()
+        self.assertEqual(len(self.product.descripcion_corta), 100)
+        self.assertTrue(self.product.descripcion_corta.endswith("…"))
+
 class ProductViewsTest(TestCase):
     def setUp(self):
         self.client = Client()
@@ -67,3 +97,711 @@ class ProductViewsTest(TestCase):
         url = reverse('product_detail', args=[999])  # ID inexistente
         response = self.client.get(url)
         self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CATALOG_PAGE_SIZE=2)
+class HomePaginationTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.productos = [
+            Product.objects.create(
+                nombre=f"Producto {i}",
+                descripcion="Descripción larga " * 20,
+                precio=100 + i,
+                destacado=True,
+                promocion=i % 2 == 0
+            )
+            for i in range(5)
+        ]
+        self.home_url = reverse('home')
+
+    def test_keyset_pages(self):
+        response = self.client.get(self.home_url)
+        pagina = response.context['productos_destacados']
+        self.assertEqual(list(pagina), self.productos[:2])
+        self.assertEqual(pagina.next_cursor, str(self.productos[1].id))
+
+        response = self.client.get(self.home_url, {'destacados': pagina.next_cursor})
+        pagina = response.context['productos_destacados']
+        self.assertEqual(list(pagina), self.productos[2:4])
+
+        response = self.client.get(self.home_url, {'destacados': pagina.next_cursor})
+        pagina = response.context['productos_destacados']
+        self.assertEqual(list(pagina), self.productos[4:])
+        self.assertFalse(pagina.has_next)
+        self.assertNotIn('destacados_next_url', response.context)
+
+    def test_cursor_invalido_vuelve_al_inicio(self):
+        response = self.client.get(self.home_url, {'destacados': 'abc'})
+        self.assertEqual(list(response.context['productos_destacados']), self.productos[:2])
+
+    def test_promociones_paginadas_y_renderizadas(self):
+        response = self.client.get(self.home_url)
+        promociones = response.context['promociones']
+        self.assertEqual(list(promociones), [self.productos[0], self.productos[2]])
+        self.assertContains(response, "En Promoción")
+        self.assertContains(response, "Ver más promociones")
+
+    def test_listado_no_carga_descripcion(self):
+        response = self.client.get(self.home_url)
+        producto = response.context['productos_destacados'][0]
+        self.assertIn('descripcion', producto.get_deferred_fields())
+        self.assertContains(response, producto.descripcion_corta)
+
+
+class ProductSearchTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.frigorifico = Product.objects.create(
+            nombre="Frigorífico Combi",
+            descripcion="Frigorífico de dos puertas con congelador No Frost",
+            precio=699.99
+        )
+        self.lavadora = Product.objects.create(
+            nombre="Lavadora Carga Frontal",
+            descripcion="Lavadora silenciosa con programa para frigoríficos de ropa delicada",
+            precio=399.99
+        )
+        self.search_url = reverse('search')
+        self.search_json_url = reverse('search_json')
+
+    def test_busqueda_por_prefijo_sin_acentos(self):
+        response = self.client.get(self.search_url, {'q': 'frigo'})
+        self.assertEqual(response.status_code, 200)
+        ids = [producto.id for hit, producto in response.context['resultados']]
+        # La coincidencia en el nombre pesa más que en la descripción
+        self.assertEqual(ids, [self.frigorifico.id, self.lavadora.id])
+
+    def test_resultados_resaltados_y_escapados(self):
+        Product.objects.create(
+            nombre="Horno <script>", descripcion="Horno de convección", precio=250
+        )
+        response = self.client.get(self.search_json_url, {'q': 'horno'})
+        resultado = response.json()['results'][0]
+        self.assertEqual(resultado['nombre_resaltado'], '<mark>Horno</mark> &lt;script&gt;')
+        self.assertIn('<mark>Horno</mark>', resultado['fragmento'])
+
+    def test_indice_sincronizado_con_cambios(self):
+        self.lavadora.nombre = "Secadora Bomba de Calor"
+        self.lavadora.descripcion = "Secadora eficiente"
+        self.lavadora.save()
+        response = self.client.get(self.search_json_url, {'q': 'secadora'})
+        self.assertEqual([r['id'] for r in response.json()['results']], [self.lavadora.id])
+
+        self.lavadora.delete()
+        response = self.client.get(self.search_json_url, {'q': 'secadora'})
+        self.assertEqual(response.json()['results'], [])
+
+    def test_sintaxis_fts_neutralizada(self):
+        response = self.client.get(self.search_json_url, {'q': '"frigo* OR NEAR('})
+        self.assertEqual(response.status_code, 200)
+
+    def test_rebuild_search_index(self):
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Indexados 2 productos', out.getvalue())
+        response = self.client.get(self.search_json_url, {'q': 'lavadora'})
+        self.assertEqual(response.json()['results'][0]['id'], self.lavadora.id)
+
+    def test_admin_usa_indice(self):
+        model_admin = site._registry[Product]
+        request = RequestFactory().get('/admin/products/product/', {'q': 'combi'})
+        queryset, may_have_duplicates = model_admin.get_search_results(
+            request, Product.objects.all(), 'combi')
+        self.assertEqual(list(queryset), [self.frigorifico])
+        self.assertIn('products_product_fts', str(queryset.query))
+
+
+class CatalogCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.product = Product.objects.create(
+            nombre="Lavadora Destacada",
+            descripcion="Una lavadora destacada",
+            precio=349.99,
+            destacado=True
+        )
+        self.home_url = reverse('home')
+
+    def test_home_anonima_cacheada(self):
+        self.client.get(self.home_url)
+        # Solo queda la consulta de los validadores de la petición condicional
+        with self.assertNumQueries(1):
+            response = self.client.get(self.home_url)
+        self.assertContains(response, "Lavadora Destacada")
+        self.assertEqual(catalog_cache.stats()['page'], (1, 1))
+
+    def test_token_csrf_propio_en_pagina_cacheada(self):
+        self.client.get(self.home_url)
+        otro = Client(enforce_csrf_checks=True)
+        response = otro.get(self.home_url)
+        self.assertNotContains(response, catalog_cache.CSRF_PLACEHOLDER)
+        token = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', response.content.decode()).group(1)
+        self.assertTrue(_does_token_match(token, otro.cookies['csrftoken'].value))
+
+    def test_edicion_invalida_pagina_y_fragmentos(self):
+        self.client.get(self.home_url)
+        self.product.nombre = "Lavadora Renovada"
+        self.product.save()
+        response = self.client.get(self.home_url)
+        self.assertContains(response, "Lavadora Renovada")
+        response = self.client.get(reverse('product_detail', args=[self.product.id]))
+        self.assertContains(response, "Lavadora Renovada")
+
+    def test_clave_de_fragmento_versionada(self):
+        clave = catalog_cache.fragment_key('card', self.product.pk)
+        self.assertNotEqual(clave, catalog_cache.fragment_key('detail', self.product.pk))
+        with mock.patch.object(catalog_cache, 'FRAGMENT_VERSION', catalog_cache.FRAGMENT_VERSION + 1):
+            self.assertNotEqual(catalog_cache.fragment_key('card', self.product.pk), clave)
+        # Otra plantilla (otro despliegue) da otra clave
+        catalog_cache._template_version.cache_clear()
+        try:
+            with mock.patch.dict(catalog_cache.FRAGMENT_TEMPLATES, card='products/_product_detail_body.html'):
+                self.assertNotEqual(catalog_cache.fragment_key('card', self.product.pk), clave)
+        finally:
+            catalog_cache._template_version.cache_clear()
+
+    def test_usuario_autenticado_no_usa_cache_de_pagina(self):
+        User.objects.create_user(username='testuser', password='testpassword')
+        self.client.login(username='testuser', password='testpassword')
+        self.client.get(self.home_url)
+        response = self.client.get(self.home_url)
+        self.assertIn('productos_destacados', response.context)
+        self.assertEqual(catalog_cache.stats()['page'], (0, 0))
+        # La tarjeta del producto sí sale del fragmento cacheado
+        self.assertEqual(catalog_cache.stats()['card'], (1, 1))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), PRODUCT_IMAGE_WIDTHS=(100, 200))
+class ProductImageDerivativesTest(TestCase):
+    def _imagen(self, nombre='nevera.png', size=(400, 300)):
+        buffer = BytesIO()
+        Image.new('RGBA', size, (200, 30, 30, 128)).save(buffer, 'PNG')
+        return SimpleUploadedFile(nombre, buffer.getvalue(), content_type='image/png')
+
+    def test_derivados_al_subir(self):
+        producto = Product.objects.create(
+            nombre="Nevera", descripcion="Nevera", precio=499, imagen=self._imagen())
+        derivados = Product.objects.get(pk=producto.pk).imagen_derivados
+        self.assertEqual(derivados['original'], producto.imagen.name)
+        self.assertEqual(set(derivados['webp']), {'100', '200'})
+        self.assertEqual(set(derivados['jpeg']), {'100', '200'})
+        for path in list(derivados['webp'].values()) + list(derivados['jpeg'].values()):
+            self.assertTrue(default_storage.exists(path))
+            self.assertTrue(path.startswith('productos/nevera'))
+        with default_storage.open(derivados['webp']['200']) as derivado:
+            self.assertEqual(Image.open(derivado).size, (200, 150))
+
+    def test_no_se_amplian_imagenes_pequenas(self):
+        producto = Product.objects.create(
+            nombre="Horno", descripcion="Horno", precio=199, imagen=self._imagen('horno.png', (150, 150)))
+        derivados = Product.objects.get(pk=producto.pk).imagen_derivados
+        self.assertEqual(set(derivados['jpeg']), {'100', '150'})
+
+    def test_cada_anchura_se_codifica_una_vez(self):
+        with mock.patch.object(images, '_encode', wraps=images._encode) as encode:
+            Product.objects.create(
+                nombre="Nevera", descripcion="Nevera", precio=499, imagen=self._imagen(size=(400, 300)))
+        # 100 y 200 en WebP y JPEG
+        self.assertEqual(encode.call_count, 4)
+
+    def test_srcset_en_las_tarjetas(self):
+        Product.objects.create(
+            nombre="Nevera", descripcion="Nevera", precio=499, destacado=True, imagen=self._imagen())
+        cache.clear()
+        response = self.client.get(reverse('home'))
+        self.assertRegex(
+            response.content.decode(),
+            r'<source type="image/webp" srcset="/media/productos/nevera\S*\.100w\.\w+\.webp 100w, ')
+        self.assertContains(response, '.jpeg 200w" sizes=')
+
+    def test_backfill_command(self):
+        producto = Product.objects.create(
+            nombre="Nevera", descripcion="Nevera", precio=499, imagen=self._imagen())
+        Product.objects.filter(pk=producto.pk).update(imagen_derivados={})
+        out = StringIO()
+        call_command('generate_image_derivatives', workers=2, stdout=out)
+        self.assertIn('1 imágenes procesadas', out.getvalue())
+        self.assertEqual(
+            Product.objects.get(pk=producto.pk).imagen_derivados['original'], producto.imagen.name)
+
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.product = Product.objects.create(
+            nombre="Lavadora Destacada",
+            descripcion="Una lavadora destacada",
+            precio=349.99,
+            destacado=True
+        )
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.home_url = reverse('home')
+        self.detail_url = reverse('product_detail', args=[self.product.id])
+
+    def test_home_304_si_no_cambia(self):
+        # La primera visita fija la cookie CSRF, que forma parte de la variante
+        self.client.get(self.home_url)
+        etag = self.client.get(self.home_url)['ETag']
+        response = self.client.get(self.home_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        self.product.precio = 299.99
+        self.product.save()
+        response = self.client.get(self.home_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_detalle_304_con_consulta_ligera(self):
+        response = self.client.get(self.detail_url)
+        self.assertIn('Last-Modified', response)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                self.detail_url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('descripcion', queries[0]['sql'])
+
+    def test_variantes_anonima_y_autenticada_no_colisionan(self):
+        anonima = self.client.get(self.detail_url)
+        self.client.login(username='testuser', password='testpassword')
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=anonima['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Last-Modified', response)
+        self.assertIn('private', response['Cache-Control'])
+
+        otro = User.objects.create_user(username='otro', password='testpassword')
+        etag = response['ETag']
+        self.client.force_login(otro)
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_cambio_en_el_carrito_cambia_la_etag(self):
+        self.client.login(username='testuser', password='testpassword')
+        etag = self.client.get(self.home_url)['ETag']
+        CartItem.objects.create(user=self.user, product=self.product)
+        response = self.client.get(self.home_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_producto_inexistente_sigue_dando_404(self):
+        response = self.client.get(reverse('product_detail', args=[999]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_busqueda_json_condicional(self):
+        url = reverse('search_json')
+        response = self.client.get(url, {'q': 'lavadora'})
+        self.assertIn('public', response['Cache-Control'])
+        response = self.client.get(url, {'q': 'lavadora'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+
+@override_settings(CATALOG_SNAPSHOT_ENABLED=True, CATALOG_PAGE_SIZE=2)
+class CatalogSnapshotTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        catalog_snapshot.reset()
+        self.client = Client()
+        self.productos = [
+            Product.objects.create(
+                nombre=f"Producto {i}",
+                descripcion=f"Descripción {i}",
+                precio=100 + i,
+                destacado=i < 3,
+                promocion=i >= 3
+            )
+            for i in range(5)
+        ]
+        self.addCleanup(catalog_snapshot.reset)
+
+    def test_vistas_sin_consultas(self):
+        detail_url = reverse('product_detail', args=[self.productos[0].id])
+        self.client.get(reverse('home'))
+        self.client.get(detail_url)
+        cache.clear()
+        catalog_cache.bump_catalog_version()
+        catalog_snapshot.get_snapshot()
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('home'))
+            self.assertEqual(
+                [p.id for p in response.context['productos_destacados']],
+                [p.id for p in self.productos[:2]])
+            self.assertEqual(response.context['productos_destacados'].next_cursor,
+                             str(self.productos[1].id))
+            response = self.client.get(detail_url)
+            self.assertContains(response, "Descripción 0")
+            response = self.client.get(reverse('product_detail', args=[999]))
+            self.assertEqual(response.status_code, 404)
+
+    def test_paginacion_por_cursor(self):
+        response = self.client.get(reverse('home'), {'destacados': self.productos[1].id})
+        self.assertEqual(
+            [p.id for p in response.context['productos_destacados']], [self.productos[2].id])
+        self.assertFalse(response.context['productos_destacados'].has_next)
+
+    def test_refresco_incremental(self):
+        anterior = catalog_snapshot.get_snapshot()
+        self.productos[0].nombre = "Producto renombrado"
+        self.productos[0].destacado = False
+        self.productos[0].save()
+        self.productos[4].delete()
+        nueva = catalog_snapshot.get_snapshot()
+        self.assertIsNot(nueva, anterior)
+        self.assertEqual(nueva.get(self.productos[0].id).nombre, "Producto renombrado")
+        self.assertIsNone(nueva.get(self.productos[4].id))
+        self.assertEqual(nueva.destacados, (self.productos[1].id, self.productos[2].id))
+        self.assertEqual(nueva.promociones, (self.productos[3].id,))
+        # La instantánea anterior no se modifica
+        self.assertEqual(anterior.get(self.productos[0].id).nombre, "Producto 0")
+
+    def test_confirmacion_tardia(self):
+        anterior = catalog_snapshot.get_snapshot()
+        # Una transacción que guardó antes del último cambio visto y confirma después
+        Product.objects.filter(pk=self.productos[1].pk).update(
+            nombre="Confirmado tarde", actualizado=anterior.last_modified - timedelta(seconds=5))
+        catalog_cache.bump_catalog_version()
+        self.assertEqual(catalog_snapshot.get_snapshot().get(self.productos[1].id).nombre, "Confirmado tarde")
+
+    def test_borrados_sin_recorrer_el_catalogo(self):
+        catalog_snapshot.get_snapshot()
+        self.productos[4].delete()
+        with CaptureQueriesContext(connection) as queries:
+            nueva = catalog_snapshot.get_snapshot()
+        self.assertIsNone(nueva.get(self.productos[4].id))
+        # Ninguna consulta de productos sin WHERE
+        sin_filtro = [q['sql'] for q in queries.captured_queries
+                      if 'FROM "products_product"' in q['sql'] and 'WHERE' not in q['sql']]
+        self.assertEqual(sin_filtro, [])
+
+    @override_settings(CATALOG_SNAPSHOT_ENABLED=False)
+    def test_desactivada(self):
+        self.assertIsNone(catalog_snapshot.get_snapshot())
+        response = self.client.get(reverse('home'))
+        self.assertIsInstance(response.context['productos_destacados'][0], Product)
+
+
+@override_settings(CATALOG_PAGE_SIZE=2)
+class CatalogFacetsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.barato = Product.objects.create(nombre="Tostadora", descripcion="x", precio=49.99, promocion=True)
+        self.medio = Product.objects.create(nombre="Microondas", descripcion="x", precio=149, destacado=True)
+        self.medio_oferta = Product.objects.create(
+            nombre="Aspiradora", descripcion="x", precio=149, destacado=True, promocion=True)
+        self.caro = Product.objects.create(nombre="Frigorífico", descripcion="x", precio=1299, promocion=True)
+        self.catalog_url = reverse('catalog')
+
+    def _recuentos(self):
+        return sorted(FacetCount.objects.filter(total__gt=0).values_list(
+            'banda_precio', 'destacado', 'promocion', 'total'))
+
+    def test_recuentos_incrementales_coinciden_con_reconstruccion(self):
+        self.barato.precio = 399
+        self.barato.save()
+        self.medio.destacado = False
+        self.medio.save()
+        # Instancia cargada sin los campos de faceta
+        producto = Product.objects.only('id', 'nombre').get(pk=self.caro.pk)
+        producto.promocion = False
+        producto.save()
+        self.medio_oferta.delete()
+        # Borrado de instancias sin los campos de faceta
+        Product.objects.filter(pk=self.medio.pk).only('id', 'nombre').delete()
+        incrementales = self._recuentos()
+        facets.rebuild_counts()
+        self.assertEqual(incrementales, self._recuentos())
+
+    def test_filtros_y_recuentos_sin_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.catalog_url, {'promocion': '1'})
+        self.assertFalse(any('COUNT(' in q['sql'] for q in queries))
+        facetas = response.context['facetas']
+        self.assertEqual(facetas['total'], 3)
+        self.assertEqual([b['total'] for b in facetas['precio']], [1, 1, 0, 0, 1])
+        # La faceta de promoción no se filtra a sí misma
+        self.assertEqual(facetas['promocion'], 3)
+        self.assertEqual(facetas['destacado'], 1)
+        self.assertEqual(list(response.context['productos']), [self.barato, self.medio_oferta])
+
+    def test_paginacion_por_precio(self):
+        response = self.client.get(self.catalog_url)
+        pagina = response.context['productos']
+        self.assertEqual(list(pagina), [self.barato, self.medio])
+        self.assertEqual(pagina.next_cursor, f'149.00_{self.medio.id}')
+        response = self.client.get(self.catalog_url, {'cursor': pagina.next_cursor})
+        self.assertEqual(list(response.context['productos']), [self.medio_oferta, self.caro])
+
+    def test_cursor_no_numerico(self):
+        for cursor in ('NaN_1', 'Infinity_1', '-Infinity_1', 'sNaN_2', '1e999999_1', '149.00_99999999999999999999999'):
+            response = self.client.get(self.catalog_url, {'cursor': cursor})
+            self.assertEqual(response.status_code, 200, cursor)
+
+    def test_filtro_por_banda(self):
+        response = self.client.get(self.catalog_url, {'precio': '1', 'destacado': '1'})
+        self.assertEqual(list(response.context['productos']), [self.medio, self.medio_oferta])
+        self.assertContains(response, '?destacado=1"')
+
+    def test_rebuild_facet_counts(self):
+        FacetCount.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_facet_counts', stdout=out)
+        self.assertIn('4 productos', out.getvalue())
+        self.assertEqual(sum(row[3] for row in self._recuentos()), 4)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), PRODUCT_IMAGE_WIDTHS=(100, 200))
+class ImportProductsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.dir = tempfile.mkdtemp()
+        Image.new('RGB', (300, 200), (10, 120, 200)).save(f'{self.dir}/lavadora.png')
+
+    def _escribir(self, nombre, contenido):
+        path = f'{self.dir}/{nombre}'
+        with open(path, 'w', encoding='utf-8') as handle:
+            handle.write(contenido)
+        return path
+
+    def _importar(self, path, *args):
+        out = StringIO()
+        call_command('import_products', path, *args, stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def test_importacion_csv_idempotente(self):
+        path = self._escribir('catalogo.csv', (
+            'sku,nombre,descripcion,precio,destacado,promocion,imagen\n'
+            'LV-1,Lavadora,Lavadora de carga frontal,399.90,1,0,lavadora.png\n'
+            'SC-1,Secadora,Secadora con bomba de calor,549,0,si,\n'
+            ',Sin sku,x,10,0,0,\n'
+        ))
+        salida = self._importar(path, '--batch-size', '1')
+        self.assertIn('2 creados', salida)
+        self.assertIn('1 con errores', salida)
+        self.assertIn('filas/s', salida)
+
+        lavadora = Product.objects.get(sku='LV-1')
+        self.assertEqual(str(lavadora.precio), '399.90')
+        self.assertTrue(lavadora.destacado)
+        self.assertEqual(lavadora.descripcion_corta, 'Lavadora de carga frontal')
+        self.assertTrue(default_storage.exists(lavadora.imagen.name))
+        self.assertEqual(lavadora.imagen_derivados['original'], lavadora.imagen.name)
+        self.assertTrue(Product.objects.get(sku='SC-1').promocion)
+        self.assertEqual(FacetCount.objects.aggregate(n=models.Sum('total'))['n'], 2)
+
+        antes = dict(Product.objects.values_list('sku', 'actualizado'))
+        with CaptureQueriesContext(connection) as queries:
+            salida = self._importar(path)
+        self.assertIn('0 creados, 0 actualizados, 2 sin cambios', salida)
+        self.assertEqual(Product.objects.count(), 2)
+        self.assertEqual(dict(Product.objects.values_list('sku', 'actualizado')), antes)
+        self.assertFalse([q for q in queries if q['sql'].startswith(('INSERT', 'UPDATE'))
+                          and 'products_product"' in q['sql']])
+
+    def test_importacion_jsonl_actualiza_por_sku(self):
+        Product.objects.create(sku='HR-1', nombre='Horno', descripcion='Horno', precio=199)
+        path = self._escribir('catalogo.jsonl', (
+            '{"sku": "HR-1", "nombre": "Horno pirolítico", "descripcion": "Horno", "precio": "249"}\n'
+            '\n'
+            '{"sku": "MO-1", "nombre": "Microondas", "precio": 89, "promocion": true}\n'
+        ))
+        salida = self._importar(path, '--no-images')
+        self.assertIn('1 creados, 1 actualizados', salida)
+        self.assertEqual(Product.objects.get(sku='HR-1').nombre, 'Horno pirolítico')
+        self.assertTrue(Product.objects.get(sku='MO-1').promocion)
+        response = self.client.get(reverse('search'), {'q': 'pirolitico'})
+        self.assertContains(response, 'Horno')
+
+    def test_filas_no_validas_no_cortan_la_importacion(self):
+        path = self._escribir('catalogo.jsonl', (
+            '{"sku": "A-1", "nombre": "Nevera", "precio": "NaN"}\n'
+            '{"sku": "A-2", "nombre": "Horno", "precio": "1e20"}\n'
+            '{"sku": "A-3", "nombre": "Microondas", "precio": "Infinity"}\n'
+            '{"sku": "A-4", "nombre": \n'
+            '["A-5", "Lavadora", 10]\n'
+            '{"sku": "A-6", "nombre": "Secadora", "precio": "99999999.99"}\n'
+        ))
+        salida = self._importar(path, '--no-images', '--batch-size', '10')
+        self.assertIn('1 creados, 0 actualizados, 0 sin cambios, 5 con errores', salida)
+        self.assertEqual(list(Product.objects.values_list('sku', flat=True)), ['A-6'])
+
+
+class ProductFeedTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.nevera = Product.objects.create(
+            sku='NV-1', nombre='Nevera "Combi"', descripcion='Dos puertas, no frost', precio=699, destacado=True)
+        self.horno = Product.objects.create(nombre='Horno', descripcion='Horno', precio=199, promocion=True)
+
+    def _contenido(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_feed_csv_por_bloques(self):
+        with self.assertNumQueries(3):
+            # Validadores + un bloque con filas + el bloque vacío final
+            response = self.client.get(reverse('product_feed', args=['csv']))
+            filas = list(csv.reader(StringIO(self._contenido(response).decode())))
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(filas[0][:5], ['id', 'sku', 'nombre', 'descripcion', 'precio'])
+        self.assertEqual(filas[1][1:5], ['NV-1', 'Nevera "Combi"', 'Dos puertas, no frost', '699.00'])
+        self.assertEqual(filas[1][5], f'http://testserver/product/{self.nevera.id}/')
+        self.assertEqual(filas[1][-2:], ['1', '0'])
+        self.assertEqual(len(filas), 3)
+
+    def test_feed_csv_vacio(self):
+        from . import feed
+        Product.objects.all().delete()
+        response = self.client.get(reverse('product_feed', args=['csv']))
+        filas = list(csv.reader(StringIO(self._contenido(response).decode())))
+        self.assertEqual(filas, [list(feed.COLUMNS)])
+
+    def test_feed_jsonl_gzip(self):
+        url = reverse('product_feed', args=['jsonl'])
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        lineas = gzip.decompress(self._contenido(response)).decode().splitlines()
+        self.assertEqual([json.loads(linea)['nombre'] for linea in lineas], ['Nevera "Combi"', 'Horno'])
+        self.assertIs(json.loads(lineas[1])['promocion'], True)
+
+        # La ETag cambia con la codificación y con la versión del catálogo
+        plano = self.client.get(url)
+        self.assertNotEqual(plano['ETag'], response['ETag'])
+        no_modificado = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(no_modificado.status_code, 304)
+        self.horno.delete()
+        self.assertEqual(
+            self.client.get(url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag']).status_code,
+            200)
+
+    def test_feed_por_cursor(self):
+        from . import feed
+        Product.objects.bulk_create([
+            Product(nombre=f'Producto {i}', descripcion='x', precio=i + 1) for i in range(5)])
+        bloques = list(feed.iter_chunks(chunk_size=3))
+        self.assertEqual([len(bloque) for bloque in bloques], [3, 3, 1])
+
+    def test_formato_desconocido(self):
+        self.assertEqual(self.client.get(reverse('product_feed', args=['xml'])).status_code, 404)
+
+
+class RelatedProductsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        crear = lambda nombre, descripcion: Product.objects.create(
+            nombre=nombre, descripcion=descripcion, precio=100)
+        self.combi = crear('Frigorífico combi', 'Frigorífico combi no frost de dos puertas')
+        self.americano = crear('Frigorífico americano', 'Frigorífico no frost con dispensador de agua')
+        self.lavadora = crear('Lavadora carga frontal', 'Lavadora de 9 kg y 1400 revoluciones')
+        self.secadora = crear('Secadora bomba de calor', 'Secadora de 9 kg para ropa delicada')
+        self.microondas = crear('Microondas con grill', 'Microondas de 20 litros')
+
+    def _vecinos(self, producto):
+        return list(RelatedProduct.objects.filter(product=producto).order_by('rank')
+                    .values_list('related_id', flat=True))
+
+    def test_vecinos_por_similitud(self):
+        stats = related.compute(full=True)
+        self.assertEqual(stats.computed, 5)
+        self.assertEqual(self._vecinos(self.combi)[0], self.americano.id)
+        self.assertEqual(self._vecinos(self.lavadora)[0], self.secadora.id)
+        self.assertNotIn(self.microondas.id, self._vecinos(self.combi))
+
+    def test_recalculo_incremental(self):
+        related.compute(full=True)
+        calculados = dict(RelatedProduct.objects.values_list('product_id', 'calculado'))
+        self.microondas.nombre = 'Frigorífico combi compacto'
+        self.microondas.descripcion = 'Frigorífico combi no frost'
+        self.microondas.save()
+
+        out = StringIO()
+        call_command('compute_related_products', stdout=out)
+        self.assertIn('de 5 productos recalculados', out.getvalue())
+        self.assertIn(self.microondas.id, self._vecinos(self.combi))
+        self.assertEqual(self._vecinos(self.microondas)[0], self.combi.id)
+        # Las listas que no dependen del producto modificado no se reescriben
+        self.assertEqual(RelatedProduct.objects.filter(product=self.lavadora).first().calculado,
+                         calculados[self.lavadora.id])
+
+    def test_detalle_con_relacionados(self):
+        related.compute(full=True)
+        with self.assertNumQueries(3):
+            # Validadores, producto y relacionados
+            response = self.client.get(reverse('product_detail', args=[self.combi.id]))
+        self.assertContains(response, 'Productos relacionados')
+        self.assertEqual(response.context['relacionados'][0], self.americano)
+
+    @override_settings(CATALOG_SNAPSHOT_ENABLED=True)
+    def test_detalle_con_relacionados_desde_instantanea(self):
+        catalog_snapshot.reset()
+        self.client.get(reverse('home'))
+        # La instantánea ya cargada recoge las listas nuevas al refrescarse
+        related.compute(full=True)
+        self.client.get(reverse('home'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('product_detail', args=[self.lavadora.id]))
+        self.assertEqual(response.context['relacionados'][0].id, self.secadora.id)
+        catalog_snapshot.reset()
+
+
+@override_settings(AUTOCOMPLETE_BACKGROUND_REFRESH=False, AUTOCOMPLETE_LIMIT=3)
+class AutocompleteTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        autocomplete.reset()
+        self.client = Client()
+        self.url = reverse('autocomplete')
+        self.combi = Product.objects.create(nombre='Frigorífico Combi', descripcion='x', precio=699)
+        self.americano = Product.objects.create(nombre='Frigorífico americano', descripcion='x', precio=1299)
+        self.lavadora = Product.objects.create(nombre='Lavadora carga frontal', descripcion='x', precio=399)
+
+    def tearDown(self):
+        autocomplete.reset()
+
+    def _nombres(self, q, **params):
+        response = self.client.get(self.url, {'q': q, **params})
+        return [r['nombre'] for r in response.json()['results']]
+
+    def test_prefijo_sin_tildes_ni_mayusculas(self):
+        self.assertEqual(set(self._nombres('frigori')), {'Frigorífico Combi', 'Frigorífico americano'})
+        self.assertEqual(self._nombres('FRIGORÍFICO C'), ['Frigorífico Combi'])
+        # Cualquier palabra del nombre, no solo la primera
+        self.assertEqual(self._nombres('comb'), ['Frigorífico Combi'])
+        self.assertEqual(self._nombres(''), [])
+        self.assertEqual(self._nombres('xyz'), [])
+
+    def test_palabras_al_final_de_nombres_largos(self):
+        nombre = 'Frigorífico americano de dos puertas con dispensador de agua y hielo Samsung Bespoke'
+        Product.objects.create(nombre=nombre, descripcion='x', precio=2199)
+        self.assertGreater(len(nombre), autocomplete.MAX_QUERY_LENGTH)
+        self.assertEqual(self._nombres('samsung'), [nombre])
+        self.assertEqual(self._nombres('bespoke'), [nombre])
+
+    def test_orden_por_popularidad(self):
+        user = User.objects.create_user(username='cliente', password='x')
+        CartItem.objects.create(user=user, product=self.americano, quantity=3)
+        self.assertEqual(self._nombres('frig'), ['Frigorífico americano', 'Frigorífico Combi'])
+        self.assertEqual(self._nombres('frig', limit=1), ['Frigorífico americano'])
+
+    def test_se_actualiza_con_el_catalogo(self):
+        self.assertEqual(self._nombres('lava'), ['Lavadora carga frontal'])
+        Product.objects.create(nombre='Lavavajillas', descripcion='x', precio=499)
+        self.assertEqual(self._nombres('lavav'), ['Lavavajillas'])
+        with self.assertNumQueries(0):
+            self.client.get(self.url, {'q': 'lav'})
+
+    def test_prefijos_precalculados(self):
+        rows = [(pk, f'{nombre} {pk}', Decimal(1), pk % 7)
+                for pk, nombre in enumerate(['Horno', 'Horno pirolítico', 'Hornillo', 'Hervidor'] * 30)]
+        with mock.patch.object(autocomplete, 'SCAN_LIMIT', 4):
+            index = autocomplete.AutocompleteIndex(rows, 5)
+        self.assertIn('hor', index.top)
+        for query in ('h', 'hor', 'horno', 'horno p', 'hornil', 'he', '1'):
+            nombres = {row: ' ' + autocomplete.normalize_name(row[1]) for row in rows}
+            esperado = sorted((row for row in rows if ' ' + query in nombres[row]),
+                              key=lambda row: (-row[3], len(row[1]), row[0]))[:5]
+            self.assertEqual(index.search(query), esperado, query)
@@ -0,0 +1,23 @@
+"""Normalización de texto compartida por la búsqueda de productos."""
+import re
+import unicodedata
+
+_WORD = re.compile(r'\w+')
+
+# Palabras demasiado frecuentes para distinguir un producto de otro
+STOPWORDS = frozenset('''
+    a al con de del el en es la las lo los o para por que se sin su sus un una y
+'''.split())
+
+
+def normalizar(texto):
+    """Minúsculas y sin tildes: 'Frigorífico Combi' -> 'frigorifico combi'."""
+    texto = texto.casefold()
+    if texto.isascii():
+        return texto
+    descompuesto = unicodedata.normalize('NFKD', texto)
+    return ''.join(c for c in descompuesto if not unicodedata.combining(c))
+
+
+def tokens(texto):
+    return [t for t in _WORD.findall(normalizar(texto)) if len(t) > 1 and t not in STOPWORDS]
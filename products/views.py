@@ -1,15 +1,209 @@
+from django.conf import settings
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404
+from django.urls import reverse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from . import autocomplete as catalog_autocomplete
+from . import facets
+from . import feed as catalog_feed
+from . import search as catalog_search
+from . import snapshot as catalog_snapshot
+from .cache import cache_anonymous_page
+from .conditional import catalog_validators, conditional_page, product_validators
 from .models import Product
+from .pagination import ORDER_PRECIO, keyset_page
 
+# Columnas que necesitan las tarjetas de los listados
+CARD_FIELDS = ('id', 'nombre', 'descripcion_corta', 'precio', 'imagen', 'imagen_derivados')
+SEARCH_LIMIT = 20
+SEARCH_MAX_LIMIT = 50
+RELATED_LIMIT = 4
+
+
+def _page_url(request, param, cursor):
+    query = request.GET.copy()
+    query[param] = cursor
+    return f'?{query.urlencode()}'
+
+
+def _toggle_url(request, param, value):
+    """URL del listado con ``param`` activado o desactivado y sin cursor."""
+    query = request.GET.copy()
+    query.pop('cursor', None)
+    if query.get(param) == str(value):
+        query.pop(param)
+    else:
+        query[param] = value
+    return f'?{query.urlencode()}'
+
+
+@conditional_page(catalog_validators)
+@cache_anonymous_page
 def home(request):
-    productos_destacados = Product.objects.filter(destacado=True)
-    promociones = Product.objects.filter(promocion=True)
+    size = settings.CATALOG_PAGE_SIZE
+    snapshot = catalog_snapshot.get_snapshot()
+    if snapshot is not None:
+        productos_destacados = snapshot.page('destacados', request.GET.get('destacados'), size)
+        promociones = snapshot.page('promociones', request.GET.get('promociones'), size)
+    else:
+        productos = Product.objects.only(*CARD_FIELDS)
+        productos_destacados = keyset_page(
+            productos.filter(destacado=True), request.GET.get('destacados'), size)
+        promociones = keyset_page(
+            productos.filter(promocion=True), request.GET.get('promociones'), size)
     context = {
         'productos_destacados': productos_destacados,
         'promociones': promociones,
     }
+    if productos_destacados.has_next:
+        context['destacados_next_url'] = _page_url(
+            request, 'destacados', productos_destacados.next_cursor)
+    if promociones.has_next:
+        context['promociones_next_url'] = _page_url(
+            request, 'promociones', promociones.next_cursor)
     return render(request, 'products/home.html', context)
 
+
+def _catalog_filters(request):
+    filtros = {
+        'precio': None,
+        'destacado': request.GET.get('destacado') == '1',
+        'promocion': request.GET.get('promocion') == '1',
+    }
+    try:
+        banda = int(request.GET.get('precio', ''))
+    except ValueError:
+        banda = None
+    if banda is not None and 0 <= banda < len(facets.PRICE_BANDS):
+        filtros['precio'] = banda
+    return filtros
+
+
+@conditional_page(catalog_validators)
+def catalog(request):
+    filtros = _catalog_filters(request)
+    productos = Product.objects.only(*CARD_FIELDS)
+    if filtros['precio'] is not None:
+        productos = productos.filter(**facets.band_filter(filtros['precio']))
+    if filtros['destacado']:
+        productos = productos.filter(destacado=True)
+    if filtros['promocion']:
+        productos = productos.filter(promocion=True)
+    pagina = keyset_page(
+        productos, request.GET.get('cursor'), settings.CATALOG_PAGE_SIZE, order=ORDER_PRECIO)
+
+    recuentos = facets.facet_counts(filtros)
+    for banda in recuentos['precio']:
+        banda['activa'] = filtros['precio'] == banda['banda']
+        banda['url'] = _toggle_url(request, 'precio', banda['banda'])
+    context = {
+        'productos': pagina,
+        'filtros': filtros,
+        'facetas': recuentos,
+        'destacado_url': _toggle_url(request, 'destacado', 1),
+        'promocion_url': _toggle_url(request, 'promocion', 1),
+    }
+    if pagina.has_next:
+        context['next_url'] = _page_url(request, 'cursor', pagina.next_cursor)
+    return render(request, 'products/catalog.html', context)
+
+
+@conditional_page(product_validators)
 def product_detail(request, product_id):
-    product = get_object_or_404(Product, id=product_id)
-    return render(request, 'products/product_detail.html', {'product': product})
+    snapshot = catalog_snapshot.get_snapshot()
+    if snapshot is not None:
+        product = snapshot.get(product_id)
+        if product is None:
+            raise Http404('No existe el producto.')
+    else:
+        product = get_object_or_404(Product, id=product_id)
+    return render(request, 'products/product_detail.html', {
+        'product': product,
+        'relacionados': _related_products(snapshot, product_id),
+    })
+
+
+def _related_products(snapshot, product_id):
+    # Vecinos precalculados por compute_related_products (products.related)
+    if snapshot is not None:
+        return snapshot.related_products(product_id, RELATED_LIMIT)
+    return list(Product.objects.only(*CARD_FIELDS)
+                .filter(relacionado_en__product_id=product_id)
+                .order_by('relacionado_en__rank')[:RELATED_LIMIT])
+
+
+def _search_results(request):
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = min(int(request.GET.get('limit', SEARCH_LIMIT)), SEARCH_MAX_LIMIT)
+    except ValueError:
+        limit = SEARCH_LIMIT
+    hits = catalog_search.search(query, limit=max(limit, 1)) if query else []
+    productos = Product.objects.only(*CARD_FIELDS).in_bulk([hit.id for hit in hits])
+    # Los productos borrados entre la consulta al índice y la carga se omiten
+    return query, [(hit, productos[hit.id]) for hit in hits if hit.id in productos]
+
+
+def search(request):
+    query, resultados = _search_results(request)
+    return render(request, 'products/search.html', {
+        'query': query,
+        'resultados': resultados,
+    })
+
+
+@conditional_page(catalog_validators, per_user=False)
+def search_json(request):
+    query, resultados = _search_results(request)
+    return JsonResponse({
+        'query': query,
+        'results': [
+            {
+                'id': producto.id,
+                'nombre': producto.nombre,
+                'nombre_resaltado': hit.nombre,
+                'fragmento': hit.fragmento,
+                'precio': str(producto.precio),
+                'url': reverse('product_detail', args=[producto.id]),
+                'imagen': producto.imagen.url if producto.imagen else None,
+            }
+            for hit, producto in resultados
+        ],
+    })
+
+
+@conditional_page(catalog_feed.feed_validators, per_user=False)
+def product_feed(request, formato):
+    if formato not in catalog_feed.CONTENT_TYPES:
+        raise Http404('Formato de feed no soportado.')
+    gzip = catalog_feed.accepts_gzip(request)
+    response = StreamingHttpResponse(
+        catalog_feed.stream(request, formato, gzip=gzip),
+        content_type=catalog_feed.CONTENT_TYPES[formato],
+    )
+    if gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+def autocomplete(request):
+    try:
+        limit = int(request.GET.get('limit', settings.AUTOCOMPLETE_LIMIT))
+    except ValueError:
+        limit = settings.AUTOCOMPLETE_LIMIT
+    resultados = catalog_autocomplete.get_index().search(request.GET.get('q', ''), max(limit, 1))
+    response = JsonResponse({
+        'results': [
+            {
+                'id': pk,
+                'nombre': nombre,
+                'precio': str(precio),
+                'url': reverse('product_detail', args=[pk]),
+            }
+            for pk, nombre, precio, popularidad in resultados
+        ],
+    })
+    # Respuestas pequeñas y muy repetidas: se dejan cachear un minuto
+    patch_cache_control(response, public=True, max_age=60)
+    return response
@@ -0,0 +1,44 @@
+// Sugerencias del buscador de la barra de navegación (api/autocomplete/)
+document.addEventListener('DOMContentLoaded', function() {
+    var input = document.querySelector('input[data-autocomplete-url]');
+    if (!input) {
+        return;
+    }
+    var lista = document.getElementById(input.getAttribute('list'));
+    var urls = {};
+    var timer = null;
+    var ultima = '';
+
+    input.addEventListener('input', function() {
+        clearTimeout(timer);
+        timer = setTimeout(function() {
+            var q = input.value.trim();
+            if (q.length < 2 || q === ultima) {
+                return;
+            }
+            ultima = q;
+            fetch(input.dataset.autocompleteUrl + '?q=' + encodeURIComponent(q))
+                .then(function(response) { return response.json(); })
+                .then(function(data) {
+                    if (q !== ultima) {
+                        return;
+                    }
+                    lista.innerHTML = '';
+                    data.results.forEach(function(producto) {
+                        var opcion = document.createElement('option');
+                        opcion.value = producto.nombre;
+                        urls[producto.nombre] = producto.url;
+                        lista.appendChild(opcion);
+                    });
+                })
+                .catch(function() {});
+        }, 120);
+    });
+
+    // Al elegir una sugerencia se va directamente a la ficha del producto
+    input.addEventListener('change', function() {
+        if (urls[input.value]) {
+            window.location.href = urls[input.value];
+        }
+    });
+});
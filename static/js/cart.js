@@ -0,0 +1,123 @@
+// Carrito sin recargar la página (api/cart/...). Sin JavaScript los botones
+// de "Añadir al carrito" siguen enviando el formulario a la vista clásica.
+document.addEventListener('DOMContentLoaded', function() {
+    function enviar(url, token, body, json) {
+        var headers = {'X-CSRFToken': token, 'Accept': 'application/json'};
+        if (json) {
+            headers['Content-Type'] = 'application/json';
+        }
+        return fetch(url, {method: 'POST', headers: headers, body: body, credentials: 'same-origin'})
+            .then(function(response) {
+                return response.json().then(function(data) {
+                    if (!response.ok) {
+                        throw new Error(data.error || response.statusText);
+                    }
+                    return data;
+                });
+            });
+    }
+
+    function actualizarContador(count) {
+        var enlace = document.querySelector('[data-cart-badge]');
+        if (!enlace) {
+            return;
+        }
+        var badge = enlace.querySelector('.badge');
+        if (count > 0 && !badge) {
+            badge = document.createElement('span');
+            badge.className = 'badge bg-danger';
+            enlace.appendChild(badge);
+        }
+        if (badge) {
+            if (count > 0) {
+                badge.textContent = count;
+            } else {
+                badge.remove();
+            }
+        }
+    }
+
+    // Botones "Añadir al carrito" del catálogo y de la ficha de producto
+    document.querySelectorAll('form[data-cart-api]').forEach(function(form) {
+        form.addEventListener('submit', function(e) {
+            e.preventDefault();
+            var boton = form.querySelector('button[type="submit"]');
+            var texto = boton.innerHTML;
+            boton.disabled = true;
+            enviar(form.dataset.cartApi, form.querySelector('[name="csrfmiddlewaretoken"]').value,
+                   new FormData(form))
+                .then(function(data) {
+                    actualizarContador(data.count);
+                    boton.innerHTML = '<i class="fas fa-check me-2"></i>Añadido';
+                    setTimeout(function() {
+                        boton.innerHTML = texto;
+                        boton.disabled = false;
+                    }, 1200);
+                })
+                .catch(function() {
+                    // Si la API falla se recurre al envío normal
+                    form.submit();
+                });
+        });
+    });
+
+    // Página del carrito: cambio de cantidades y eliminación de líneas
+    var tabla = document.querySelector('[data-cart-update-url]');
+    if (!tabla) {
+        return;
+    }
+    var token = tabla.dataset.csrf;
+
+    function aplicar(data) {
+        if (data.count === 0) {
+            window.location.reload();
+            return;
+        }
+        data.lines.forEach(function(line) {
+            var fila = tabla.querySelector('tr[data-product="' + line.product_id + '"]');
+            if (!fila) {
+                return;
+            }
+            if (line.quantity === 0) {
+                fila.remove();
+                return;
+            }
+            fila.querySelector('input[name="quantity"]').value = line.quantity;
+            fila.querySelector('[data-line-total]').textContent = '€' + line.line_total;
+        });
+        tabla.querySelector('[data-cart-total]').textContent = '€' + data.total;
+        actualizarContador(data.count);
+    }
+
+    function error(e) {
+        alert('No se pudo actualizar el carrito: ' + e.message);
+    }
+
+    tabla.querySelectorAll('[data-cart-remove]').forEach(function(boton) {
+        boton.addEventListener('click', function() {
+            enviar(boton.dataset.cartRemove, token).then(aplicar).catch(error);
+        });
+    });
+
+    // Todas las cantidades modificadas van en una sola petición
+    var actualizar = document.getElementById('cart-update-button');
+    actualizar.addEventListener('click', function() {
+        var lines = {};
+        tabla.querySelectorAll('input[name="quantity"]').forEach(function(input) {
+            if (input.value !== input.defaultValue) {
+                lines[input.closest('tr').dataset.product] = parseInt(input.value, 10) || 0;
+            }
+        });
+        if (!Object.keys(lines).length) {
+            return;
+        }
+        enviar(tabla.dataset.cartUpdateUrl, token, JSON.stringify({lines: lines}), true)
+            .then(function(data) {
+                tabla.querySelectorAll('input[name="quantity"]').forEach(function(input) {
+                    input.defaultValue = input.value;
+                });
+                aplicar(data);
+            })
+            .catch(error);
+    });
+});
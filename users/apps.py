@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class UsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'users'
+
+    def ready(self):
+        from . import signals
+
+        # Una vez por migrate, no una vez por aplicación instalada
+        post_migrate.connect(signals.create_user_profiles, sender=self)
@@ -13,14 +13,38 @@ class UserProfile(models.Model):
     codigo_postal_facturacion = models.CharField(max_length=10, blank=True)
     telefono = models.CharField(max_length=15, blank=True)
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._guardado = self._valores()
+
     def __str__(self):
         return f"Perfil de {self.user.username}"
 
+    def _valores(self):
+        # Solo los campos cargados: leer uno diferido haría otra consulta
+        return {f.attname: self.__dict__[f.attname] for f in self._meta.concrete_fields
+                if f.attname in self.__dict__}
+
+    def get_dirty_fields(self):
+        """Campos cambiados desde que se cargó o guardó el perfil."""
+        return [attname for attname, valor in self._valores().items()
+                if attname not in self._guardado or self._guardado[attname] != valor]
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._guardado = self._valores()
+
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     if created:
         UserProfile.objects.create(user=instance)
 
 @receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    instance.userprofile.save()
+def save_user_profile(sender, instance, created, **kwargs):
+    # Solo se guarda un perfil ya cargado y con cambios: el login, que
+    # actualiza last_login, no consulta ni escribe el perfil
+    if created or not User.userprofile.related.is_cached(instance):
+        return
+    cambios = instance.userprofile.get_dirty_fields()
+    if cambios:
+        instance.userprofile.save(update_fields=cambios)
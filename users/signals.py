@@ -0,0 +1,34 @@
+from django.apps import apps as global_apps
+from django.db.models import Exists, OuterRef
+
+# Perfiles por INSERT al crear los que faltan tras ``migrate``
+PROFILE_BATCH_SIZE = 1000
+
+
+def create_user_profiles(sender, app_config=None, using='default', apps=global_apps, **kwargs):
+    """
+    Crea tras ``migrate`` los perfiles que falten (usuarios anteriores a
+    ``UserProfile`` o creados sin señales). Una consulta con NOT EXISTS
+    encuentra cada lote de usuarios sin perfil y se inserta con
+    ``bulk_create``; los que cree a la vez otro proceso se ignoran.
+    """
+    try:
+        User = apps.get_model('auth', 'User')
+        UserProfile = apps.get_model('users', 'UserProfile')
+    except LookupError:
+        # Las migraciones de users todavía no están aplicadas
+        return
+    sin_perfil = (
+        User.objects.using(using)
+        .filter(~Exists(UserProfile.objects.using(using).filter(user_id=OuterRef('pk'))))
+        .order_by('pk')
+        .values_list('pk', flat=True)
+    )
+    ultimo = 0
+    while True:
+        lote = list(sin_perfil.filter(pk__gt=ultimo)[:PROFILE_BATCH_SIZE])
+        if not lote:
+            break
+        UserProfile.objects.using(using).bulk_create(
+            [UserProfile(user_id=user_id) for user_id in lote], ignore_conflicts=True)
+        ultimo = lote[-1]
@@ -1,6 +1,15 @@
+from datetime import timedelta
+from io import StringIO
+from django.contrib.sessions.models import Session
+from django.core.management import call_command
+from django.core.management.sql import emit_post_migrate_signal
+from django.utils import timezone
+from django.db import connection
 from django.test import TestCase, Client
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.contrib.auth.models import User
+from products.models import Product
 from .models import UserProfile
 from .forms import LoginForm, RegistroForm, UserUpdateForm, ProfileUpdateForm
 
@@ -32,6 +41,29 @@ class UserProfileModelTest(TestCase):
         self.assertEqual(self.profile.codigo_postal_envio, "12345")
         self.assertEqual(self.profile.telefono, "666777888")
     
+    def test_perfiles_creados_tras_migrate(self):
+        # bulk_create no envía post_save: usuarios sin perfil
+        User.objects.bulk_create([User(username=f'sin-perfil-{i}') for i in range(3)])
+        with CaptureQueriesContext(connection) as queries:
+            emit_post_migrate_signal(verbosity=0, interactive=False, db='default')
+        self.assertEqual(UserProfile.objects.count(), 4)
+        # Una vez por migrate: lote de usuarios sin perfil, INSERT y lote vacío
+        perfiles = [q for q in queries.captured_queries if 'users_userprofile' in q['sql']]
+        self.assertEqual(len(perfiles), 3)
+
+    def test_perfil_solo_se_guarda_con_cambios(self):
+        user = User.objects.select_related('userprofile').get(pk=self.user.pk)
+        with CaptureQueriesContext(connection) as queries:
+            user.save()
+        self.assertFalse([q for q in queries.captured_queries if 'users_userprofile' in q['sql']])
+        user.userprofile.telefono = '600111222'
+        with CaptureQueriesContext(connection) as queries:
+            user.save()
+        updates = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('UPDATE "users_userprofile"')]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('direccion_envio', updates[0])
+        self.assertEqual(UserProfile.objects.get(user=self.user).telefono, '600111222')
+
     def test_profile_str(self):
         expected_str = f"Perfil de {self.user.username}"
         self.assertEqual(str(self.profile), expected_str)
@@ -88,7 +120,13 @@ class UserViewsTest(TestCase):
         }
         response = self.client.post(self.login_url, form_data)
         self.assertRedirects(response, reverse('home'))
-    
+
+    def test_login_sin_consultas_al_perfil(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.login_url, {'username': 'testuser', 'password': 'testpassword'})
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+        self.assertFalse([q for q in queries.captured_queries if 'users_userprofile' in q['sql']])
+
     def test_login_view_post_invalid(self):
         form_data = {
             'username': 'testuser',
@@ -135,6 +173,21 @@ class UserViewsTest(TestCase):
         user = User.objects.get(username='newuser')
         self.assertTrue(UserProfile.objects.filter(user=user).exists())
     
+    def test_usuario_y_perfil_en_una_consulta(self):
+        self.client.login(username='testuser', password='testpassword')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.profile_url)
+        self.assertEqual(response.status_code, 200)
+        # El perfil llega con el JOIN de la consulta del usuario
+        self.assertFalse([q for q in queries.captured_queries if 'FROM "users_userprofile"' in q['sql']])
+        self.assertTrue([q for q in queries.captured_queries if 'JOIN "users_userprofile"' in q['sql']])
+
+    def test_sesion_iniciada_con_model_backend(self):
+        # Sesiones anteriores al backend con perfil: siguen siendo válidas
+        self.client.force_login(self.user, backend='django.contrib.auth.backends.ModelBackend')
+        response = self.client.get(self.profile_url)
+        self.assertEqual(response.status_code, 200)
+
     def test_profile_view_get(self):
         self.client.login(username='testuser', password='testpassword')
         response = self.client.get(self.profile_url)
@@ -165,3 +218,29 @@ class UserViewsTest(TestCase):
         # Verificar que los datos se actualizaron
         self.assertEqual(self.user.username, 'testuser_updated')
         self.assertEqual(self.user.email, 'updated@example.com')
+
+
+class SessionTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.product = Product.objects.create(nombre='Horno', descripcion='x', precio=199)
+        self.client.login(username='testuser', password='testpassword')
+
+    def test_mensajes_sin_escribir_la_sesion(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('add_to_cart', args=[self.product.pk]), follow=True)
+        self.assertContains(response, 'Producto añadido al carrito.')
+        # El mensaje va en una cookie: ni al añadirlo ni al mostrarlo se escribe la sesión
+        escrituras = [q['sql'] for q in queries.captured_queries
+                      if 'django_session' in q['sql'] and not q['sql'].startswith('SELECT')]
+        self.assertEqual(escrituras, [])
+
+    def test_purge_sessions(self):
+        caducada = timezone.now() - timedelta(days=1)
+        Session.objects.bulk_create([
+            Session(session_key=f'caducada{i}', session_data='', expire_date=caducada) for i in range(5)])
+        out = StringIO()
+        call_command('purge_sessions', batch_size=2, stdout=out)
+        self.assertIn('5 sesiones caducadas borradas', out.getvalue())
+        # La sesión del cliente no ha caducado
+        self.assertEqual(Session.objects.count(), 1)
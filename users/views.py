@@ -2,6 +2,7 @@ from django.shortcuts import render, redirect
 from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from cart.cart import merge_session_cart
 from .forms import LoginForm, RegistroForm, UserUpdateForm, ProfileUpdateForm
 
 def iniciar_sesion(request):
@@ -13,6 +14,7 @@ def iniciar_sesion(request):
         if form.is_valid():
             user = form.get_user()
             login(request, user)
+            merge_session_cart(request, user)
             messages.success(request, f'¡Bienvenido {user.username}!')
             return redirect('home')
         else:
@@ -35,7 +37,9 @@ def registro(request):
         form = RegistroForm(request.POST)
         if form.is_valid():
             user = form.save()
-            login(request, user)
+            # Con varios backends hay que indicar con cuál queda la sesión
+            login(request, user, backend='users.backends.ProfileModelBackend')
+            merge_session_cart(request, user)
             messages.success(request, '¡Registro exitoso! Bienvenido.')
             return redirect('home')
     else:
@@ -49,8 +53,10 @@ def profile(request):
         profile_form = ProfileUpdateForm(request.POST, instance=request.user.userprofile)
         
         if user_form.is_valid() and profile_form.is_valid():
-            user_form.save()
+            # Primero el perfil: así al guardar el usuario ya no tiene cambios
+            # pendientes y no se vuelve a escribir
             profile_form.save()
+            user_form.save()
             messages.success(request, 'Tu perfil ha sido actualizado.')
             return redirect('profile')
     else: